@@ -1,4 +1,13 @@
 
-from .approver import main as approve_openshift_csrs
-
 __version__ = '0.1.2'
+
+
+# The approver is only imported when it is run, importing a subpackage
+# like openshift_csr_approver.metrics should not pull in the kubernetes
+# client.
+def main() -> None:
+    from openshift_csr_approver.approver import main as approver_main
+    approver_main()
+
+
+approve_openshift_csrs = main
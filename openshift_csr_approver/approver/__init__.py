@@ -21,26 +21,74 @@
 # SPDX-FileCopyrightText: 2020 Adfinis SyGroup AG
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, \
+    List, Mapping, NamedTuple, Optional, Set, Tuple, Union, TYPE_CHECKING
+from typing import Counter as TypingCounter
 
 import os
 import sys
+import time
 import argparse
 import json
+import enum
+import logging
+import math
 import base64
-from datetime import datetime
+import ipaddress
+import socket
+import threading
+import itertools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 import yaml
 import kubernetes.client as k8s
-import OpenSSL
+import kubernetes.watch as k8s_watch
+from kubernetes.client.rest import ApiException
+from urllib3.connection import HTTPConnection
 
-from openshift_csr_approver.logging import logger, PrettyFormatter
+if TYPE_CHECKING:
+    # Imported lazily in parse_csr, CSRs that are already decided or
+    # dropped by the selector never need it
+    import OpenSSL.crypto
 
+from openshift_csr_approver import metrics
+from openshift_csr_approver.cache import CsrCache
+from openshift_csr_approver import store as csr_store
+from openshift_csr_approver.store import CsrStore
+from openshift_csr_approver.records import RecordCondition, RecordMeta, \
+    parse_csr_list
+from openshift_csr_approver.election import KubernetesLeaseStore, \
+    LeaderElector, ShardMembership, keep_renewing, shard_owner
+from openshift_csr_approver.logging import logger, PrettyFormatter, \
+    configure as configure_logging
 
-def create_approval_patch(csr: k8s.V1beta1CertificateSigningRequest,
-                          date: datetime) -> None:
+
+def _condition_model(condition: Any) \
+        -> k8s.V1beta1CertificateSigningRequestCondition:
+    # The conditions of records are converted to models, which the API
+    # client knows how to serialize
+    if not isinstance(condition, RecordCondition):
+        return condition
+    return k8s.V1beta1CertificateSigningRequestCondition(
+        type=condition.type,
+        reason=condition.reason,
+        message=condition.message,
+        last_update_time=condition.last_update_time
+    )
+
+
+def create_approval_body(csr: k8s.V1beta1CertificateSigningRequest,
+                         date: datetime) \
+        -> k8s.V1beta1CertificateSigningRequest:
     # Approving CSRs works by appending a condition of type
-    # "Approved" to the status.
+    # "Approved" to the status.  The API server takes the conditions
+    # from the body of an approval, and API servers before 1.21 update
+    # the metadata (e.g. labels, annotations and owner references) from
+    # it as well, so the CSR's metadata is sent unchanged, including the
+    # resource version the conditions are based on.  Only the spec,
+    # which holds the request and can't be changed, is left out.
     message = f'This CSR for node {csr.metadata.name} was approved by openshift-csr-approver'  # noqa E501
     condition = k8s.V1beta1CertificateSigningRequestCondition(
         type='Approved',
@@ -49,9 +97,111 @@ def create_approval_patch(csr: k8s.V1beta1CertificateSigningRequest,
         # Ugly "+ Z" hack to make the kubernetes API accept the UTC timestamp
         last_update_time=date.isoformat(timespec='seconds') + 'Z'
     )
-    if csr.status.conditions is None:
-        csr.status.conditions = []
-    csr.status.conditions.append(condition)
+    conditions = [
+        _condition_model(c) for c in csr.status.conditions or []
+    ] + [condition]
+    metadata = csr.metadata
+    if isinstance(metadata, RecordMeta):
+        # As received in the list, serialized as is
+        metadata = metadata.raw
+    return k8s.V1beta1CertificateSigningRequest(
+        api_version=csr.api_version,
+        kind=csr.kind,
+        metadata=metadata,
+        status=k8s.V1beta1CertificateSigningRequestStatus(
+            conditions=conditions
+        )
+    )
+
+
+class ApprovalFailed(Exception):
+    """Raised in watch mode if approvals failed, e.g. with 429 or 5xx
+    responses or timeouts, so that the CSRs are listed and approved again
+    after a backoff."""
+
+
+class ApprovalSkipped(Exception):
+    """Raised if a CSR no longer passes the checks when it is read again
+    after a conflicting update."""
+
+
+def approve_csr(api: k8s.CertificatesV1beta1Api,
+                csr: k8s.V1beta1CertificateSigningRequest,
+                date: datetime,
+                node_csr_spec: Optional['NodeCsrSpec'] = None,
+                retries: int = 3,
+                backoff: float = 0.5) -> Optional[float]:
+    # Returns the time from the creation of the CSR until its approval.
+    #
+    # The approval fails with a conflict if the CSR was modified since
+    # it was read.  Given the spec, the CSR is then read again, checked
+    # again and the approval retried with exponential backoff.
+    name = csr.metadata.name
+    attempt = 0
+    while True:
+        try:
+            with metrics.APPROVE_DURATION.time():
+                api.replace_certificate_signing_request_approval(
+                    name, body=create_approval_body(csr, date))
+            break
+        except ApiException as e:
+            if e.status != 409 or node_csr_spec is None \
+                    or attempt >= retries:
+                raise
+        metrics.APPROVAL_CONFLICTS.inc()
+        time.sleep(backoff * 2 ** attempt)
+        attempt += 1
+        csr = api.read_certificate_signing_request(name)
+        decision = decide_csr(csr, node_csr_spec)
+        if not decision.approve:
+            raise ApprovalSkipped(f'{name}: {decision}')
+    metrics.CSRS_APPROVED.inc()
+    created = csr.metadata.creation_timestamp
+    if created is None:
+        return None
+    time_to_approval = (datetime.now(timezone.utc) - created).total_seconds()
+    metrics.TIME_TO_APPROVAL.observe(time_to_approval)
+    return time_to_approval
+
+
+class PooledApiClient(k8s.ApiClient):
+    """ApiClient applying default timeouts to all requests.
+
+    The client is meant to be shared by all API calls of the process,
+    so that connections in its pool are reused across reconcile loops
+    instead of being re-established.
+    """
+
+    def __init__(self, configuration: k8s.Configuration,
+                 request_timeout: Optional[
+                     Tuple[Optional[float], Optional[float]]] = None) \
+            -> None:
+        super().__init__(configuration)
+        self.request_timeout = request_timeout
+
+    def call_api(self, resource_path: str, method: str,
+                 path_params: Any = None, query_params: Any = None,
+                 *args: Any, **kwargs: Any) -> Any:
+        # Watch requests are expected to stay idle for long periods and
+        # are not subject to the read timeout
+        watch = query_params is not None and ('watch', True) in query_params
+        if kwargs.get('_request_timeout') is None and not watch:
+            kwargs['_request_timeout'] = self.request_timeout
+        return super().call_api(resource_path, method, path_params,
+                                query_params, *args, **kwargs)
+
+
+def connection_stats(client: k8s.ApiClient) -> Tuple[int, int]:
+    # Returns the number of connections opened and the number of
+    # requests that reused an existing connection
+    pools = client.rest_client.pool_manager.pools
+    opened = 0
+    requests = 0
+    for key in pools.keys():
+        pool = pools[key]
+        opened += pool.num_connections
+        requests += pool.num_requests
+    return opened, max(0, requests - opened)
 
 
 def build_k8s_client(args: argparse.Namespace) -> k8s.ApiClient:
@@ -63,6 +213,9 @@ def build_k8s_client(args: argparse.Namespace) -> k8s.ApiClient:
     config.logger_formatter = PrettyFormatter()
     config.debug = False
     config.host = args.endpoint
+    # One connection per concurrent approval, plus one for list and watch
+    config.connection_pool_maxsize = args.pool_size \
+        or max(4, args.concurrency + 1)
 
     if os.path.exists(token_path):
         with open(token_path, 'r') as tf:
@@ -72,15 +225,182 @@ def build_k8s_client(args: argparse.Namespace) -> k8s.ApiClient:
     if os.path.exists(ca_path):
         config.ssl_ca_cert = ca_path
 
-    client = k8s.ApiClient(config)
+    timeout = None
+    if args.connect_timeout > 0 or args.read_timeout > 0:
+        timeout = (args.connect_timeout or None, args.read_timeout or None)
+    client = PooledApiClient(config, timeout)
+
+    if args.keepalive > 0:
+        # Enable TCP keepalive on the pooled connections, so that idle
+        # connections (e.g. a quiet watch) are not silently dropped by
+        # firewalls or load balancers in between
+        socket_options = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            socket_options += [
+                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, args.keepalive),
+                (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, args.keepalive),
+                (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3),
+            ]
+        pool_manager = client.rest_client.pool_manager
+        pool_manager.connection_pool_kw['socket_options'] = socket_options
     return client
 
 
-def parse_node_csr_spec(filepath: str) -> Dict[str, Any]:
-    filename: str = os.path.basename(filepath)
-    with open(filepath, 'r') as cm:
-        spec = yaml.safe_load(cm)
-    node_csr_spec = {}
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+# Tells whether a node of the given name has joined the cluster
+NodeLookup = Callable[[str], bool]
+
+_spec_generations = itertools.count(1)
+
+
+class NodeSpec:
+    """The DNS names and IP addresses a node may request in its CSRs.
+
+    IP addresses are stored as ipaddress objects, so that different
+    notations of the same address (e.g. 2001:db8::10 and
+    2001:db8:0:0:0:0:0:10) compare equal.
+    """
+
+    __slots__ = ('name', 'names', 'ips')
+
+    name: str
+    names: FrozenSet[str]
+    ips: FrozenSet[IPAddress]
+
+    def __init__(self, name: str, names: Iterable[str],
+                 ips: Iterable[IPAddress]) -> None:
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'names', frozenset(names))
+        object.__setattr__(self, 'ips', frozenset(ips))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, NodeSpec):
+            return NotImplemented
+        return (self.name, self.names, self.ips) \
+            == (other.name, other.names, other.ips)
+
+    def __hash__(self) -> int:
+        return hash((self.name, self.names, self.ips))
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Pickled for DecisionPool workers; the default would restore
+        # the slots through the blocked __setattr__
+        return NodeSpec, (self.name, self.names, self.ips)
+
+    def __repr__(self) -> str:
+        names = sorted(self.names)
+        ips = sorted(str(ip) for ip in self.ips)
+        return f'NodeSpec({self.name!r}, names={names}, ips={ips})'
+
+
+class NodeCsrSpec(Mapping[str, NodeSpec]):
+    """Immutable mapping of node names to their NodeSpec.
+
+    With approve_bootstrap, the client CSRs that nodes request through
+    the node bootstrapper when joining the cluster are approved for the
+    nodes of the spec as well, not only their serving CSRs, but only as
+    long as node_exists tells that the node has not joined yet.
+    Otherwise, anyone with the bootstrapper's credentials could obtain
+    client certificates for the nodes of the cluster.
+
+    The shard of a replica holds only the nodes it owns; other_shards
+    names the nodes of the full spec owned by other replicas, whose
+    CSRs are left to them.
+
+    Every spec gets a new generation, so that cached decisions made
+    with another spec are not reused.
+    """
+
+    __slots__ = ('_nodes', 'approve_bootstrap', 'node_exists',
+                 'other_shards', 'generation')
+
+    _nodes: Dict[str, NodeSpec]
+    approve_bootstrap: bool
+    node_exists: Optional[NodeLookup]
+    other_shards: FrozenSet[str]
+    generation: int
+
+    def __init__(self, nodes: Dict[str, NodeSpec],
+                 approve_bootstrap: bool = False,
+                 node_exists: Optional[NodeLookup] = None,
+                 other_shards: Iterable[str] = ()) -> None:
+        if approve_bootstrap and node_exists is None:
+            raise ValueError('Approving client CSRs requires a lookup of existing nodes')  # noqa E501
+        object.__setattr__(self, '_nodes', dict(nodes))
+        object.__setattr__(self, 'approve_bootstrap', approve_bootstrap)
+        object.__setattr__(self, 'node_exists', node_exists)
+        object.__setattr__(self, 'other_shards', frozenset(other_shards))
+        object.__setattr__(self, 'generation', next(_spec_generations))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __getitem__(self, nodename: str) -> NodeSpec:
+        return self._nodes[nodename]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._nodes)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __repr__(self) -> str:
+        return f'NodeCsrSpec({list(self._nodes.values())})'
+
+
+class SpecDiff(NamedTuple):
+    added: FrozenSet[str]
+    removed: FrozenSet[str]
+    changed: FrozenSet[str]
+
+    @property
+    def affected(self) -> FrozenSet[str]:
+        return self.added | self.removed | self.changed
+
+
+def diff_node_csr_specs(old: NodeCsrSpec, new: NodeCsrSpec) -> SpecDiff:
+    old_nodes = set(old)
+    new_nodes = set(new)
+    changed = [
+        nodename for nodename in old_nodes & new_nodes
+        if old[nodename] != new[nodename]
+    ]
+    return SpecDiff(frozenset(new_nodes - old_nodes),
+                    frozenset(old_nodes - new_nodes),
+                    frozenset(changed))
+
+
+def shard_node_csr_spec(node_csr_spec: NodeCsrSpec, members: List[str],
+                        identity: str) -> NodeCsrSpec:
+    # The nodes of the spec that belong to the member identity
+    nodes = {}
+    other_shards = []
+    for nodename, node_spec in node_csr_spec.items():
+        if shard_owner(nodename, members) == identity:
+            nodes[nodename] = node_spec
+        else:
+            other_shards.append(nodename)
+    return NodeCsrSpec(nodes, node_csr_spec.approve_bootstrap,
+                       node_csr_spec.node_exists, other_shards)
+
+
+def compile_node_csr_spec(spec: Any, filename: str = 'spec',
+                          approve_bootstrap: bool = False,
+                          node_exists: Optional[NodeLookup] = None) \
+        -> NodeCsrSpec:
+    nodes = {}
     if not isinstance(spec, dict):
         raise TypeError(f'{filename}: . is not of type dict')
     for nodename, node_spec in spec.items():
@@ -105,137 +425,1315 @@ def parse_node_csr_spec(filepath: str) -> Dict[str, Any]:
         for i, ip in enumerate(node_spec['ips']):
             if not isinstance(ip, str):
                 raise TypeError(f'{filename}: .{nodename}.ips[{i}] is not of type str')  # noqa E501
-            ips.append(ip)
-        node_csr_spec[nodename] = {
-            'names': names,
-            'ips': ips
-        }
-    return node_csr_spec
+            try:
+                ips.append(ipaddress.ip_address(ip))
+            except ValueError:
+                raise ValueError(f'{filename}: .{nodename}.ips[{i}] is not a valid IP address')  # noqa E501
+        nodes[nodename] = NodeSpec(nodename, names, ips)
+    return NodeCsrSpec(nodes, approve_bootstrap, node_exists)
 
 
-def parse_csr(csr: k8s.V1beta1CertificateSigningRequest) \
-        -> OpenSSL.crypto.X509Req:
-    b64 = csr.spec.request
+def parse_node_csr_spec(filepath: str,
+                        approve_bootstrap: bool = False,
+                        node_exists: Optional[NodeLookup] = None) \
+        -> NodeCsrSpec:
+    filename: str = os.path.basename(filepath)
+    with open(filepath, 'r') as cm:
+        spec = yaml.safe_load(cm)
+    return compile_node_csr_spec(spec, filename, approve_bootstrap,
+                                 node_exists)
+
+
+def api_node_exists(api: k8s.CoreV1Api) -> NodeLookup:
+    # Looks up whether a node has joined the cluster, for
+    # NodeCsrSpec.node_exists.  Errors other than a missing node are
+    # raised, so that client CSRs are not approved while in doubt.
+    def node_exists(nodename: str) -> bool:
+        try:
+            api.read_node(nodename)
+        except ApiException as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+    return node_exists
+
+
+def parse_request(b64: str) -> 'OpenSSL.crypto.X509Req':
+    import OpenSSL.crypto
     decoded = base64.b64decode(b64)
     parsed = OpenSSL.crypto.load_certificate_request(
         OpenSSL.crypto.FILETYPE_PEM, decoded)
     return parsed
 
 
-def check_approve_csr(csr: k8s.V1beta1CertificateSigningRequest,
-                      csr_info: OpenSSL.crypto.X509Req,
-                      node_csr_spec: Dict[str, Any]) \
-        -> Tuple[bool, str]:
+def parse_csr(csr: k8s.V1beta1CertificateSigningRequest) \
+        -> 'OpenSSL.crypto.X509Req':
+    return parse_request(csr.spec.request)
+
+
+class SubjectAltNames(NamedTuple):
+    # The SANs of a CSR, by type; other holds SANs of any other type,
+    # rendered for the log
+    dns: Tuple[str, ...]
+    ips: Tuple[IPAddress, ...]
+    other: Tuple[str, ...]
+
+
+class DuplicateExtension(ValueError):
+    # Raised by extract_sans for a request with an X.509 extension, e.g.
+    # subjectAltName, more than once; its arg is the extension's OID
+    pass
+
+
+# Prefixes of the GeneralName types other than DNS names and IP
+# addresses, as rendered by OpenSSL
+GENERAL_NAME_TYPES = {
+    'RFC822Name': 'email',
+    'UniformResourceIdentifier': 'URI',
+    'DirectoryName': 'DirName',
+    'RegisteredID': 'Registered ID',
+    'OtherName': 'othername',
+}
+
+
+def extract_sans(csr_info: 'OpenSSL.crypto.X509Req') \
+        -> Optional[SubjectAltNames]:
+    # Returns the SANs of a parsed CSR, or None if it has no
+    # subjectAltName extension.  The extensions are decoded by
+    # cryptography rather than read from OpenSSL's text rendering, which
+    # is ambiguous for names containing ", " and IPv6 addresses.  A
+    # request with any extension more than once is refused with
+    # DuplicateExtension: which of the SAN extensions counts differs
+    # between OpenSSL, which renders the last one, and the signer.
+    # Raises ValueError if an extension is malformed, or holds names of
+    # a type cryptography can't decode (e.g. x400Address).
+    from cryptography import x509
+    try:
+        extensions = csr_info.to_cryptography().extensions
+    except x509.DuplicateExtension as e:
+        raise DuplicateExtension(e.oid.dotted_string)
+    except x509.UnsupportedGeneralNameType as e:
+        raise ValueError(str(e))
+    try:
+        extension = extensions.get_extension_for_class(
+            x509.SubjectAlternativeName)
+    except x509.ExtensionNotFound:
+        return None
+    dns = []
+    ips = []
+    other = []
+    for name in extension.value:
+        if isinstance(name, x509.DNSName):
+            dns.append(name.value)
+        elif isinstance(name, x509.IPAddress):
+            if not isinstance(name.value, (ipaddress.IPv4Address,
+                                           ipaddress.IPv6Address)):
+                raise ValueError(f'invalid IP address {name.value}')
+            ips.append(name.value)
+        elif type(name).__name__ not in GENERAL_NAME_TYPES:
+            # Types of later versions of cryptography are not rendered
+            other.append(f'{type(name).__name__}:<unsupported>')
+        else:
+            name_type = GENERAL_NAME_TYPES[type(name).__name__]
+            if isinstance(name, x509.OtherName):
+                value = name.type_id.dotted_string
+            elif isinstance(name, x509.DirectoryName):
+                value = name.value.rfc4514_string()
+            elif isinstance(name, x509.RegisteredID):
+                value = name.value.dotted_string
+            else:
+                value = name.value
+            other.append(f'{name_type}:{value}')
+    return SubjectAltNames(tuple(dns), tuple(ips), tuple(other))
+
+
+# The logic implemented here is based on the checks in
+# https://github.com/openshift/cluster-machine-approver/blob/master/csr_check.go
+#
+# The checks are split into stages, ordered from cheapest to most
+# expensive.  The first stages only look at the CSR resource itself;
+# only CSRs that pass all of them are decoded and parsed for the
+# checks of the final X.509 stage.  Each stage check returns a Decision
+# rejecting the CSR, or None if the CSR passes the stage.
+
+NODE_USERNAME_PREFIX = 'system:node:'
+NODE_GROUPS = ['system:nodes', 'system:authenticated']
+SERVING_USAGES = ['digital signature', 'key encipherment', 'server auth']
+
+# Nodes joining the cluster first request a client certificate through
+# the node bootstrapper service account; they only request a serving
+# certificate as themselves once the client CSR is approved.
+NODE_BOOTSTRAPPER_USERNAME = 'system:serviceaccount:openshift-machine-config-operator:node-bootstrapper'  # noqa E501
+NODE_BOOTSTRAPPER_GROUPS = [
+    'system:serviceaccounts',
+    'system:serviceaccounts:openshift-machine-config-operator',
+    'system:authenticated',
+]
+CLIENT_USAGES = ['digital signature', 'key encipherment', 'client auth']
+
+
+class Reason(enum.Enum):
+    """Why a CSR is approved or not, see MESSAGES."""
+
+    APPROVED = 'approved'
+    APPROVED_CLIENT = 'approved-client'
+    ALREADY_PROCESSED = 'already-processed'
+    USERNAME_MISMATCH = 'username-mismatch'
+    EMPTY_NODE_NAME = 'empty-node-name'
+    UNKNOWN_NODE = 'unknown-node'
+    OTHER_SHARD = 'other-shard'
+    GROUP_ABSENT = 'group-absent'
+    WRONG_USAGES = 'wrong-usages'
+    USAGE_ABSENT = 'usage-absent'
+    CN_MISMATCH = 'cn-mismatch'
+    CN_NOT_A_NODE = 'cn-not-a-node'
+    O_MISMATCH = 'o-mismatch'
+    MALFORMED_SAN = 'malformed-san'
+    DUPLICATE_EXTENSION = 'duplicate-extension'
+    SAN_ABSENT = 'san-absent'
+    UNEXPECTED_SAN = 'unexpected-san'
+    DNS_NOT_ALLOWED = 'dns-not-allowed'
+    IP_NOT_ALLOWED = 'ip-not-allowed'
+    CLIENT_SANS = 'client-sans'
+    NODE_EXISTS = 'node-exists'
+
+
+# Templates of the messages of decisions, formatted with their args
+MESSAGES: Dict[Reason, str] = {
+    Reason.APPROVED: 'Marking CSR for approval: {}',
+    Reason.APPROVED_CLIENT: 'Marking client CSR of node {} for approval: {}',
+    Reason.ALREADY_PROCESSED: 'Already processed at {0.last_update_time} ({0.type}, {0.reason}), skipping',  # noqa E501
+    Reason.USERNAME_MISMATCH: 'Not approving, username {} does not match system:node:<nodename>',  # noqa E501
+    Reason.EMPTY_NODE_NAME: 'Not approving, node name is empty',
+    Reason.UNKNOWN_NODE: 'Not approving, node {} not present in spec',
+    Reason.OTHER_SHARD: 'Not approving, node {} belongs to the shard of another replica',  # noqa E501
+    Reason.GROUP_ABSENT: 'Not approving, required group {} absent from CSR',
+    Reason.WRONG_USAGES: 'Not approving, wrong usages: {}',
+    Reason.USAGE_ABSENT: 'Not approving, required usage {} absent from CSR',
+    Reason.CN_MISMATCH: 'Not approving, subject CN ({}) does not match username {}',  # noqa E501
+    Reason.CN_NOT_A_NODE: 'Not approving, subject CN ({}) does not match system:node:<nodename>',  # noqa E501
+    Reason.O_MISMATCH: 'Not approving, subject O ({}) does not match system:nodes',  # noqa E501
+    Reason.MALFORMED_SAN: 'Not approving, malformed SAN extension: {}',
+    Reason.DUPLICATE_EXTENSION: 'Not approving, X509v3 extension {} present more than once',  # noqa E501
+    Reason.SAN_ABSENT: 'Not approving, X509v3 extension Subject Alternative Name absent from CSR',  # noqa E501
+    Reason.UNEXPECTED_SAN: 'Not approving, unexpected SAN {}',
+    Reason.DNS_NOT_ALLOWED: 'Not approving, SAN DNS:{} not allowed for node {}',  # noqa E501
+    Reason.IP_NOT_ALLOWED: 'Not approving, SAN IP Address:{} not allowed for node {}',  # noqa E501
+    Reason.CLIENT_SANS: 'Not approving, unexpected SANs in client CSR of node {}',  # noqa E501
+    Reason.NODE_EXISTS: 'Not approving client CSR, node {} already joined the cluster',  # noqa E501
+}
+
+
+class Decision:
+    """The outcome of deciding on a CSR.
+
+    stage is the stage that rejected the CSR, or 'approved' if none did.
+    The message is only rendered from the reason and its args when it
+    is needed, e.g. when it is logged at an enabled level, so deciding
+    on CSRs does not format any strings.
+    """
+
+    __slots__ = ('stage', 'approve', 'reason', 'args')
+
+    def __init__(self, stage: str, approve: bool, reason: Reason,
+                 args: Tuple[Any, ...] = ()) -> None:
+        self.stage = stage
+        self.approve = approve
+        self.reason = reason
+        self.args = args
+
+    @property
+    def message(self) -> str:
+        return MESSAGES[self.reason].format(*self.args)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Decision):
+            return NotImplemented
+        return (self.stage, self.approve, self.reason, self.args) \
+            == (other.stage, other.approve, other.reason, other.args)
+
+    def __repr__(self) -> str:
+        return f'Decision({self.stage!r}, {self.approve!r}, {self.reason}, {self.args!r})'  # noqa E501
+
+    def __str__(self) -> str:
+        return self.message
+
+
+class _Subject:
+    # The components of a request's subject, only decoded when the
+    # message of a decision is rendered
+
+    __slots__ = ('components',)
+
+    def __init__(self, components: List[Tuple[bytes, bytes]]) -> None:
+        self.components = components
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Subject) \
+            and self.components == other.components
+
+    def __repr__(self) -> str:
+        return f'_Subject({self.components!r})'
+
+    def __str__(self) -> str:
+        return ', '.join([
+            f'{name.decode()} = {value.decode()}'
+            for name, value in self.components
+        ])
+
+
+def is_bootstrap_csr(csr: k8s.V1beta1CertificateSigningRequest,
+                     node_csr_spec: NodeCsrSpec) -> bool:
+    # Whether csr is a client CSR of a joining node, to be checked as
+    # such
+    return node_csr_spec.approve_bootstrap and \
+        csr.spec.username == NODE_BOOTSTRAPPER_USERNAME
+
+
+def _check_conditions(csr: k8s.V1beta1CertificateSigningRequest,
+                      node_csr_spec: NodeCsrSpec) -> Optional[Decision]:
     # Skip CSRs that are already approved or denied
     if csr.status.conditions is not None:
         for condition in csr.status.conditions:
             if condition.type in ['Approved', 'Denied']:
-                update_time = condition.last_update_time
-                ctype = condition.type
-                reason = condition.reason
-                return False, f'Already processed at {update_time} ({ctype}, {reason}), skipping'  # noqa E501
+                return Decision('conditions', False, Reason.ALREADY_PROCESSED,
+                                (condition,))
+    return None
 
-    # The logic implemented here is based on the checks in
-    # https://github.com/openshift/cluster-machine-approver/blob/master/csr_check.go
 
+def _check_username(csr: k8s.V1beta1CertificateSigningRequest,
+                    node_csr_spec: NodeCsrSpec) -> Optional[Decision]:
     csr_username = csr.spec.username
-    if not csr_username.startswith('system:node:'):
-        return False, f'Not approving, username {csr_username} does not match system:node:<nodename>'  # noqa E501
-    nodename = csr_username[len('system:node:'):]
-    if len(nodename) == 0:
-        return False, 'Not approving, node name is empty'
+    if is_bootstrap_csr(csr, node_csr_spec):
+        return None
+    if not csr_username.startswith(NODE_USERNAME_PREFIX):
+        return Decision('username', False, Reason.USERNAME_MISMATCH,
+                        (csr_username,))
+    if len(csr_username) == len(NODE_USERNAME_PREFIX):
+        return Decision('username', False, Reason.EMPTY_NODE_NAME)
+    return None
+
+
+def _check_node(csr: k8s.V1beta1CertificateSigningRequest,
+                node_csr_spec: NodeCsrSpec) -> Optional[Decision]:
+    if is_bootstrap_csr(csr, node_csr_spec):
+        # The node is only named by the request's subject, it is
+        # checked in the X.509 stage
+        return None
+    nodename = csr.spec.username[len(NODE_USERNAME_PREFIX):]
+    if nodename in node_csr_spec.other_shards:
+        return Decision('node', False, Reason.OTHER_SHARD, (nodename,))
     if nodename not in node_csr_spec:
-        return False, f'Not approving, node {nodename} not present in spec'
-    node_spec = node_csr_spec[nodename]
+        return Decision('node', False, Reason.UNKNOWN_NODE, (nodename,))
+    return None
 
+
+def _check_groups(csr: k8s.V1beta1CertificateSigningRequest,
+                  node_csr_spec: NodeCsrSpec) -> Optional[Decision]:
     groups = csr.spec.groups
-    for group in ['system:nodes', 'system:authenticated']:
+    required = NODE_GROUPS
+    if is_bootstrap_csr(csr, node_csr_spec):
+        required = NODE_BOOTSTRAPPER_GROUPS
+    for group in required:
         if group not in groups:
-            return False, f'Not approving, required group {group} absent from CSR'  # noqa E501
+            return Decision('groups', False, Reason.GROUP_ABSENT, (group,))
+    return None
+
 
+def _check_usages(csr: k8s.V1beta1CertificateSigningRequest,
+                  node_csr_spec: NodeCsrSpec) -> Optional[Decision]:
     usages = csr.spec.usages
     if len(usages) != 3:
-        return False, f'Not approving, wrong usages: {", ".join(usages)}'
-    for usage in ['digital signature', 'key encipherment', 'server auth']:
+        return Decision('usages', False, Reason.WRONG_USAGES,
+                        (', '.join(usages),))
+    required = SERVING_USAGES
+    if is_bootstrap_csr(csr, node_csr_spec):
+        required = CLIENT_USAGES
+    for usage in required:
         if usage not in usages:
-            return False, f'Not approving, required usage {usage} absent from CSR'  # noqa E501
+            return Decision('usages', False, Reason.USAGE_ABSENT, (usage,))
+    return None
+
+
+PRECHECK_STAGES: List[Tuple[str, Callable[
+    [k8s.V1beta1CertificateSigningRequest, NodeCsrSpec],
+    Optional[Decision]]]] = [
+    ('conditions', _check_conditions),
+    ('username', _check_username),
+    ('node', _check_node),
+    ('groups', _check_groups),
+    ('usages', _check_usages),
+]
+
+# Names of all stages, in the order they are run
+STAGES = [name for name, _ in PRECHECK_STAGES] + ['x509']
 
+
+def precheck_csr(csr: k8s.V1beta1CertificateSigningRequest,
+                 node_csr_spec: NodeCsrSpec) -> Optional[Decision]:
+    for _, check in PRECHECK_STAGES:
+        decision = check(csr, node_csr_spec)
+        if decision is not None:
+            return decision
+    return None
+
+
+def check_csr_info(csr: k8s.V1beta1CertificateSigningRequest,
+                   csr_info: 'OpenSSL.crypto.X509Req',
+                   node_csr_spec: NodeCsrSpec) -> Decision:
+    # X.509 stage, only to be run for CSRs that passed precheck_csr
+    if is_bootstrap_csr(csr, node_csr_spec):
+        return check_client_request(csr_info, node_csr_spec)
+    csr_username = csr.spec.username
+    nodename = csr_username[len(NODE_USERNAME_PREFIX):]
+    return check_request(csr_username, csr_info, node_csr_spec[nodename])
+
+
+def _x509_rejection(reason: Reason, *args: Any) -> Decision:
+    return Decision('x509', False, reason, args)
+
+
+def check_request(csr_username: str, csr_info: 'OpenSSL.crypto.X509Req',
+                  node_spec: NodeSpec) -> Decision:
+    # The X.509 stage on its own, for the node the CSR was requested by
+    nodename = node_spec.name
     subject = csr_info.get_subject()
     if subject.CN != csr_username:
-        return False, f'Not approving, subject CN ({subject.CN}) does not match username {csr_username}'  # noqa E501
+        return _x509_rejection(Reason.CN_MISMATCH, subject.CN, csr_username)
     if subject.O != 'system:nodes':
-        return False, f'Not approving, subject O ({subject.O}) does not match system:nodes'  # noqa E501
+        return _x509_rejection(Reason.O_MISMATCH, subject.O)
 
-    # Find SAN exstension
-    csr_san = None
-    for extension in csr_info.get_extensions():
-        if extension.get_short_name() == b'subjectAltName':
-            csr_san = extension
-    if not csr_san:
-        return False, f'Not approving, X509v3 extension Subject Alternative Name absent from CSR'  # noqa E501
+    try:
+        sans = extract_sans(csr_info)
+    except DuplicateExtension as e:
+        return _x509_rejection(Reason.DUPLICATE_EXTENSION, e.args[0])
+    except ValueError as e:
+        return _x509_rejection(Reason.MALFORMED_SAN, str(e))
+    if sans is None:
+        return _x509_rejection(Reason.SAN_ABSENT)
 
-    # Match each SAN against the allowed values from the CM
     # Only approve if ALL SANs are present in the node CSR spec
-    parsed_san = str(csr_san)
-    sans = parsed_san.split(', ')
-    for name in sans:
-        if name.startswith('DNS:'):
-            dns_name = name[len('DNS:'):]
-            if dns_name not in node_spec['names']:
-                return False, f'Not approving, SAN {name} not allowed for node {nodename}'  # noqa E501
-        elif name.startswith('IP Address:'):
-            ip_name = name[len('IP Address:'):]
-            if ip_name not in node_spec['ips']:
-                return False, f'Not approving, SAN {name} not allowed for node {nodename}'  # noqa E501
-        else:
-            return False, f'Not approving, unexpected SAN {name}'
+    if sans.other:
+        return _x509_rejection(Reason.UNEXPECTED_SAN, sans.other[0])
+    for dns_name in sans.dns:
+        if dns_name not in node_spec.names:
+            return _x509_rejection(Reason.DNS_NOT_ALLOWED, dns_name, nodename)
+    for ip in sans.ips:
+        if ip not in node_spec.ips:
+            return _x509_rejection(Reason.IP_NOT_ALLOWED, ip, nodename)
 
     # Approve CSR
-    prettyname = ', '.join([
-        f'{x[0].decode()} = {x[1].decode()}'
-        for x in subject.get_components()
-    ])
-    return True, f'Marking CSR for approval: {prettyname}'
+    return Decision('approved', True, Reason.APPROVED,
+                    (_Subject(subject.get_components()),))
+
+
+def check_client_request(csr_info: 'OpenSSL.crypto.X509Req',
+                         node_csr_spec: NodeCsrSpec) -> Decision:
+    # The X.509 stage of a client CSR requested by the node bootstrapper
+    # on behalf of a joining node, which is named by the subject CN
+    subject = csr_info.get_subject()
+    if subject.O != 'system:nodes':
+        return _x509_rejection(Reason.O_MISMATCH, subject.O)
+    cn = subject.CN or ''
+    if not cn.startswith(NODE_USERNAME_PREFIX) \
+            or len(cn) == len(NODE_USERNAME_PREFIX):
+        return _x509_rejection(Reason.CN_NOT_A_NODE, cn)
+    nodename = cn[len(NODE_USERNAME_PREFIX):]
+    if nodename in node_csr_spec.other_shards:
+        return _x509_rejection(Reason.OTHER_SHARD, nodename)
+    if nodename not in node_csr_spec:
+        return _x509_rejection(Reason.UNKNOWN_NODE, nodename)
+
+    # Client certificates don't name the node by anything but the CN
+    try:
+        sans = extract_sans(csr_info)
+    except DuplicateExtension as e:
+        return _x509_rejection(Reason.DUPLICATE_EXTENSION, e.args[0])
+    except ValueError as e:
+        return _x509_rejection(Reason.MALFORMED_SAN, str(e))
+    if sans is not None and (sans.dns or sans.ips or sans.other):
+        return _x509_rejection(Reason.CLIENT_SANS, nodename)
+
+    # Joined nodes renew their client certificates as themselves, so
+    # a client CSR of the bootstrapper for one of them is not
+    # approved.  Looked up last, as it takes a request to the API.
+    if node_csr_spec.node_exists is None \
+            or node_csr_spec.node_exists(nodename):
+        return _x509_rejection(Reason.NODE_EXISTS, nodename)
+
+    return Decision('approved', True, Reason.APPROVED_CLIENT,
+                    (nodename, _Subject(subject.get_components())))
+
+
+def _timed_parse_csr(csr: k8s.V1beta1CertificateSigningRequest) \
+        -> 'OpenSSL.crypto.X509Req':
+    with metrics.PARSE_DURATION.time():
+        return parse_csr(csr)
+
+
+def check_approve_csr(csr: k8s.V1beta1CertificateSigningRequest,
+                      csr_info: 'OpenSSL.crypto.X509Req',
+                      node_csr_spec: NodeCsrSpec) -> Decision:
+    rejected = precheck_csr(csr, node_csr_spec)
+    if rejected is not None:
+        return rejected
+    return check_csr_info(csr, csr_info, node_csr_spec)
+
+
+# Result of the X.509 stage of a CSR run in a DecisionPool worker,
+# either the decision of check_request or the error it raised
+X509Result = Union[Decision, BaseException]
+
+
+def decide_csr(csr: k8s.V1beta1CertificateSigningRequest,
+               node_csr_spec: NodeCsrSpec,
+               cache: Optional[CsrCache] = None,
+               checked: Optional[X509Result] = None) -> Decision:
+    # checked is the result of the X.509 stage if it already ran in a
+    # DecisionPool.
+    with metrics.DECISION_DURATION.time():
+        return _decide_csr(csr, node_csr_spec, cache, checked)
+
+
+def _decide_csr(csr: k8s.V1beta1CertificateSigningRequest,
+                node_csr_spec: NodeCsrSpec,
+                cache: Optional[CsrCache],
+                checked: Optional[X509Result] = None) -> Decision:
+    # Only parse CSRs that pass the cheap checks
+    decision = precheck_csr(csr, node_csr_spec)
+    if decision is not None:
+        return decision
+    # Only decisions of the X.509 stage are cached.  Most listed CSRs,
+    # e.g. those approved long ago, fail the cheap checks, and would
+    # otherwise crowd the pending CSRs out of the cache.
+    if cache is not None:
+        cached = cache.get_decision(csr, node_csr_spec.generation)
+        if cached is not None:
+            return cached
+    if isinstance(checked, BaseException):
+        raise checked
+    if checked is not None:
+        decision = checked
+    else:
+        if cache is not None:
+            csrinfo = cache.parse(csr, _timed_parse_csr)
+        else:
+            csrinfo = _timed_parse_csr(csr)
+        decision = check_csr_info(csr, csrinfo, node_csr_spec)
+    if cache is not None:
+        cache.put_decision(csr, node_csr_spec.generation, decision)
+    return decision
+
+
+def _client_nodename(csr: k8s.V1beta1CertificateSigningRequest,
+                     cache: Optional[CsrCache]) -> Optional[str]:
+    # The node a client CSR of the node bootstrapper is requested for,
+    # as named by the subject CN, if any
+    try:
+        if cache is not None:
+            csr_info = cache.parse(csr, _timed_parse_csr)
+        else:
+            csr_info = _timed_parse_csr(csr)
+    except Exception:
+        return None
+    cn = csr_info.get_subject().CN or ''
+    if not cn.startswith(NODE_USERNAME_PREFIX):
+        return None
+    return cn[len(NODE_USERNAME_PREFIX):] or None
+
+
+def _update_store(store: CsrStore,
+                  csr: k8s.V1beta1CertificateSigningRequest,
+                  decision: Decision,
+                  node_csr_spec: NodeCsrSpec,
+                  cache: Optional[CsrCache] = None) -> bool:
+    # Returns whether the CSR is new to the store, or its state or the
+    # reason for it changed.  Client CSRs of joining nodes are indexed
+    # by the node they are requested for, so that they are re-evaluated
+    # when it is added to the spec; they are only parsed for it while
+    # undecided.
+    nodename = None
+    if csr.spec.username.startswith(NODE_USERNAME_PREFIX):
+        nodename = csr.spec.username[len(NODE_USERNAME_PREFIX):] or None
+    elif decision.stage != 'conditions' \
+            and is_bootstrap_csr(csr, node_csr_spec):
+        nodename = _client_nodename(csr, cache)
+    if decision.approve:
+        state = csr_store.PENDING
+    elif decision.stage == 'conditions':
+        ctypes = [c.type for c in csr.status.conditions]
+        if 'Approved' in ctypes:
+            state = csr_store.APPROVED
+        else:
+            state = csr_store.DENIED
+    else:
+        state = csr_store.REJECTED
+    previous = store.get(csr.metadata.uid)
+    store.update(csr, nodename, state, decision)
+    return previous is None or previous.state != state \
+        or previous.reason != decision
+
+
+def _log_decision(csr: k8s.V1beta1CertificateSigningRequest,
+                  decision: Decision, changed: bool) -> None:
+    # Approvals and new rejections are logged at info level.  CSRs that
+    # were already approved or denied, rejections that were logged
+    # before and CSRs left to other replicas are only logged at debug
+    # level, as they would otherwise make up most of the log.  The
+    # message is only rendered if logged.
+    level = logging.INFO
+    if not decision.approve \
+            and (decision.stage == 'conditions' or not changed):
+        level = logging.DEBUG
+    elif decision.reason is Reason.OTHER_SHARD:
+        level = logging.DEBUG
+    if logger.isEnabledFor(level):
+        name = csr.metadata.name
+        logger.log(level, '%s: %s', name, decision,
+                   extra={'csr': name, 'stage': decision.stage,
+                          'reason': decision.reason.value})
+
+
+def evaluate_csr(csr: k8s.V1beta1CertificateSigningRequest,
+                 node_csr_spec: NodeCsrSpec,
+                 stats: Optional[TypingCounter[str]] = None,
+                 cache: Optional[CsrCache] = None,
+                 store: Optional[CsrStore] = None,
+                 checked: Optional[X509Result] = None) -> bool:
+    # Broad error handling around each single CSR processing
+    # prevents denial of service if a (maliciously crafted)
+    # malformed CSR causes an unexpected error.
+    metrics.CSRS_SEEN.inc()
+    try:
+        decision = decide_csr(csr, node_csr_spec, cache, checked)
+        if stats is not None:
+            stats[decision.stage] += 1
+        if metrics.REGISTRY.enabled:
+            # Labels are only looked up if recorded
+            metrics.CSRS_DECIDED.inc(reason=decision.reason.value)
+            if not decision.approve:
+                metrics.CSRS_REJECTED.inc(reason=decision.stage)
+        changed = True
+        if store is not None:
+            changed = _update_store(store, csr, decision, node_csr_spec,
+                                    cache)
+        _log_decision(csr, decision, changed)
+        return decision.approve
+    except BaseException as e:
+        # Log, but don't quit -> continue processing other CSRs
+        logger.error(e, exc_info=True)
+        metrics.CSRS_ERRORS.inc()
+        if stats is not None:
+            stats['error'] += 1
+        return False
 
 
-def iterate_csrs(csrs: k8s.V1beta1CertificateSigningRequestList,
-                 node_csr_spec: Dict[str, Any]) \
-        -> List[k8s.V1beta1CertificateSigningRequest]:
-    if len(csrs.items) == 0:
+class CsrSelector:
+    """Selects the CSRs to evaluate.
+
+    The label and field selectors are passed on to list and watch
+    requests, so that the API server leaves out CSRs that don't match
+    them.  The API can't select CSRs by the requesting user though, so
+    with drop_unknown_nodes, CSRs not requested by a node of the spec
+    are dropped on arrival, before they are evaluated, cached or
+    stored.  Such CSRs are never approved, but neither are they logged
+    nor re-evaluated once their node is added to the spec, until the
+    next full list.  CSRs of nodes in the shards of other replicas are
+    always dropped, as these replicas approve them.
+    """
+
+    def __init__(self, label_selector: str = '', field_selector: str = '',
+                 node_csr_spec: Optional[NodeCsrSpec] = None,
+                 drop_unknown_nodes: bool = False) -> None:
+        self.label_selector = label_selector
+        self.field_selector = field_selector
+        self.drop_unknown_nodes = drop_unknown_nodes
+        self._usernames: FrozenSet[str] = frozenset()
+        self._other_shards: FrozenSet[str] = frozenset()
+        if node_csr_spec is not None:
+            self.update(node_csr_spec)
+        self.selected = 0
+        self.dropped = 0
+
+    def update(self, node_csr_spec: NodeCsrSpec) -> None:
+        usernames = [
+            f'{NODE_USERNAME_PREFIX}{nodename}' for nodename in node_csr_spec
+        ]
+        # The node of a client CSR is only known once it is parsed
+        if node_csr_spec.approve_bootstrap:
+            usernames.append(NODE_BOOTSTRAPPER_USERNAME)
+        self._usernames = frozenset(usernames)
+        self._other_shards = frozenset([
+            f'{NODE_USERNAME_PREFIX}{nodename}'
+            for nodename in node_csr_spec.other_shards
+        ])
+
+    def request_kwargs(self) -> Dict[str, str]:
+        kwargs = {}
+        if self.label_selector:
+            kwargs['label_selector'] = self.label_selector
+        if self.field_selector:
+            kwargs['field_selector'] = self.field_selector
+        return kwargs
+
+    def select(self, csr: k8s.V1beta1CertificateSigningRequest) -> bool:
+        if csr.spec.username in self._other_shards:
+            self.dropped += 1
+            metrics.CSRS_DROPPED.inc(reason=Reason.OTHER_SHARD.value)
+            return False
+        if self.drop_unknown_nodes \
+                and csr.spec.username not in self._usernames:
+            self.dropped += 1
+            metrics.CSRS_DROPPED.inc(reason=Reason.UNKNOWN_NODE.value)
+            return False
+        self.selected += 1
+        return True
+
+
+class CsrLister:
+    """Lists CSRs page by page, so that only a single page of CSRs
+    needs to be held in memory at a time.
+
+    The resource version of the list is available once iteration has
+    started; all pages of a paginated list share the same resource
+    version.  In raw mode, pages are decoded into CsrRecords instead of
+    the client's models.
+
+    The continue token of the next page expires after a few minutes,
+    e.g. while approvals of the previous page hold up paging.  The list
+    is then started over, so CSRs may be yielded more than once.
+    """
+
+    def __init__(self, api: k8s.CertificatesV1beta1Api,
+                 page_size: int = 0,
+                 selector: Optional[CsrSelector] = None,
+                 raw: bool = False) -> None:
+        self.api = api
+        self.page_size = page_size
+        self.selector = selector
+        self.raw = raw
+        self.resource_version: Optional[str] = None
+        self.pages = 0
+
+    def _list(self, kwargs: Dict[str, Any]) \
+            -> Tuple[List[Any], Optional[str], Optional[str]]:
+        # Returns a page of CSRs, the resource version of the list and
+        # the continue token of the next page
+        if self.raw:
+            response = self.api.list_certificate_signing_request(
+                _preload_content=False, **kwargs)
+            try:
+                return parse_csr_list(response.data)
+            finally:
+                response.release_conn()
+        page: k8s.V1beta1CertificateSigningRequestList \
+            = self.api.list_certificate_signing_request(**kwargs)
+        if page.metadata is None:
+            return page.items, None, None
+        return page.items, page.metadata.resource_version, \
+            page.metadata._continue
+
+    def __iter__(self) -> Iterator[k8s.V1beta1CertificateSigningRequest]:
+        kwargs: Dict[str, Any] = {}
+        if self.selector is not None:
+            kwargs.update(self.selector.request_kwargs())
+        if self.page_size > 0:
+            kwargs['limit'] = self.page_size
+        while True:
+            try:
+                with metrics.LIST_DURATION.time():
+                    items, resource_version, _continue = self._list(kwargs)
+            except ApiException as e:
+                if e.status != 410 or '_continue' not in kwargs:
+                    raise
+                # The CSRs of the pages so far may have changed since,
+                # so they are listed again rather than skipped
+                logger.warning('Continue token expired, relisting CSRs')
+                del kwargs['_continue']
+                continue
+            self.pages += 1
+            if resource_version is not None:
+                self.resource_version = resource_version
+            yield from items
+            if not _continue:
+                return
+            kwargs['_continue'] = _continue
+
+
+def _check_requests(requests: List[Tuple[str, str, NodeSpec]]) \
+        -> List[X509Result]:
+    # Runs the X.509 stage of a chunk of CSRs in a DecisionPool worker.
+    # Errors are returned, so that they only affect their own CSR.
+    results: List[X509Result] = []
+    for username, request, node_spec in requests:
+        try:
+            results.append(
+                check_request(username, parse_request(request), node_spec))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+class DecisionPool:
+    """Runs the X.509 stage of CSR decisions in a pool of processes.
+
+    Decoding, parsing and checking the requests of CSRs is CPU bound and
+    dominates evaluating large backlogs of pending CSRs.  CSRs are read
+    in batches; the CSRs of a batch that pass the prechecks and are not
+    cached are split into chunks that are checked in parallel.  The
+    results are then passed on with the CSRs in their original order,
+    and evaluate_csr takes it from there, so logging, errors, the cache
+    and the store are handled exactly as in serial mode.
+
+    Batches with fewer than min_batch CSRs to check are checked in the
+    main process, as shipping them to the pool would cost more than it
+    saves.  The pool is only started once a batch is large enough.
+    """
+
+    def __init__(self, processes: int, min_batch: int = 256,
+                 batch_size: int = 2000) -> None:
+        self.processes = max(1, processes)
+        self.min_batch = min_batch
+        self.batch_size = max(1, batch_size)
+        self.parallel = 0
+        self.serial = 0
+        self._executor: Optional[Any] = None
+
+    def _start(self) -> Any:
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Forking the main process is unsafe while other threads,
+            # e.g. those of the ApprovalPool, hold locks.  A forkserver
+            # forks workers from a clean single-threaded process.
+            context: Any
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(self.processes,
+                                                 mp_context=context)
+        return self._executor
+
+    def check(self, csrs: List[k8s.V1beta1CertificateSigningRequest],
+              node_csr_spec: NodeCsrSpec,
+              cache: Optional[CsrCache] = None) -> Dict[str, X509Result]:
+        # Returns the results of the X.509 stage by uid, for the CSRs
+        # that reach it.  Empty if they are too few to check in parallel.
+        # Client CSRs of joining nodes are few, they are checked in the
+        # main process
+        pending = [
+            csr for csr in csrs
+            if precheck_csr(csr, node_csr_spec) is None
+            if not is_bootstrap_csr(csr, node_csr_spec)
+        ]
+        if cache is not None:
+            pending = [
+                csr for csr in pending
+                if not cache.cached(csr, node_csr_spec.generation)
+            ]
+        if len(pending) < max(1, self.min_batch):
+            self.serial += len(pending)
+            return {}
+        self.parallel += len(pending)
+        requests = [
+            (csr.spec.username, csr.spec.request,
+             node_csr_spec[csr.spec.username[len(NODE_USERNAME_PREFIX):]])
+            for csr in pending
+        ]
+        executor = self._start()
+        size = math.ceil(len(requests) / self.processes)
+        chunks = [
+            (pending[i:i + size], executor.submit(_check_requests,
+                                                  requests[i:i + size]))
+            for i in range(0, len(requests), size)
+        ]
+        results: Dict[str, X509Result] = {}
+        for chunk, future in chunks:
+            try:
+                chunk_results = future.result()
+            except Exception as e:
+                # E.g. a worker died or a result could not be pickled
+                chunk_results = [e] * len(chunk)
+            for csr, result in zip(chunk, chunk_results):
+                results[csr.metadata.uid] = result
+        return results
+
+    def iterate(self, csrs: Iterable[k8s.V1beta1CertificateSigningRequest],
+                node_csr_spec: NodeCsrSpec,
+                cache: Optional[CsrCache] = None) \
+            -> Iterator[Tuple[k8s.V1beta1CertificateSigningRequest,
+                              Optional[X509Result]]]:
+        iterator = iter(csrs)
+        while True:
+            batch = list(itertools.islice(iterator, self.batch_size))
+            if len(batch) == 0:
+                return
+            results = self.check(batch, node_csr_spec, cache)
+            for csr in batch:
+                yield csr, results.get(csr.metadata.uid)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def iterate_csrs(csrs: Iterable[k8s.V1beta1CertificateSigningRequest],
+                 node_csr_spec: NodeCsrSpec,
+                 stats: Optional[TypingCounter[str]] = None,
+                 cache: Optional[CsrCache] = None,
+                 store: Optional[CsrStore] = None,
+                 selector: Optional[CsrSelector] = None,
+                 decider: Optional[DecisionPool] = None) \
+        -> Iterator[k8s.V1beta1CertificateSigningRequest]:
+    # csrs must be the complete list of CSRs, as cache and store entries
+    # of CSRs not in it are evicted.
+    if stats is None:
+        stats = Counter()
+    count = 0
+    uids: Set[str] = set()
+    oldest_pending: Optional[datetime] = None
+
+    def select() -> Iterator[k8s.V1beta1CertificateSigningRequest]:
+        nonlocal count
+        for csr in csrs:
+            count += 1
+            if selector is not None and not selector.select(csr):
+                stats['dropped'] += 1
+                continue
+            if cache is not None or store is not None:
+                uids.add(csr.metadata.uid)
+            yield csr
+
+    checked: Iterator[Tuple[k8s.V1beta1CertificateSigningRequest,
+                            Optional[X509Result]]]
+    if decider is None:
+        checked = ((csr, None) for csr in select())
+    else:
+        checked = decider.iterate(select(), node_csr_spec, cache)
+    for csr, x509_result in checked:
+        if evaluate_csr(csr, node_csr_spec, stats, cache, store,
+                        x509_result):
+            yield csr
+        elif metrics.REGISTRY.enabled \
+                and _check_conditions(csr, node_csr_spec) is None:
+            created = csr.metadata.creation_timestamp
+            if created is not None and \
+                    (oldest_pending is None or created < oldest_pending):
+                oldest_pending = created
+    if metrics.REGISTRY.enabled:
+        age = 0.0
+        if oldest_pending is not None:
+            age = (datetime.now(timezone.utc) - oldest_pending) \
+                .total_seconds()
+        metrics.PENDING_CSR_AGE.set(age)
+    if store is not None:
+        store.retain(uids)
+    if cache is not None:
+        cache.retain(uids)
+        cstats = cache.stats()
+        logger.info(f'CSR cache: {cstats["parsed_hits"]} hits, {cstats["parsed_misses"]} misses for parsed CSRs, {cstats["decision_hits"]} hits, {cstats["decision_misses"]} misses for decisions')  # noqa E501
+    if count == 0:
         logger.info('No CSRs to process')
-    csrs_to_approve = []
-    for csr in csrs.items:
-        # Broad error handling around each single CSR processing
-        # prevents denial of service if a (maliciously crafted)
-        # malformed CSR causes an unexpected error.
+        return
+    eliminated = ', '.join([
+        f'{stage} {stats[stage]}' for stage in ['dropped'] + STAGES + ['error']
+    ])
+    logger.info(f'Processed {count} CSRs, {stats["approved"]} to approve, eliminated by stage: {eliminated}',  # noqa E501
+                extra={'csrs': count, 'outcomes': dict(stats)})
+
+
+class RateLimiter:
+    """Token bucket limiting the rate of API requests.
+
+    Callers exceeding the rate reserve a future token and sleep until
+    it becomes available.  A rate of 0 disables rate limiting.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.burst),
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+def percentile(values: List[float], p: float) -> float:
+    # Nearest-rank percentile of a list of values sorted ascending
+    if len(values) == 0:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+class ApprovalPool:
+    """Submits CSR approvals to the API from a bounded pool of threads.
+
+    Each approval is isolated: errors are logged and don't affect other
+    approvals.  Given the spec, approvals that conflict with a change of
+    the CSR are checked again and retried.  Latencies of the approval
+    calls are collected for a summary once all approvals are done.  With
+    a concurrency of 1, CSRs are approved synchronously in submission
+    order.
+    """
+
+    def __init__(self, api: k8s.CertificatesV1beta1Api,
+                 concurrency: int = 1,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 node_csr_spec: Optional[NodeCsrSpec] = None) -> None:
+        self.api = api
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = rate_limiter
+        self.node_csr_spec = node_csr_spec
+        self.latencies: List[float] = []
+        self.times_to_approval: List[float] = []
+        self.errors = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if self.concurrency > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.concurrency,
+                thread_name_prefix='approval')
+        # Limit the number of queued approvals, so that a lazily
+        # evaluated stream of CSRs is not consumed faster than the
+        # approvals can be sent
+        self._pending = threading.BoundedSemaphore(self.concurrency * 2)
+
+    def _approve(self, csr: k8s.V1beta1CertificateSigningRequest) -> None:
         try:
-            csrinfo = parse_csr(csr)
-            ok, msg = check_approve_csr(csr, csrinfo, node_csr_spec)
-            name = csr.metadata.name
-            logger.info(f'{name}: {msg}')
-            if ok:
-                csrs_to_approve.append(csr)
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            start = time.monotonic()
+            time_to_approval = approve_csr(self.api, csr, datetime.utcnow(),
+                                           self.node_csr_spec)
+            latency = time.monotonic() - start
+            with self._lock:
+                self.latencies.append(latency)
+                if time_to_approval is not None:
+                    self.times_to_approval.append(time_to_approval)
+        except ApprovalSkipped as e:
+            logger.info(f'Not approving after conflict, {e}')
+            with self._lock:
+                self.skipped += 1
         except BaseException as e:
             # Log, but don't quit -> continue processing other CSRs
             logger.error(e, exc_info=True)
-    return csrs_to_approve
+            metrics.CSRS_ERRORS.inc()
+            with self._lock:
+                self.errors += 1
+        finally:
+            self._pending.release()
+
+    def submit(self, csr: k8s.V1beta1CertificateSigningRequest) -> None:
+        self._pending.acquire()
+        if self._executor is None:
+            self._approve(csr)
+        else:
+            self._executor.submit(self._approve, csr)
+
+    def close(self) -> None:
+        # Wait for all submitted approvals to finish
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        latencies = sorted(self.latencies)
+        if len(latencies) == 0:
+            if self.errors > 0 or self.skipped > 0:
+                logger.info(f'Approved 0 CSRs ({self.errors} failed, {self.skipped} skipped)')  # noqa E501
+            return
+        mean = sum(latencies) / len(latencies)
+        logger.info(
+            f'Approved {len(latencies)} CSRs ({self.errors} failed, '
+            f'{self.skipped} skipped), '
+            f'approval latency: min {latencies[0]:.3f}s, '
+            f'mean {mean:.3f}s, p95 {percentile(latencies, 95):.3f}s, '
+            f'max {latencies[-1]:.3f}s')
+        times = sorted(self.times_to_approval)
+        if len(times) > 0:
+            logger.info(
+                f'Time from CSR creation to approval: '
+                f'p50 {percentile(times, 50):.1f}s, '
+                f'p95 {percentile(times, 95):.1f}s, '
+                f'p99 {percentile(times, 99):.1f}s')
 
 
 def run_csr_approval(client: k8s.ApiClient,
-                     node_csr_spec: Dict[str, Any]) -> None:
+                     node_csr_spec: NodeCsrSpec,
+                     page_size: int = 0,
+                     cache: Optional[CsrCache] = None,
+                     concurrency: int = 1,
+                     rate_limiter: Optional[RateLimiter] = None,
+                     store: Optional[CsrStore] = None,
+                     selector: Optional[CsrSelector] = None,
+                     raw: bool = False,
+                     decider: Optional[DecisionPool] = None,
+                     raise_failed: bool = False) -> Optional[str]:
+    # With raise_failed, ApprovalFailed is raised once all CSRs are
+    # processed if any of the approvals failed
     api = k8s.CertificatesV1beta1Api(client)
-    csrs: k8s.V1beta1CertificateSigningRequestList \
-        = api.list_certificate_signing_request()
-    now = datetime.utcnow()
-    csrs_to_approve = iterate_csrs(csrs, node_csr_spec)
-    for csr in csrs_to_approve:
+    lister = CsrLister(api, page_size, selector, raw)
+    approvals = ApprovalPool(api, concurrency, rate_limiter, node_csr_spec)
+    try:
+        # CSRs are approved while the list is still being paged through
+        for csr in iterate_csrs(lister, node_csr_spec, cache=cache,
+                                store=store, selector=selector,
+                                decider=decider):
+            approvals.submit(csr)
+    finally:
+        approvals.close()
+    opened, reused = connection_stats(client)
+    logger.info(f'API connections: {opened} opened, {reused} requests reused a connection')  # noqa E501
+    if raise_failed and approvals.errors > 0:
+        raise ApprovalFailed(f'{approvals.errors} approvals failed')
+    # The list's resource version is where a subsequent watch resumes
+    return lister.resource_version
+
+
+def reevaluate_csrs(client: k8s.ApiClient,
+                    node_csr_spec: NodeCsrSpec,
+                    store: CsrStore,
+                    nodenames: Iterable[str],
+                    cache: Optional[CsrCache] = None,
+                    concurrency: int = 1,
+                    rate_limiter: Optional[RateLimiter] = None) -> None:
+    # Re-evaluate the pending CSRs of the given nodes only, e.g. after
+    # their spec changed.  Decisions about CSRs of other nodes don't
+    # depend on the change and remain valid.
+    csrs = store.for_nodes(nodenames)
+    logger.info(f'Re-evaluating {len(csrs)} pending CSRs of {len(set(nodenames))} changed nodes')  # noqa E501
+    api = k8s.CertificatesV1beta1Api(client)
+    approvals = ApprovalPool(api, concurrency, rate_limiter, node_csr_spec)
+    try:
+        for csr in csrs:
+            if cache is not None:
+                cache.evict_decision(csr.metadata.uid)
+            if evaluate_csr(csr, node_csr_spec, cache=cache, store=store):
+                approvals.submit(csr)
+    finally:
+        approvals.close()
+    if approvals.errors > 0:
+        raise ApprovalFailed(f'{approvals.errors} approvals failed')
+
+
+def watch_csrs(api: k8s.CertificatesV1beta1Api,
+               node_csr_spec: NodeCsrSpec,
+               resource_version: Optional[str],
+               cache: Optional[CsrCache] = None,
+               timeout_seconds: Optional[int] = None,
+               store: Optional[CsrStore] = None,
+               selector: Optional[CsrSelector] = None,
+               concurrency: int = 1,
+               rate_limiter: Optional[RateLimiter] = None) \
+        -> Optional[str]:
+    # Follow the watch stream until it times out, or until the server
+    # reports that the resource version is too old (410 Gone).  Returns
+    # the resource version to resume watching from, or None if the
+    # caller has to relist.  Approvals are sent from an ApprovalPool,
+    # like those of listed CSRs.  Raises ApprovalFailed as soon as an
+    # approval failed, as the CSR would not be approved before its next
+    # event otherwise.
+    watch = k8s_watch.Watch()
+    approvals = ApprovalPool(api, concurrency, rate_limiter, node_csr_spec)
+    kwargs: Dict[str, Any] = {}
+    if timeout_seconds is not None:
+        kwargs['timeout_seconds'] = timeout_seconds
+    if selector is not None:
+        kwargs.update(selector.request_kwargs())
+    try:
+        for event in watch.stream(api.list_certificate_signing_request,
+                                  resource_version=resource_version,
+                                  **kwargs):
+            etype = event['type']
+            if etype == 'ERROR':
+                status = event['raw_object']
+                if status.get('code') == 410:
+                    logger.info('Watch expired, relisting CSRs')
+                else:
+                    logger.error(f'Watch failed: {status.get("message")}')
+                return None
+            csr = event['object']
+            if etype == 'DELETED':
+                if cache is not None:
+                    cache.evict(csr.metadata.uid)
+                if store is not None:
+                    store.remove(csr.metadata.uid)
+            if etype not in ['ADDED', 'MODIFIED']:
+                continue
+            if selector is not None and not selector.select(csr):
+                continue
+            if not evaluate_csr(csr, node_csr_spec, cache=cache,
+                                store=store):
+                continue
+            approvals.submit(csr)
+            if approvals.errors > 0:
+                break
+    except ApiException as e:
+        if e.status != 410:
+            raise
+        logger.info('Watch expired, relisting CSRs')
+        return None
+    finally:
+        watch.stop()
+        approvals.close()
+    if approvals.errors > 0:
+        raise ApprovalFailed(f'{approvals.errors} approvals failed')
+    return watch.resource_version
+
+
+class SpecWatcher:
+    """Keeps the node CSR spec up to date with its file.
+
+    ConfigMap volumes are updated by atomically swapping a symlink, so
+    the file is considered changed whenever the file the path resolves
+    to, its size or its modification time change.  A changed file is
+    parsed and swapped in as a whole; if it is invalid, the previous
+    spec stays in effect.
+
+    Given a ShardMembership, spec only holds the nodes of this
+    replica's shard, which also changes as replicas join or leave.
+    """
+
+    def __init__(self, filepath: str,
+                 approve_bootstrap: bool = False,
+                 membership: Optional[ShardMembership] = None,
+                 node_exists: Optional[NodeLookup] = None) -> None:
+        self.filepath = filepath
+        self.approve_bootstrap = approve_bootstrap
+        self.membership = membership
+        self.node_exists = node_exists
+        self._fingerprint = self._stat()
+        self.full_spec = parse_node_csr_spec(filepath, approve_bootstrap,
+                                             node_exists)
+        self.spec = self._shard()
+
+    def _shard(self) -> NodeCsrSpec:
+        if self.membership is None:
+            return self.full_spec
+        return shard_node_csr_spec(self.full_spec,
+                                   self.membership.members(),
+                                   self.membership.identity)
+
+    def _stat(self) -> Optional[Tuple[int, int, int, int]]:
         try:
-            create_approval_patch(csr, now)
-            api.replace_certificate_signing_request_approval(
-                csr.metadata.name, body=csr)
-        except BaseException as e:
-            # Log, but don't quit -> continue processing other CSRs
+            st = os.stat(self.filepath)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _reload(self) -> bool:
+        fingerprint = self._stat()
+        if fingerprint is None or fingerprint == self._fingerprint:
+            return False
+        self._fingerprint = fingerprint
+        try:
+            spec = parse_node_csr_spec(self.filepath,
+                                       self.approve_bootstrap,
+                                       self.node_exists)
+        except Exception as e:
+            logger.error(f'Not reloading invalid node CSR spec: {e}')
+            return False
+        self.full_spec = spec
+        logger.info(f'Reloaded node CSR spec from {self.filepath}')
+        return True
+
+    def poll(self) -> bool:
+        # Returns True if a new spec was loaded, or the shard of this
+        # replica changed
+        reloaded = self._reload()
+        if self.membership is None:
+            self.spec = self.full_spec
+            return reloaded
+        spec = self._shard()
+        if spec == self.spec:
+            return False
+        self.spec = spec
+        logger.info(f'Approving CSRs of {len(spec)} of {len(self.full_spec)} nodes in this shard')  # noqa E501
+        return True
+
+
+def watch_csr_approval(client: k8s.ApiClient,
+                       spec_watcher: SpecWatcher,
+                       page_size: int = 0,
+                       cache: Optional[CsrCache] = None,
+                       concurrency: int = 1,
+                       rate_limiter: Optional[RateLimiter] = None,
+                       reload_interval: int = 10,
+                       retry_delay: float = 5.0,
+                       store: Optional[CsrStore] = None,
+                       selector: Optional[CsrSelector] = None,
+                       raw: bool = False,
+                       decider: Optional[DecisionPool] = None,
+                       max_retry_delay: float = 60.0) -> None:
+    api = k8s.CertificatesV1beta1Api(client)
+    # CSRs by node, to re-evaluate only those affected by a change of
+    # the spec
+    if store is None:
+        store = CsrStore()
+    resource_version: Optional[str] = None
+    # Consecutive relists with failed approvals
+    failures = 0
+    while True:
+        try:
+            if resource_version is None:
+                resource_version = run_csr_approval(
+                    client, spec_watcher.spec, page_size, cache,
+                    concurrency, rate_limiter, store, selector, raw,
+                    decider, raise_failed=True)
+                failures = 0
+            # Watch in short intervals, so that changes of the spec are
+            # picked up in between
+            resource_version = watch_csrs(api, spec_watcher.spec,
+                                          resource_version, cache,
+                                          reload_interval, store, selector,
+                                          concurrency, rate_limiter)
+            old_spec = spec_watcher.spec
+            if spec_watcher.poll():
+                diff = diff_node_csr_specs(old_spec, spec_watcher.spec)
+                logger.info(f'Node CSR spec changed: {len(diff.added)} nodes added, {len(diff.removed)} removed, {len(diff.changed)} changed')  # noqa E501
+                if selector is not None:
+                    selector.update(spec_watcher.spec)
+                    dropped = selector.drop_unknown_nodes or \
+                        not diff.added.isdisjoint(old_spec.other_shards)
+                    if dropped and len(diff.added) > 0:
+                        # CSRs of the added nodes were dropped, so they
+                        # are only known to the API
+                        resource_version = None
+                        continue
+                reevaluate_csrs(client, spec_watcher.spec, store,
+                                diff.affected, cache, concurrency,
+                                rate_limiter)
+        except ApprovalFailed as e:
+            # The CSRs whose approval failed are approved again after
+            # relisting them, with their cached decisions.  The API
+            # server may be overloaded (429), so back off exponentially
+            # while approvals keep failing.
+            delay = min(retry_delay * 2 ** failures, max_retry_delay)
+            failures += 1
+            logger.warning(f'{e}, relisting CSRs in {delay:.1f}s')
+            resource_version = None
+            time.sleep(delay)
+        except Exception as e:
+            # Connection errors and the like: back off, then start over
+            # with a fresh list so no CSR events are missed.
             logger.error(e, exc_info=True)
+            resource_version = None
+            time.sleep(retry_delay)
 
 
 def parse_arguments(args: List[str]) -> argparse.Namespace:
@@ -253,15 +1751,212 @@ def parse_arguments(args: List[str]) -> argparse.Namespace:
                         type=str, action='store', dest='sa_path',
                         default='/var/run/secrets/service-account',
                         help='Path to the service account secret mount point, e.g. /var/run/secrets/service-account')  # noqa E501
-    return parser.parse_args(args)
+    parser.add_argument('--pool-size', metavar='N',
+                        type=int, action='store', dest='pool_size',
+                        default=0,
+                        help='Maximum number of pooled connections to the API (default: concurrency + 1, at least 4)')  # noqa E501
+    parser.add_argument('--connect-timeout', metavar='SECONDS',
+                        type=float, action='store', dest='connect_timeout',
+                        default=10.0,
+                        help='Timeout for connecting to the API, 0 for no timeout (default: 10)')  # noqa E501
+    parser.add_argument('--read-timeout', metavar='SECONDS',
+                        type=float, action='store', dest='read_timeout',
+                        default=60.0,
+                        help='Timeout for API responses, except for watches, 0 for no timeout (default: 60)')  # noqa E501
+    parser.add_argument('--keepalive', metavar='SECONDS',
+                        type=int, action='store', dest='keepalive',
+                        default=60,
+                        help='Idle time before TCP keepalive probes are sent on API connections, 0 to disable keepalive (default: 60)')  # noqa E501
+    parser.add_argument('--page-size', metavar='N',
+                        type=int, action='store', dest='page_size',
+                        default=500,
+                        help='Number of CSRs to request from the API at once, 0 to list all CSRs in a single request (default: 500)')  # noqa E501
+    parser.add_argument('--label-selector', metavar='SELECTOR',
+                        type=str, action='store', dest='label_selector',
+                        default='',
+                        help='Only list and watch CSRs with matching labels, e.g. app=node (default: all CSRs)')  # noqa E501
+    parser.add_argument('--field-selector', metavar='SELECTOR',
+                        type=str, action='store', dest='field_selector',
+                        default='',
+                        help='Only list and watch CSRs with matching fields, as far as the API supports field selectors on CSRs (default: all CSRs)')  # noqa E501
+    parser.add_argument('--drop-unknown-nodes',
+                        action='store_true', dest='drop_unknown_nodes',
+                        help='Drop CSRs not requested by a node of the spec before evaluating them; they are neither logged nor kept track of')  # noqa E501
+    parser.add_argument('--raw-lists',
+                        action='store_true', dest='raw_lists',
+                        help='Decode listed CSRs into compact records of the fields needed for approval, instead of the full API models')  # noqa E501
+    parser.add_argument('--approve-bootstrap-csrs',
+                        action='store_true', dest='approve_bootstrap',
+                        help='Also approve the client CSRs requested by the node bootstrapper for nodes of the spec that have not joined yet, so that they join without a manual approval')  # noqa E501
+    parser.add_argument('--processes', metavar='N',
+                        type=int, action='store', dest='processes',
+                        default=0,
+                        help='Number of processes checking large batches of pending CSRs in parallel, 0 to check all CSRs in the main process (default: 0)')  # noqa E501
+    parser.add_argument('--parallel-min-batch', metavar='N',
+                        type=int, action='store', dest='parallel_min_batch',
+                        default=256,
+                        help='Minimum number of CSRs to check among a batch of listed CSRs for them to be checked in parallel (default: 256)')  # noqa E501
+    parser.add_argument('--cache-size', metavar='N',
+                        type=int, action='store', dest='cache_size',
+                        default=1024,
+                        help='Number of parsed pending CSRs and their decisions to keep between reconcile loops in watch mode, 0 to disable caching (default: 1024)')  # noqa E501
+    parser.add_argument('--concurrency', metavar='N',
+                        type=int, action='store', dest='concurrency',
+                        default=4,
+                        help='Maximum number of CSR approvals sent to the API in parallel (default: 4)')  # noqa E501
+    parser.add_argument('--rate-limit', metavar='QPS',
+                        type=float, action='store', dest='rate_limit',
+                        default=10.0,
+                        help='Maximum number of CSR approvals sent to the API per second, 0 for no limit (default: 10)')  # noqa E501
+    parser.add_argument('--reload-interval', metavar='SECONDS',
+                        type=int, action='store', dest='reload_interval',
+                        default=10,
+                        help='Interval in which the config file is checked for changes in watch mode (default: 10)')  # noqa E501
+    parser.add_argument('--metrics-port', metavar='PORT',
+                        type=int, action='store', dest='metrics_port',
+                        default=0,
+                        help='Port to expose Prometheus metrics on at /metrics, 0 to disable metrics (default: 0)')  # noqa E501
+    parser.add_argument('--metrics-address', metavar='ADDRESS',
+                        type=str, action='store', dest='metrics_address',
+                        default='0.0.0.0',
+                        help='Address to expose Prometheus metrics on (default: 0.0.0.0)')  # noqa E501
+    parser.add_argument('--watch',
+                        action='store_true', dest='watch',
+                        help='Keep running and approve CSRs as they are created, instead of processing all CSRs once')  # noqa E501
+    parser.add_argument('--leader-election',
+                        action='store_true', dest='leader_election',
+                        help='Run multiple replicas, of which only the one holding the lease processes CSRs')  # noqa E501
+    parser.add_argument('--shard',
+                        action='store_true', dest='shard',
+                        help='Run multiple replicas in watch mode, each processing the CSRs of its share of the nodes of the spec')  # noqa E501
+    parser.add_argument('--lease-name', metavar='NAME',
+                        type=str, action='store', dest='lease_name',
+                        default='openshift-csr-approver',
+                        help='Name of the lease for leader election, and prefix of the leases of shard members (default: openshift-csr-approver)')  # noqa E501
+    parser.add_argument('--lease-namespace', metavar='NAMESPACE',
+                        type=str, action='store', dest='lease_namespace',
+                        default='',
+                        help='Namespace of the leases (default: the namespace of the service account)')  # noqa E501
+    parser.add_argument('--lease-duration', metavar='SECONDS',
+                        type=int, action='store', dest='lease_duration',
+                        default=15,
+                        help='Time after which replicas take over from a replica that stopped renewing its lease (default: 15)')  # noqa E501
+    parser.add_argument('--identity', metavar='NAME',
+                        type=str, action='store', dest='identity',
+                        default=socket.gethostname(),
+                        help='Name of this replica in leases (default: the host name, i.e. the name of the pod)')  # noqa E501
+    parser.add_argument('--log-format', metavar='FORMAT',
+                        type=str, action='store', dest='log_format',
+                        choices=['pretty', 'json'], default='pretty',
+                        help='Format of log records, pretty or json with one object per line (default: pretty)')  # noqa E501
+    parser.add_argument('--log-level', metavar='LEVEL',
+                        type=str.upper, action='store', dest='log_level',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        default='INFO',
+                        help='Minimum level of logged records; CSRs that were already processed are only logged at DEBUG (default: INFO)')  # noqa E501
+    parsed = parser.parse_args(args)
+    if parsed.leader_election and parsed.shard:
+        parser.error('--leader-election and --shard are mutually exclusive')  # noqa E501
+    if parsed.shard and not parsed.watch:
+        parser.error('--shard requires --watch')
+    return parsed
+
+
+def lease_namespace(args: argparse.Namespace) -> str:
+    if args.lease_namespace:
+        return args.lease_namespace
+    # Service account token secrets hold the namespace as well
+    namespace_path = os.path.join(args.sa_path, 'namespace')
+    if os.path.exists(namespace_path):
+        with open(namespace_path, 'r') as nf:
+            return nf.read().strip()
+    return 'default'
+
+
+def _lost_lease() -> None:
+    # Other replicas take over once the lease expires, exit before that
+    # to not approve alongside them; the pod is restarted
+    logger.critical('Failed to renew lease, exiting')
+    os._exit(1)
 
 
 def main() -> None:
     args = parse_arguments(sys.argv[1:])
+    configure_logging(args.log_format, args.log_level)
+    decider = None
+    elector = None
+    membership = None
     try:
+        metrics_server = None
+        if args.metrics_port > 0:
+            from openshift_csr_approver.metrics.server import MetricsServer
+            metrics_server = MetricsServer(args.metrics_address,
+                                           args.metrics_port)
+            metrics_server.start()
         client = build_k8s_client(args)
-        node_csr_spec = parse_node_csr_spec(args.cm_path)
-        run_csr_approval(client, node_csr_spec)
+        node_exists: Optional[NodeLookup] = None
+        if args.approve_bootstrap:
+            node_exists = api_node_exists(k8s.CoreV1Api(client))
+        rate_limiter = RateLimiter(args.rate_limit, args.concurrency)
+        selector = CsrSelector(args.label_selector, args.field_selector,
+                               drop_unknown_nodes=args.drop_unknown_nodes)
+        if args.processes > 0:
+            decider = DecisionPool(args.processes, args.parallel_min_batch)
+        if args.leader_election or args.shard:
+            lease_store = KubernetesLeaseStore(
+                k8s.CoordinationV1Api(client), lease_namespace(args))
+            # Renew well within the lease duration, and give up before
+            # other replicas take over
+            renew_period = args.lease_duration / 5
+            renew_deadline = args.lease_duration * 2 / 3
+        if args.leader_election:
+            elector = LeaderElector(lease_store, args.lease_name,
+                                    args.identity, args.lease_duration)
+            logger.info(f'Waiting for lease {args.lease_name} as {args.identity}')  # noqa E501
+            if not elector.acquire(renew_period, wait=args.watch):
+                logger.info('Another replica holds the lease, not processing CSRs')  # noqa E501
+                return
+            keep_renewing(elector.try_acquire_or_renew, renew_period,
+                          renew_deadline, _lost_lease)
+        if args.shard:
+            membership = ShardMembership(lease_store, f'{args.lease_name}-',
+                                         args.identity, args.lease_duration)
+            if not membership.renew():
+                raise RuntimeError(f'Failed to create lease {membership.lease_name}')  # noqa E501
+            keep_renewing(membership.renew, renew_period, renew_deadline,
+                          _lost_lease)
+        if args.watch:
+            spec_watcher = SpecWatcher(args.cm_path, args.approve_bootstrap,
+                                       membership, node_exists)
+            selector.update(spec_watcher.spec)
+            # Caching only pays off when CSRs are evaluated repeatedly
+            cache = CsrCache(args.cache_size)
+            store = CsrStore()
+            if metrics_server is not None:
+                metrics_server.add_route('/debug/csrs', store.debug_route)
+            watch_csr_approval(client, spec_watcher, args.page_size, cache,
+                               args.concurrency, rate_limiter,
+                               args.reload_interval, store=store,
+                               selector=selector, raw=args.raw_lists,
+                               decider=decider)
+        else:
+            node_csr_spec = parse_node_csr_spec(args.cm_path,
+                                                args.approve_bootstrap,
+                                                node_exists)
+            selector.update(node_csr_spec)
+            run_csr_approval(client, node_csr_spec, args.page_size,
+                             concurrency=args.concurrency,
+                             rate_limiter=rate_limiter,
+                             selector=selector, raw=args.raw_lists,
+                             decider=decider)
     except BaseException as e:
         logger.critical(e, exc_info=True)
         sys.exit(1)
+    finally:
+        if decider is not None:
+            decider.close()
+        # Let other replicas take over right away
+        if elector is not None:
+            elector.release()
+        if membership is not None:
+            membership.release()
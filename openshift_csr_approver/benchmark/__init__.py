@@ -0,0 +1,408 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import os
+import sys
+import gc
+import time
+import json
+import random
+import argparse
+import base64
+import logging
+import ipaddress
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import yaml
+import kubernetes.client as k8s
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from openshift_csr_approver import __version__
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver.logging import logger
+from openshift_csr_approver.records import parse_csr_list
+
+
+# Benchmarks of the decision pipeline on synthetic clusters.
+#
+# The generated CSRs mimic what a cluster accumulates over time: mostly
+# CSRs that were already approved, some denied ones, pending kubelet
+# serving CSRs of known nodes, and pending CSRs that must not be
+# approved (SANs not in the spec, unknown nodes, other requestors).
+# Results are written as JSON, which can be compared against the
+# results of another version with --compare.
+
+
+# Kinds of generated CSRs and their default share of all CSRs
+DEFAULT_MIX: Dict[str, float] = {
+    'approved': 0.60,      # already approved
+    'denied': 0.02,        # already denied
+    'valid': 0.20,         # pending, to be approved
+    'bad-san': 0.08,       # pending, SAN not allowed for the node
+    'unknown-node': 0.05,  # pending, node not in the spec
+    'not-node': 0.03,      # pending, not requested by a node
+    'bad-usages': 0.02,    # pending, wrong usages
+}
+
+DEFAULT_SCENARIOS = [(10, 10), (1000, 100), (10000, 1000), (50000, 5000)]
+
+SERVING_USAGES = ['digital signature', 'key encipherment', 'server auth']
+NODE_GROUPS = ['system:nodes', 'system:authenticated']
+
+
+def node_name(i: int) -> str:
+    return f'node-{i:05d}'
+
+
+def generate_spec(num_nodes: int) -> Dict[str, Dict[str, List[str]]]:
+    # Raw node CSR spec, as loaded from the ConfigMap
+    spec = {}
+    for i in range(num_nodes):
+        name = node_name(i)
+        spec[name] = {
+            'names': [name, f'{name}.os.example.com'],
+            'ips': [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}',
+                    f'192.168.{i // 256 % 256}.{i % 256}'],
+        }
+    return spec
+
+
+class CsrGenerator:
+    """Generates synthetic CSR resources for the nodes of a raw spec.
+
+    Generating and signing a request for every CSR would dominate the
+    run time for large clusters, so the encoded requests are generated
+    once per node and kind, all signed by the same key.
+    """
+
+    def __init__(self, spec: Dict[str, Dict[str, List[str]]],
+                 seed: int = 0, start: Optional[datetime] = None,
+                 interval: float = 1.0) -> None:
+        self.spec = spec
+        # The i-th CSR is created interval seconds after the previous one
+        if start is None:
+            start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.start = start
+        self.interval = interval
+        self.nodes = sorted(spec.keys())
+        self.random = random.Random(seed)
+        self._key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+        self._requests: Dict[Tuple[str, str], str] = {}
+
+    def _encode_request(self, cn: str, org: str, names: Sequence[str],
+                        ips: Sequence[str]) -> str:
+        sans: List[x509.GeneralName] = [x509.DNSName(n) for n in names]
+        for ip in ips:
+            sans.append(x509.IPAddress(ipaddress.ip_address(ip)))
+        builder = x509.CertificateSigningRequestBuilder().subject_name(
+            x509.Name([
+                x509.NameAttribute(NameOID.ORGANIZATION_NAME, org),
+                x509.NameAttribute(NameOID.COMMON_NAME, cn),
+            ])
+        ).add_extension(x509.SubjectAlternativeName(sans), critical=False)
+        request = builder.sign(self._key, hashes.SHA256(), default_backend())
+        pem = request.public_bytes(serialization.Encoding.PEM)
+        return base64.b64encode(pem).decode()
+
+    def _request(self, nodename: str, kind: str) -> str:
+        key = (nodename, kind)
+        if key not in self._requests:
+            node = self.spec.get(nodename, {'names': [nodename], 'ips': []})
+            names = list(node['names'])
+            if kind == 'bad-san':
+                names.append(f'{nodename}.evil.example.com')
+            self._requests[key] = self._encode_request(
+                f'{oca.NODE_USERNAME_PREFIX}{nodename}', 'system:nodes',
+                names, node['ips'])
+        return self._requests[key]
+
+    def csr(self, i: int, kind: str) -> k8s.V1beta1CertificateSigningRequest:
+        nodename = self.random.choice(self.nodes)
+        username = f'{oca.NODE_USERNAME_PREFIX}{nodename}'
+        groups = NODE_GROUPS
+        usages = SERVING_USAGES
+        request_kind = 'valid'
+        if kind == 'bad-san':
+            request_kind = kind
+        elif kind == 'unknown-node':
+            nodename = f'unknown-{i:05d}'
+            username = f'{oca.NODE_USERNAME_PREFIX}{nodename}'
+        elif kind == 'not-node':
+            username = 'system:serviceaccount:openshift-machine-config-operator:node-bootstrapper'  # noqa E501
+            groups = ['system:serviceaccounts', 'system:authenticated']
+        elif kind == 'bad-usages':
+            usages = ['digital signature', 'key encipherment',
+                      'client auth']
+        conditions = None
+        created = self.start + timedelta(seconds=i * self.interval)
+        if kind in ['approved', 'denied']:
+            conditions = [k8s.V1beta1CertificateSigningRequestCondition(
+                type=kind.capitalize(),
+                reason='AutoApproved' if kind == 'approved' else 'Denied',
+                last_update_time=created
+            )]
+        uid = f'00000000-0000-4000-8000-{i:012d}'
+        return k8s.V1beta1CertificateSigningRequest(
+            api_version='certificates.k8s.io/v1beta1',
+            kind='CertificateSigningRequest',
+            metadata=k8s.V1ObjectMeta(
+                name=f'csr-{i:05d}',
+                uid=uid,
+                resource_version=str(i + 1),
+                creation_timestamp=created
+            ),
+            spec=k8s.V1beta1CertificateSigningRequestSpec(
+                groups=groups,
+                uid=uid,
+                usages=usages,
+                username=username,
+                request=self._request(nodename, request_kind)
+            ),
+            status=k8s.V1beta1CertificateSigningRequestStatus(
+                conditions=conditions
+            )
+        )
+
+    def generate(self, num_csrs: int,
+                 mix: Optional[Dict[str, float]] = None) \
+            -> List[k8s.V1beta1CertificateSigningRequest]:
+        if mix is None:
+            mix = DEFAULT_MIX
+        kinds = list(mix.keys())
+        weights = [mix[kind] for kind in kinds]
+        return [
+            self.csr(i, self.random.choices(kinds, weights)[0])
+            for i in range(num_csrs)
+        ]
+
+
+class _Response:
+    # Stands in for the HTTP response deserialized by the client
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    # Best of repeat runs, and the peak memory allocated during an
+    # extra run, as tracing allocations slows down the run itself
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'seconds': min(timings),
+        'mean_seconds': sum(timings) / len(timings),
+        'peak_memory_bytes': peak,
+    }
+
+
+# Imports the approver in a fresh interpreter and reports the time it
+# took and the number of modules it loaded
+STARTUP_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import openshift_csr_approver.approver
+print(time.perf_counter() - start, len(sys.modules))
+'''
+
+
+def measure_startup(repeat: int) -> Dict[str, Any]:
+    # Best of repeat cold imports, each in its own process as imports
+    # are cached by the interpreter
+    # The package may be run from a checkout rather than installed
+    root = os.path.dirname(os.path.dirname(os.path.abspath(oca.__file__)))
+    env = dict(os.environ)
+    paths = [os.path.dirname(root)]
+    if env.get('PYTHONPATH'):
+        paths.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+    timings = []
+    modules = 0
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT], check=True, env=env,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+        seconds, modules_loaded = output.split()
+        timings.append(float(seconds))
+        modules = int(modules_loaded)
+    return {
+        'benchmark': 'startup',
+        'csrs': 0,
+        'nodes': 0,
+        'items': 1,
+        'seconds': min(timings),
+        'mean_seconds': sum(timings) / len(timings),
+        'peak_memory_bytes': 0,
+        'modules': modules,
+    }
+
+
+def run_scenario(num_csrs: int, num_nodes: int, repeat: int = 3,
+                 seed: int = 0) -> List[Dict[str, Any]]:
+    raw_spec = generate_spec(num_nodes)
+    spec = oca.compile_node_csr_spec(raw_spec)
+    csrs = CsrGenerator(raw_spec, seed).generate(num_csrs)
+    # Only CSRs that are neither approved nor denied are parsed
+    undecided = [
+        csr for csr in csrs if csr.status.conditions is None
+    ]
+    parsed = [(csr, oca.parse_csr(csr)) for csr in undecided]
+    # Drops CSRs not requested by nodes of the spec before evaluation
+    selector = oca.CsrSelector(node_csr_spec=spec, drop_unknown_nodes=True)
+    # The body of a response listing all CSRs
+    client = k8s.ApiClient()
+    data = json.dumps(client.sanitize_for_serialization(
+        k8s.V1beta1CertificateSigningRequestList(
+            api_version='certificates.k8s.io/v1beta1',
+            kind='CertificateSigningRequestList',
+            metadata=k8s.V1ListMeta(resource_version=str(num_csrs)),
+            items=csrs
+        )
+    )).encode()
+    response = _Response(data)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml') as f:
+        yaml.safe_dump(raw_spec, f)
+        f.flush()
+        benchmarks: List[Tuple[str, int, Callable[[], Any]]] = [
+            # Decoding a list response into the client's models, and
+            # into records
+            ('deserialize_models', num_csrs,
+             lambda: client.deserialize(
+                 response, 'V1beta1CertificateSigningRequestList')),
+            ('deserialize_records', num_csrs,
+             lambda: parse_csr_list(data)),
+            ('parse_node_csr_spec', num_nodes,
+             lambda: oca.parse_node_csr_spec(f.name)),
+            ('parse_csr', len(undecided),
+             lambda: [oca.parse_csr(csr) for csr in undecided]),
+            ('extract_sans', len(parsed),
+             lambda: [oca.extract_sans(info) for _, info in parsed]),
+            ('check_approve_csr', len(parsed),
+             lambda: [oca.check_approve_csr(csr, info, spec)
+                      for csr, info in parsed]),
+            ('iterate_csrs', num_csrs,
+             lambda: list(oca.iterate_csrs(csrs, spec))),
+            ('iterate_csrs_drop_unknown_nodes', num_csrs,
+             lambda: list(oca.iterate_csrs(csrs, spec,
+                                           selector=selector))),
+        ]
+        results = []
+        for name, items, fn in benchmarks:
+            result: Dict[str, Any] = {
+                'benchmark': name,
+                'csrs': num_csrs,
+                'nodes': num_nodes,
+                'items': items,
+            }
+            result.update(measure(fn, repeat))
+            result['items_per_second'] = \
+                items / result['seconds'] if result['seconds'] > 0 else 0.0
+            results.append(result)
+    return results
+
+
+def run_benchmarks(scenarios: Sequence[Tuple[int, int]], repeat: int = 3,
+                   seed: int = 0) -> Dict[str, Any]:
+    # The approver logs every CSR, which would dominate the timings
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        results = [measure_startup(repeat)]
+        for num_csrs, num_nodes in scenarios:
+            results.extend(run_scenario(num_csrs, num_nodes, repeat, seed))
+    finally:
+        logger.setLevel(level)
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any]) \
+        -> List[Dict[str, Any]]:
+    # Ratio of the current to the baseline timing of each benchmark
+    # present in both; a ratio above 1 is a slowdown
+    def key(result: Dict[str, Any]) -> Tuple[str, int, int]:
+        return result['benchmark'], result['csrs'], result['nodes']
+    previous = {key(result): result for result in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        base = previous.get(key(result))
+        if base is None or base['seconds'] <= 0:
+            continue
+        comparison.append({
+            'benchmark': result['benchmark'],
+            'csrs': result['csrs'],
+            'nodes': result['nodes'],
+            'time_ratio': result['seconds'] / base['seconds'],
+            'memory_ratio': (
+                result['peak_memory_bytes'] / base['peak_memory_bytes']
+                if base['peak_memory_bytes'] > 0 else None
+            ),
+        })
+    return comparison
+
+
+def parse_scenario(value: str) -> Tuple[int, int]:
+    try:
+        csrs, nodes = value.split(':')
+        return int(csrs), int(nodes)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'invalid scenario {value}, expected <csrs>:<nodes>')
+
+
+def parse_arguments(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the CSR decision pipeline on synthetic clusters')  # noqa E501
+    parser.add_argument('--scenario', type=parse_scenario, action='append',
+                        dest='scenarios',
+                        help='Number of CSRs and nodes as <csrs>:<nodes>, can be repeated (default: 10:10, 1000:100, 10000:1000, 50000:5000)')  # noqa E501
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs per benchmark, the best run is reported (default: 3)')  # noqa E501
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the CSR generator (default: 0)')
+    parser.add_argument('--output', default='-',
+                        help='File to write the JSON results to (default: stdout)')  # noqa E501
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON results of a previous run to compare against')  # noqa E501
+    return parser.parse_args(args)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_arguments(sys.argv[1:] if argv is None else argv)
+    report = run_benchmarks(args.scenarios or DEFAULT_SCENARIOS,
+                            args.repeat, args.seed)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            report['comparison'] = compare_results(json.load(f), report)
+    output = json.dumps(report, indent=2) + '\n'
+    if args.output == '-':
+        sys.stdout.write(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        logger.info(f'Wrote benchmark results to {os.path.abspath(args.output)}')  # noqa E501
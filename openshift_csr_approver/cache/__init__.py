@@ -0,0 +1,142 @@
+from typing import Any, Callable, Dict, Generic, Hashable, Iterable, \
+    Optional, Tuple, TypeVar
+
+from collections import OrderedDict
+
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """A bounded mapping that evicts the least recently used entry once
+    it is full."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[K, V]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    def keys(self) -> Iterable[K]:
+        return list(self._data.keys())
+
+    def get(self, key: K) -> Optional[V]:
+        try:
+            value = self._data[key]
+        except KeyError:
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def peek(self, key: K) -> Optional[V]:
+        # Like get, but without marking the entry as recently used
+        return self._data.get(key)
+
+    def put(self, key: K, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class CsrCache:
+    """Caches the results of evaluating CSRs across reconcile loops.
+
+    A CSR's request is immutable, so the parsed request is cached by the
+    CSR's uid alone.  Decisions additionally depend on the rest of the
+    CSR (e.g. its conditions) and on the node CSR spec, and are only
+    reused as long as the CSR's resource version and the generation of
+    the spec are unchanged.  Both caches only hold one entry per uid,
+    which allows evicting CSRs that no longer exist.  Only CSRs that
+    pass the cheap checks, i.e. pending CSRs of nodes, are cached.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.parsed: LRUCache[str, Any] = LRUCache(maxsize)
+        self.decisions: LRUCache[str, Tuple[Tuple[Any, Any], Any]] \
+            = LRUCache(maxsize)
+        self.parsed_hits = 0
+        self.parsed_misses = 0
+        self.decision_hits = 0
+        self.decision_misses = 0
+
+    @staticmethod
+    def _version(csr: Any, spec_generation: Any) -> Tuple[Any, Any]:
+        return csr.metadata.resource_version, spec_generation
+
+    def parse(self, csr: Any, parse: Callable[[Any], Any]) -> Any:
+        uid = csr.metadata.uid
+        parsed = self.parsed.get(uid)
+        if parsed is not None:
+            self.parsed_hits += 1
+            return parsed
+        self.parsed_misses += 1
+        parsed = parse(csr)
+        self.parsed.put(uid, parsed)
+        return parsed
+
+    def get_decision(self, csr: Any, spec_generation: Any) -> Optional[Any]:
+        entry = self.decisions.get(csr.metadata.uid)
+        # Decisions about an older version of the CSR, or made with
+        # another spec, are stale
+        if entry is None or entry[0] != self._version(csr, spec_generation):
+            self.decision_misses += 1
+            return None
+        self.decision_hits += 1
+        return entry[1]
+
+    def cached(self, csr: Any, spec_generation: Any) -> bool:
+        # Whether evaluating csr would hit the cache, without counting
+        # as a hit or miss
+        if csr.metadata.uid in self.parsed:
+            return True
+        entry = self.decisions.peek(csr.metadata.uid)
+        return entry is not None \
+            and entry[0] == self._version(csr, spec_generation)
+
+    def put_decision(self, csr: Any, spec_generation: Any,
+                     decision: Any) -> None:
+        self.decisions.put(csr.metadata.uid,
+                           (self._version(csr, spec_generation), decision))
+
+    def evict(self, uid: str) -> None:
+        self.parsed.pop(uid)
+        self.decisions.pop(uid)
+
+    def evict_decision(self, uid: str) -> None:
+        self.decisions.pop(uid)
+
+    def retain(self, uids: Iterable[str]) -> None:
+        # Evict all CSRs not in uids, e.g. CSRs that were deleted since
+        # the last list
+        keep = set(uids)
+        for cache in [self.parsed, self.decisions]:
+            for uid in cache.keys():
+                if uid not in keep:
+                    cache.pop(uid)
+
+    def clear_decisions(self) -> None:
+        self.decisions.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'parsed_size': len(self.parsed),
+            'parsed_hits': self.parsed_hits,
+            'parsed_misses': self.parsed_misses,
+            'decision_size': len(self.decisions),
+            'decision_hits': self.decision_hits,
+            'decision_misses': self.decision_misses,
+        }
@@ -0,0 +1,418 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import copy
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+
+import kubernetes.client as k8s
+from kubernetes.client.rest import ApiException
+
+from openshift_csr_approver.logging import logger
+
+
+# Coordination of multiple replicas of the approver through Leases
+# (coordination.k8s.io/v1), either by electing a single leader that
+# approves all CSRs, or by sharding the nodes of the spec across all
+# live replicas.
+#
+# Like client-go's leader election, leases are considered expired once
+# they were not seen to change for their duration by the local clock,
+# so the clocks of the replicas need not be in sync.
+
+
+class LeaseConflict(Exception):
+    """The lease was created or changed concurrently by someone else."""
+
+
+class Lease:
+
+    # version is the resource version the lease was read at, updates
+    # of a lease that changed since are rejected
+    __slots__ = ('name', 'holder', 'duration', 'acquire_time', 'renew_time',
+                 'transitions', 'version')
+
+    def __init__(self, name: str, holder: str, duration: int,
+                 acquire_time: Optional[datetime] = None,
+                 renew_time: Optional[datetime] = None,
+                 transitions: int = 0,
+                 version: Optional[str] = None) -> None:
+        self.name = name
+        self.holder = holder
+        self.duration = duration
+        self.acquire_time = acquire_time
+        self.renew_time = renew_time
+        self.transitions = transitions
+        self.version = version
+
+
+class LeaseStore:
+    """Where leases are kept.
+
+    Updates must carry the version the lease was read at, and fail with
+    LeaseConflict if it changed since.  Deletions do so if given the
+    version.
+    """
+
+    def get(self, name: str) -> Optional[Lease]:
+        raise NotImplementedError()
+
+    def list(self, prefix: str = '') -> List[Lease]:
+        raise NotImplementedError()
+
+    def create(self, lease: Lease) -> Lease:
+        raise NotImplementedError()
+
+    def update(self, lease: Lease) -> Lease:
+        raise NotImplementedError()
+
+    def delete(self, name: str, version: Optional[str] = None) -> None:
+        raise NotImplementedError()
+
+
+class FakeLeaseStore(LeaseStore):
+    """In-memory leases, with the optimistic concurrency of the API."""
+
+    def __init__(self) -> None:
+        self._leases: Dict[str, Lease] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _put(self, lease: Lease) -> Lease:
+        self._version += 1
+        stored = copy.copy(lease)
+        stored.version = str(self._version)
+        self._leases[lease.name] = stored
+        return copy.copy(stored)
+
+    def get(self, name: str) -> Optional[Lease]:
+        with self._lock:
+            lease = self._leases.get(name)
+            return copy.copy(lease) if lease is not None else None
+
+    def list(self, prefix: str = '') -> List[Lease]:
+        with self._lock:
+            return [
+                copy.copy(lease) for name, lease in self._leases.items()
+                if name.startswith(prefix)
+            ]
+
+    def create(self, lease: Lease) -> Lease:
+        with self._lock:
+            if lease.name in self._leases:
+                raise LeaseConflict(f'Lease {lease.name} already exists')
+            return self._put(lease)
+
+    def update(self, lease: Lease) -> Lease:
+        with self._lock:
+            stored = self._leases.get(lease.name)
+            if stored is None or stored.version != lease.version:
+                raise LeaseConflict(f'Lease {lease.name} was changed')
+            return self._put(lease)
+
+    def delete(self, name: str, version: Optional[str] = None) -> None:
+        with self._lock:
+            stored = self._leases.get(name)
+            if stored is None:
+                return
+            if version is not None and stored.version != version:
+                raise LeaseConflict(f'Lease {name} was changed')
+            del self._leases[name]
+
+
+def format_micro_time(value: Optional[datetime]) -> Optional[str]:
+    # The API only accepts MicroTime with exactly six fractional digits,
+    # which isoformat() leaves out if they are zero
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class KubernetesLeaseStore(LeaseStore):
+    """Leases of a namespace of the Kubernetes API."""
+
+    def __init__(self, api: k8s.CoordinationV1Api, namespace: str) -> None:
+        self.api = api
+        self.namespace = namespace
+
+    @staticmethod
+    def _from_model(model: k8s.V1Lease) -> Lease:
+        spec = model.spec
+        return Lease(model.metadata.name, spec.holder_identity or '',
+                     spec.lease_duration_seconds or 0,
+                     spec.acquire_time, spec.renew_time,
+                     spec.lease_transitions or 0,
+                     model.metadata.resource_version)
+
+    @staticmethod
+    def _to_body(lease: Lease) -> Dict[str, object]:
+        # A plain body, so that the times are sent as MicroTime
+        metadata: Dict[str, object] = {'name': lease.name}
+        if lease.version is not None:
+            metadata['resourceVersion'] = lease.version
+        return {
+            'apiVersion': 'coordination.k8s.io/v1',
+            'kind': 'Lease',
+            'metadata': metadata,
+            'spec': {
+                'holderIdentity': lease.holder,
+                'leaseDurationSeconds': lease.duration,
+                'acquireTime': format_micro_time(lease.acquire_time),
+                'renewTime': format_micro_time(lease.renew_time),
+                'leaseTransitions': lease.transitions,
+            },
+        }
+
+    def get(self, name: str) -> Optional[Lease]:
+        try:
+            return self._from_model(
+                self.api.read_namespaced_lease(name, self.namespace))
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def list(self, prefix: str = '') -> List[Lease]:
+        leases = self.api.list_namespaced_lease(self.namespace)
+        return [
+            self._from_model(lease) for lease in leases.items
+            if lease.metadata.name.startswith(prefix)
+        ]
+
+    def create(self, lease: Lease) -> Lease:
+        try:
+            return self._from_model(self.api.create_namespaced_lease(
+                self.namespace, self._to_body(lease)))
+        except ApiException as e:
+            if e.status == 409:
+                raise LeaseConflict(f'Lease {lease.name} already exists')
+            raise
+
+    def update(self, lease: Lease) -> Lease:
+        try:
+            return self._from_model(self.api.replace_namespaced_lease(
+                lease.name, self.namespace, self._to_body(lease)))
+        except ApiException as e:
+            if e.status == 409:
+                raise LeaseConflict(f'Lease {lease.name} was changed')
+            raise
+
+    def delete(self, name: str, version: Optional[str] = None) -> None:
+        kwargs = {}
+        if version is not None:
+            kwargs['body'] = k8s.V1DeleteOptions(
+                preconditions=k8s.V1Preconditions(resource_version=version))
+        try:
+            self.api.delete_namespaced_lease(name, self.namespace, **kwargs)
+        except ApiException as e:
+            if e.status == 409:
+                raise LeaseConflict(f'Lease {name} was changed')
+            if e.status != 404:
+                raise
+
+
+class _Observer:
+    # Remembers when, by the local clock, leases were last seen to
+    # change
+
+    def __init__(self, clock: Callable[[], float]) -> None:
+        self.clock = clock
+        self._seen: Dict[str, Tuple[Optional[str], float]] = {}
+
+    def expired(self, lease: Lease) -> bool:
+        now = self.clock()
+        seen = self._seen.get(lease.name)
+        if seen is None or seen[0] != lease.version:
+            self._seen[lease.name] = (lease.version, now)
+            return False
+        return now >= seen[1] + lease.duration
+
+    def forget(self, names: Sequence[str]) -> None:
+        for name in list(self._seen.keys()):
+            if name not in names:
+                del self._seen[name]
+
+
+class LeaderElector:
+    """Elects a single leader among the replicas through a Lease.
+
+    The leader renews the lease well within its duration.  Other
+    replicas take over once the lease was not renewed for its duration,
+    or right away once the leader released it.
+    """
+
+    def __init__(self, store: LeaseStore, name: str, identity: str,
+                 lease_duration: int = 15,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.store = store
+        self.name = name
+        self.identity = identity
+        self.lease_duration = lease_duration
+        self.is_leader = False
+        self._observer = _Observer(clock)
+
+    def try_acquire_or_renew(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            lease = self.store.get(self.name)
+            if lease is None:
+                self.store.create(Lease(
+                    self.name, self.identity, self.lease_duration, now, now))
+            else:
+                if lease.holder != self.identity:
+                    if lease.holder and not self._observer.expired(lease):
+                        self.is_leader = False
+                        return False
+                    lease.holder = self.identity
+                    lease.acquire_time = now
+                    lease.transitions += 1
+                lease.renew_time = now
+                lease.duration = self.lease_duration
+                self.store.update(lease)
+        except LeaseConflict:
+            self.is_leader = False
+            return False
+        if not self.is_leader:
+            logger.info(f'Became the leader as {self.identity}')
+        self.is_leader = True
+        return True
+
+    def acquire(self, retry_period: float, wait: bool = True) -> bool:
+        # Blocks until this replica leads; without wait, only tries once
+        while True:
+            try:
+                if self.try_acquire_or_renew():
+                    return True
+            except Exception as e:
+                logger.error(f'Failed to acquire lease {self.name}: {e}')
+            if not wait:
+                return False
+            time.sleep(retry_period)
+
+    def release(self) -> None:
+        # Lets another replica take over without waiting for the lease
+        # to expire
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        try:
+            lease = self.store.get(self.name)
+            if lease is None or lease.holder != self.identity:
+                return
+            lease.holder = ''
+            self.store.update(lease)
+        except Exception as e:
+            # The lease expires anyway
+            logger.error(f'Failed to release lease {self.name}: {e}')
+
+
+def shard_owner(nodename: str, members: Sequence[str]) -> str:
+    # Rendezvous hashing: a node belongs to the member with the highest
+    # hash of both their names.  When a member joins or leaves, only the
+    # nodes it gains or loses change owners.
+    return max(members, key=lambda member: hashlib.sha256(
+        f'{member}/{nodename}'.encode()).digest())
+
+
+class ShardMembership:
+    """Tracks the live replicas sharing the nodes of the spec.
+
+    Every replica holds a lease named <prefix><identity>, which it
+    renews well within its duration.  The members are the replicas
+    whose leases did not expire; each approves the CSRs of the nodes
+    that shard_owner assigns to it.
+
+    Expired leases of other replicas are deleted as soon as they are
+    seen, so that the leases of replicas that are gone for good, e.g.
+    pods with generated names, don't pile up.  A replica can only tell
+    that a lease expired once it watched it for its duration, so a
+    replica that just started counts leases that are not yet deleted as
+    members for that long.
+    """
+
+    def __init__(self, store: LeaseStore, prefix: str, identity: str,
+                 lease_duration: int = 15,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.store = store
+        self.prefix = prefix
+        self.identity = identity
+        self.lease_duration = lease_duration
+        self._observer = _Observer(clock)
+
+    @property
+    def lease_name(self) -> str:
+        return f'{self.prefix}{self.identity}'
+
+    def renew(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            lease = self.store.get(self.lease_name)
+            if lease is None:
+                self.store.create(Lease(
+                    self.lease_name, self.identity, self.lease_duration,
+                    now, now))
+            else:
+                lease.holder = self.identity
+                lease.renew_time = now
+                lease.duration = self.lease_duration
+                self.store.update(lease)
+        except LeaseConflict:
+            return False
+        return True
+
+    def members(self) -> List[str]:
+        leases = self.store.list(self.prefix)
+        self._observer.forget([lease.name for lease in leases])
+        members = {self.identity}
+        for lease in leases:
+            if lease.name == self.lease_name:
+                continue
+            if not self._observer.expired(lease):
+                if lease.holder:
+                    members.add(lease.holder)
+                continue
+            try:
+                # Unless it was renewed in the meantime
+                self.store.delete(lease.name, lease.version)
+                logger.info(f'Deleted expired lease {lease.name}')
+            except LeaseConflict:
+                pass
+            except Exception as e:
+                logger.error(f'Failed to delete expired lease {lease.name}: {e}')  # noqa E501
+        return sorted(members)
+
+    def release(self) -> None:
+        try:
+            self.store.delete(self.lease_name)
+        except Exception as e:
+            # The lease expires anyway
+            logger.error(f'Failed to release lease {self.lease_name}: {e}')
+
+
+def keep_renewing(renew: Callable[[], bool], period: float,
+                  deadline: float, on_lost: Callable[[], None],
+                  clock: Callable[[], float] = time.monotonic) \
+        -> threading.Event:
+    # Calls renew every period seconds in a daemon thread.  Once renew
+    # failed for longer than deadline, on_lost is called and renewing
+    # stops.  Setting the returned event stops renewing as well.
+    stop = threading.Event()
+
+    def run() -> None:
+        renewed = clock()
+        while not stop.wait(period):
+            try:
+                ok = renew()
+            except Exception as e:
+                logger.error(f'Failed to renew lease: {e}')
+                ok = False
+            if ok:
+                renewed = clock()
+            elif clock() - renewed > deadline:
+                on_lost()
+                return
+
+    thread = threading.Thread(target=run, name='lease-renewal', daemon=True)
+    thread.start()
+    return stop
@@ -0,0 +1,510 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import yaml
+import kubernetes.client as k8s
+
+from openshift_csr_approver.logging import logger
+
+
+# An in-process fake of the certificates.k8s.io/v1beta1 CSR endpoints
+# of the Kubernetes API, for load testing the approver without a
+# cluster:
+#
+#   GET .../certificatesigningrequests          list, with limit/continue
+#   GET .../certificatesigningrequests?watch=1  watch, from resourceVersion
+#   GET .../certificatesigningrequests/<name>   get
+#   PUT .../certificatesigningrequests/<name>/approval
+#
+# The server keeps a bounded history of watch events; watches and list
+# continuations from before it are answered with 410 Gone, like an API
+# server whose etcd history was compacted.  Latency and errors can be
+# injected into any request.
+
+API_PATH = '/apis/certificates.k8s.io/v1beta1/certificatesigningrequests'
+API_VERSION = 'certificates.k8s.io/v1beta1'
+
+ENDPOINTS = ['list', 'watch', 'get', 'approve']
+
+# Statuses that can be injected, and the endpoints they apply to
+INJECTABLE_ERRORS: Dict[int, List[str]] = {
+    409: ['approve'],
+    410: ['list', 'watch'],
+    429: ENDPOINTS,
+    500: ENDPOINTS,
+    503: ENDPOINTS,
+}
+
+REASONS = {
+    404: 'NotFound',
+    409: 'Conflict',
+    410: 'Expired',
+    429: 'TooManyRequests',
+    500: 'InternalError',
+    503: 'ServiceUnavailable',
+}
+
+
+class ApiError(Exception):
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'kind': 'Status',
+            'apiVersion': 'v1',
+            'metadata': {},
+            'status': 'Failure',
+            'message': self.message,
+            'reason': REASONS.get(self.code, 'Unknown'),
+            'code': self.code,
+        }
+
+
+class Faults:
+    """Latency and errors injected into the requests to the server.
+
+    error_rates maps HTTP statuses from INJECTABLE_ERRORS to the
+    probability of a request to an endpoint they apply to failing with
+    that status.  Given endpoints, errors are only injected into
+    requests to these.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 error_rates: Optional[Dict[int, float]] = None,
+                 seed: int = 0,
+                 endpoints: Optional[Iterable[str]] = None) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rates = dict(error_rates or {})
+        self.endpoints = set(ENDPOINTS if endpoints is None else endpoints)
+        for code in self.error_rates:
+            if code not in INJECTABLE_ERRORS:
+                raise ValueError(f'Cannot inject status {code}')
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self) -> None:
+        latency = self.latency
+        if self.jitter > 0:
+            with self._lock:
+                latency += self._random.uniform(0, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def error(self, endpoint: str) -> Optional[int]:
+        for code, rate in sorted(self.error_rates.items()):
+            if endpoint not in INJECTABLE_ERRORS[code] \
+                    or endpoint not in self.endpoints:
+                continue
+            with self._lock:
+                failed = self._random.random() < rate
+            if failed:
+                return code
+        return None
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class CsrState:
+    """The CSRs of the fake API server and their history of events."""
+
+    def __init__(self, history: int = 1000) -> None:
+        self._csrs: Dict[str, Dict[str, Any]] = {}
+        self._events: deque = deque(maxlen=history)
+        self._resource_version = 0
+        # Resource version of the newest event dropped from the history
+        self._compacted = 0
+        self._serializer = k8s.ApiClient()
+        self._cond = threading.Condition()
+        self.closed = False
+
+    @property
+    def resource_version(self) -> int:
+        return self._resource_version
+
+    def __len__(self) -> int:
+        return len(self._csrs)
+
+    def _record(self, etype: str, obj: Dict[str, Any]) -> None:
+        # Caller must hold the lock
+        if len(self._events) == self._events.maxlen:
+            self._compacted = self._events[0][0]
+        self._events.append((self._resource_version, etype, obj))
+        self._cond.notify_all()
+
+    def _bump(self, obj: Dict[str, Any]) -> Dict[str, Any]:
+        self._resource_version += 1
+        obj = json.loads(json.dumps(obj))
+        obj['metadata']['resourceVersion'] = str(self._resource_version)
+        return obj
+
+    def add(self, csr: Any) -> Dict[str, Any]:
+        # csr is a V1beta1CertificateSigningRequest or its JSON form
+        obj = self._serializer.sanitize_for_serialization(csr)
+        obj.setdefault('apiVersion', API_VERSION)
+        obj.setdefault('kind', 'CertificateSigningRequest')
+        metadata = obj.setdefault('metadata', {})
+        metadata.setdefault('creationTimestamp', _now())
+        obj.setdefault('status', {})
+        with self._cond:
+            name = metadata['name']
+            metadata.setdefault('uid', f'fake-{self._resource_version + 1}')
+            etype = 'MODIFIED' if name in self._csrs else 'ADDED'
+            obj = self._bump(obj)
+            self._csrs[name] = obj
+            self._record(etype, obj)
+        return obj
+
+    def add_all(self, csrs: Iterable[Any]) -> None:
+        for csr in csrs:
+            self.add(csr)
+
+    def delete(self, name: str) -> None:
+        with self._cond:
+            obj = self._csrs.pop(name, None)
+            if obj is None:
+                raise ApiError(404, f'certificatesigningrequests "{name}" not found')  # noqa E501
+            self._record('DELETED', self._bump(obj))
+
+    def get(self, name: str) -> Dict[str, Any]:
+        with self._cond:
+            obj = self._csrs.get(name)
+        if obj is None:
+            raise ApiError(404, f'certificatesigningrequests "{name}" not found')  # noqa E501
+        return obj
+
+    def all(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [self._csrs[name] for name in sorted(self._csrs)]
+
+    def approve(self, name: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self._cond:
+            obj = self._csrs.get(name)
+            if obj is None:
+                raise ApiError(404, f'certificatesigningrequests "{name}" not found')  # noqa E501
+            version = body.get('metadata', {}).get('resourceVersion')
+            if version and version != obj['metadata']['resourceVersion']:
+                raise ApiError(409, f'Operation cannot be fulfilled on certificatesigningrequests "{name}": the object has been modified; please apply your changes to the latest version and try again')  # noqa E501
+            conditions = body.get('status', {}).get('conditions') or []
+            obj = json.loads(json.dumps(obj))
+            obj['status']['conditions'] = conditions
+            obj = self._bump(obj)
+            self._csrs[name] = obj
+            self._record('MODIFIED', obj)
+        return obj
+
+    def list(self, limit: int = 0, token: Optional[str] = None) \
+            -> Tuple[List[Dict[str, Any]], str, Optional[str]]:
+        # Returns a page of CSRs ordered by name, the list's resource
+        # version and the continue token of the next page, if any
+        start = ''
+        with self._cond:
+            resource_version = self._resource_version
+            if token:
+                try:
+                    decoded = json.loads(base64.b64decode(token))
+                    resource_version = int(decoded['rv'])
+                    start = decoded['start']
+                except (ValueError, KeyError, TypeError):
+                    raise ApiError(400, 'invalid continue token')
+                if resource_version < self._compacted:
+                    raise ApiError(410, 'The provided continue parameter is too old to display a consistent list result.')  # noqa E501
+            names = [name for name in sorted(self._csrs) if name >= start]
+            if limit > 0 and len(names) > limit:
+                next_token = base64.b64encode(json.dumps({
+                    'rv': resource_version, 'start': names[limit],
+                }).encode()).decode()
+                names = names[:limit]
+            else:
+                next_token = None
+            items = [self._csrs[name] for name in names]
+        return items, str(resource_version), next_token
+
+    def wait_events(self, after: int, timeout: float) \
+            -> List[Tuple[int, str, Dict[str, Any]]]:
+        # Events newer than the resource version after, waiting up to
+        # timeout seconds for some to occur
+        with self._cond:
+            if after < self._compacted:
+                raise ApiError(410, f'too old resource version: {after} ({self._compacted})')  # noqa E501
+            if self._resource_version <= after and not self.closed:
+                self._cond.wait(timeout)
+            return [event for event in self._events if event[0] > after]
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which would otherwise
+    # delay responses on kept-alive connections
+    disable_nagle_algorithm = True
+    server: 'FakeApiServer'
+
+    def _send_json(self, code: int, body: Dict[str, Any],
+                   headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, error: ApiError) -> None:
+        headers = {}
+        if error.code == 429:
+            headers['Retry-After'] = '1'
+        self._send_json(error.code, error.status(), headers)
+
+    def _route(self, method: str) -> Tuple[str, Optional[str],
+                                           Dict[str, List[str]]]:
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == API_PATH and method == 'GET':
+            watch = query.get('watch', ['false'])[0].lower() in ['true', '1']
+            return 'watch' if watch else 'list', None, query
+        if url.path.startswith(API_PATH + '/'):
+            parts = url.path[len(API_PATH) + 1:].split('/')
+            if len(parts) == 1 and method == 'GET':
+                return 'get', parts[0], query
+            if len(parts) == 2 and parts[1] == 'approval' \
+                    and method == 'PUT':
+                return 'approve', parts[0], query
+        raise ApiError(404, f'{method} {url.path} not found')
+
+    def _handle(self, method: str) -> None:
+        body = None
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > 0:
+            body = json.loads(self.rfile.read(length))
+        try:
+            endpoint, name, query = self._route(method)
+            self.server.requests[endpoint] += 1
+            self.server.faults.delay()
+            code = self.server.faults.error(endpoint)
+            if code is not None:
+                self.server.errors[endpoint] += 1
+                if endpoint == 'watch' and code == 410:
+                    # Watches report expired resource versions as event
+                    self._send_watch_error(ApiError(410, 'injected'))
+                    return
+                raise ApiError(code, f'injected {REASONS[code]} error')
+            if endpoint == 'list':
+                self._list(query)
+            elif endpoint == 'watch':
+                self._watch(query)
+            elif endpoint == 'get':
+                assert name is not None
+                self._send_json(200, self.server.state.get(name))
+            elif endpoint == 'approve':
+                assert name is not None
+                self._send_json(200, self.server.state.approve(name, body or {}))  # noqa E501
+        except ApiError as e:
+            self._send_error(e)
+
+    def _list(self, query: Dict[str, List[str]]) -> None:
+        limit = int(query.get('limit', ['0'])[0])
+        token = query.get('continue', [None])[0]
+        items, resource_version, next_token = \
+            self.server.state.list(limit, token)
+        metadata: Dict[str, Any] = {'resourceVersion': resource_version}
+        if next_token is not None:
+            metadata['continue'] = next_token
+        self._send_json(200, {
+            'apiVersion': API_VERSION,
+            'kind': 'CertificateSigningRequestList',
+            'metadata': metadata,
+            'items': items,
+        })
+
+    def _start_chunked(self) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _write_event(self, etype: str, obj: Dict[str, Any]) -> None:
+        event = {'type': etype, 'object': obj}
+        self._write_chunk(json.dumps(event).encode() + b'\n')
+
+    def _send_watch_error(self, error: ApiError) -> None:
+        self._start_chunked()
+        self._write_event('ERROR', error.status())
+        self._write_chunk(b'')
+
+    def _watch(self, query: Dict[str, List[str]]) -> None:
+        state = self.server.state
+        timeout = float(query.get('timeoutSeconds', ['1800'])[0])
+        deadline = time.monotonic() + timeout
+        version = query.get('resourceVersion', [''])[0]
+        if version in ['', '0']:
+            # Without a resource version, the watch starts with the
+            # current state
+            after = state.resource_version
+            initial = state.all()
+        else:
+            after = int(version)
+            initial = []
+        try:
+            events = state.wait_events(after, 0)
+        except ApiError as e:
+            self._send_watch_error(e)
+            return
+        self._start_chunked()
+        for obj in initial:
+            self._write_event('ADDED', obj)
+        while not state.closed:
+            for event_version, etype, obj in events:
+                self._write_event(etype, obj)
+                after = event_version
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                events = state.wait_events(after, min(remaining, 1.0))
+            except ApiError as e:
+                self._write_event('ERROR', e.status())
+                break
+        self._write_chunk(b'')
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_PUT(self) -> None:
+        self._handle('PUT')
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class FakeApiServer(ThreadingMixIn, HTTPServer):
+    """Fake Kubernetes API server for the CSR endpoints.
+
+    Listens on a random port unless one is given; point an ApiClient at
+    its url.  The server runs in a daemon thread once started.  The
+    numbers of requests and injected errors per endpoint are counted in
+    requests and errors.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: str = '127.0.0.1', port: int = 0,
+                 faults: Optional[Faults] = None,
+                 history: int = 1000) -> None:
+        super().__init__((address, port), _ApiHandler)
+        self.address = address
+        self.state = CsrState(history)
+        self.faults = faults or Faults()
+        self.requests: Counter = Counter()
+        self.errors: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.address}:{self.server_port}'
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='fakeapi', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Ends open watches, then stops serving
+        self.state.close()
+        self.shutdown()
+        self.server_close()
+
+
+def parse_error_rate(value: str) -> Tuple[int, float]:
+    try:
+        code, rate = value.split(':')
+        return int(code), float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'invalid error rate {value}, expected <status>:<rate>')
+
+
+def parse_arguments(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Serve synthetic CSRs from a fake Kubernetes API')
+    parser.add_argument('--address', default='127.0.0.1',
+                        help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port to listen on (default: 8080)')
+    parser.add_argument('--csrs', type=int, default=1000,
+                        help='Number of CSRs to seed (default: 1000)')
+    parser.add_argument('--nodes', type=int, default=100,
+                        help='Number of nodes in the spec (default: 100)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the CSR generator and of injected errors (default: 0)')  # noqa E501
+    parser.add_argument('--spec-file',
+                        help='File to write the node CSR spec of the seeded CSRs to')  # noqa E501
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latency added to every request in seconds (default: 0)')  # noqa E501
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random latency of up to this many seconds added to every request (default: 0)')  # noqa E501
+    parser.add_argument('--error', type=parse_error_rate, action='append',
+                        dest='errors', default=[],
+                        help=f'Fail requests with an HTTP status at a rate, as <status>:<rate>, e.g. 409:0.1; can be repeated, statuses: {", ".join(map(str, INJECTABLE_ERRORS))}')  # noqa E501
+    parser.add_argument('--error-endpoint', choices=ENDPOINTS,
+                        action='append', dest='error_endpoints',
+                        help='Only inject errors into requests to this endpoint; can be repeated (default: all endpoints)')  # noqa E501
+    parser.add_argument('--history', type=int, default=1000,
+                        help='Number of watch events kept, older resource versions are gone (default: 1000)')  # noqa E501
+    return parser.parse_args(args)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    # Imported here, as only the command line needs the generator
+    from openshift_csr_approver import benchmark
+
+    args = parse_arguments(sys.argv[1:] if argv is None else argv)
+    faults = Faults(args.latency, args.jitter, dict(args.errors), args.seed,
+                    args.error_endpoints)
+    server = FakeApiServer(args.address, args.port, faults, args.history)
+    raw_spec = benchmark.generate_spec(args.nodes)
+    # CSRs were created up to an hour ago
+    generator = benchmark.CsrGenerator(
+        raw_spec, args.seed,
+        datetime.now(timezone.utc) - timedelta(hours=1),
+        3600 / max(1, args.csrs))
+    server.state.add_all(generator.generate(args.csrs))
+    if args.spec_file:
+        with open(args.spec_file, 'w') as f:
+            yaml.safe_dump(raw_spec, f)
+    logger.info(f'Serving {len(server.state)} CSRs at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.state.close()
+        server.server_close()
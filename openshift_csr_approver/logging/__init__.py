@@ -1,6 +1,8 @@
 import sys
+import json
 import logging
 import time
+from datetime import datetime, timezone
 
 
 class PrettyFormatter(logging.Formatter):
@@ -13,6 +15,8 @@ class PrettyFormatter(logging.Formatter):
 
     def formatMessage(self, msg):
         original = super().formatMessage(msg)
+        if '\n' not in original:
+            return original
         return original.replace('\n', ' ')
 
     def formatException(self, exc):
@@ -23,6 +27,56 @@ class PrettyFormatter(logging.Formatter):
         return '\n'.join(lines)
 
 
+# Attributes of every log record; all others were passed in extra
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) \
+    | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line.
+
+    Fields passed with extra=... are added to the object, so that log
+    pipelines can filter and aggregate on them without parsing the
+    message.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'location': f'{record.pathname}:{record.lineno}',
+            'function': record.funcName,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+FORMATTERS = {
+    'pretty': PrettyFormatter,
+    'json': JsonFormatter,
+}
+
+
+def configure(log_format='pretty', level='INFO', stream=None):
+    # Given a stream, e.g. sys.stderr, the log is written to it instead
+    # of stdout
+    stdout.setFormatter(FORMATTERS[log_format]())
+    logger.setLevel(level)
+    if stream is not None:
+        stdout.acquire()
+        try:
+            stdout.flush()
+            stdout.stream = stream
+        finally:
+            stdout.release()
+
+
 logger = logging.getLogger('openshift-csr-approver')
 logger.setLevel(logging.INFO)
 
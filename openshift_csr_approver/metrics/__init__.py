@@ -0,0 +1,260 @@
+from typing import ContextManager, Dict, Iterator, List, Sequence, Tuple
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+
+# Metrics are exposed by openshift_csr_approver.metrics.server in the
+# Prometheus text exposition format:
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+#
+# Recording is disabled by default.  As long as the registry is not
+# enabled, recording a metric returns right away without taking any
+# locks or reading the clock.
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(labels: Labels) -> str:
+    if len(labels) == 0:
+        return ''
+    pairs = ','.join([
+        f'{name}="{_escape(value)}"'
+        for name, value in labels
+    ])
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Registry:
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._metrics: List['Metric'] = []
+
+    def register(self, metric: 'Metric') -> None:
+        self._metrics.append(metric)
+
+    def reset(self) -> None:
+        for metric in self._metrics:
+            metric.reset()
+
+    def exposition(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str,
+                 registry: Registry = REGISTRY) -> None:
+        self.name = name
+        self.help = help
+        self.registry = registry
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def reset(self) -> None:
+        raise NotImplementedError()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str,
+                 registry: Registry = REGISTRY) -> None:
+        super().__init__(name, help, registry)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not self.registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f'{self.name}{_format_labels(labels)} {_format_value(value)}'
+            for labels, value in values
+        ]
+
+
+class Gauge(Metric):
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str,
+                 registry: Registry = REGISTRY) -> None:
+        super().__init__(name, help, registry)
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        if not self.registry.enabled:
+            return
+        self._value = value
+
+    def value(self) -> float:
+        return self._value
+
+    def reset(self) -> None:
+        self._value = 0.0
+
+    def samples(self) -> List[str]:
+        return [f'{self.name} {_format_value(self._value)}']
+
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY) -> None:
+        super().__init__(name, help, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.reset()
+
+    def observe(self, value: float) -> None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def _time(self) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start)
+
+    def time(self) -> ContextManager[None]:
+        # Context manager observing the duration of its body
+        if not self.registry.enabled:
+            return _NULL_TIMER
+        return self._time()
+
+    def count(self) -> int:
+        return self._count
+
+    def reset(self) -> None:
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+            count = self._count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            le = _format_labels((('le', _format_value(bound)),))
+            lines.append(f'{self.name}_bucket{le} {cumulative}')
+        lines.append(f'{self.name}_sum {_format_value(total)}')
+        lines.append(f'{self.name}_count {count}')
+        return lines
+
+
+class _NullTimer:
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc: object) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+# Metrics of the CSR approver
+
+CSRS_SEEN = Counter(
+    'openshift_csr_approver_csrs_seen_total',
+    'Number of CSRs evaluated')
+CSRS_DROPPED = Counter(
+    'openshift_csr_approver_csrs_dropped_total',
+    'Number of CSRs dropped before evaluation, by the reason code they would have been rejected with')  # noqa E501
+CSRS_APPROVED = Counter(
+    'openshift_csr_approver_csrs_approved_total',
+    'Number of CSRs approved')
+CSRS_REJECTED = Counter(
+    'openshift_csr_approver_csrs_rejected_total',
+    'Number of CSRs not approved, by the check stage that rejected them')
+CSRS_DECIDED = Counter(
+    'openshift_csr_approver_decisions_total',
+    'Number of decisions on CSRs, by their reason code')
+CSRS_ERRORS = Counter(
+    'openshift_csr_approver_csrs_errors_total',
+    'Number of CSRs that could not be evaluated or approved due to errors')
+APPROVAL_CONFLICTS = Counter(
+    'openshift_csr_approver_approval_conflicts_total',
+    'Number of approvals that conflicted with a change of the CSR and were retried')  # noqa E501
+LIST_DURATION = Histogram(
+    'openshift_csr_approver_list_duration_seconds',
+    'Duration of CSR list requests, per page')
+PARSE_DURATION = Histogram(
+    'openshift_csr_approver_parse_duration_seconds',
+    'Duration of decoding and parsing a CSR')
+DECISION_DURATION = Histogram(
+    'openshift_csr_approver_decision_duration_seconds',
+    'Duration of deciding whether to approve a CSR, including parsing')
+APPROVE_DURATION = Histogram(
+    'openshift_csr_approver_approve_duration_seconds',
+    'Duration of CSR approval requests')
+TIME_TO_APPROVAL = Histogram(
+    'openshift_csr_approver_time_to_approval_seconds',
+    'Time from the creation of a CSR until its approval',
+    buckets=(1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0,
+             3600.0))
+PENDING_CSR_AGE = Gauge(
+    'openshift_csr_approver_pending_csr_max_age_seconds',
+    'Age of the oldest CSR that is neither approved nor denied, as of the last list')  # noqa E501
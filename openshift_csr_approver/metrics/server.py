@@ -0,0 +1,66 @@
+from typing import Callable, Dict, Optional, Tuple
+
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from openshift_csr_approver.metrics import Registry, REGISTRY
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    server: 'MetricsServer'
+
+    def do_GET(self) -> None:
+        path = self.path.split('?', 1)[0]
+        route = self.server.routes.get(path)
+        if route is None:
+            self.send_error(404)
+            return
+        content_type, body = route()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        # Don't log every scrape
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """HTTP server exposing the registry's metrics at /metrics.
+
+    Further endpoints can be added with add_route.  The server runs in
+    a daemon thread once started.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: str, port: int,
+                 registry: Registry = REGISTRY) -> None:
+        super().__init__((address, port), _MetricsHandler)
+        self.registry = registry
+        self.routes: Dict[str, Callable[[], Tuple[str, bytes]]] = {
+            '/metrics': self._metrics,
+        }
+        self._thread: Optional[threading.Thread] = None
+
+    def _metrics(self) -> Tuple[str, bytes]:
+        return ('text/plain; version=0.0.4; charset=utf-8',
+                self.registry.exposition().encode())
+
+    def add_route(self, path: str,
+                  route: Callable[[], Tuple[str, bytes]]) -> None:
+        self.routes[path] = route
+
+    def start(self) -> None:
+        self.registry.enabled = True
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
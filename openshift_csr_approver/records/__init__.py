@@ -0,0 +1,130 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import json
+from datetime import datetime, timezone
+
+from dateutil.parser import isoparse
+
+
+# Compact records of CSRs, decoded straight from the JSON of list
+# responses instead of through the kubernetes client's models.
+#
+# The client deserializes each CSR into a tree of model objects by
+# reflecting over their attribute types, which dominates the CPU time
+# of processing large lists.  Records only hold the fields the approver
+# uses, under the same attribute paths as the models (e.g.
+# csr.metadata.name, csr.spec.username), so either can be evaluated and
+# approved.
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        # The format used by the API server
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ') \
+            .replace(tzinfo=timezone.utc)
+    except ValueError:
+        return isoparse(value)
+
+
+class RecordMeta:
+
+    # raw is the metadata as received, sent back unchanged on approval
+    __slots__ = ('name', 'uid', 'resource_version', 'generation',
+                 'creation_timestamp', 'raw')
+
+    def __init__(self, name: str, uid: str, resource_version: str,
+                 generation: Optional[int],
+                 creation_timestamp: Optional[datetime],
+                 raw: Optional[Dict[str, Any]] = None) -> None:
+        self.name = name
+        self.uid = uid
+        self.resource_version = resource_version
+        self.generation = generation
+        self.creation_timestamp = creation_timestamp
+        self.raw = raw
+
+
+class RecordSpec:
+
+    __slots__ = ('username', 'groups', 'usages', 'request')
+
+    def __init__(self, username: str, groups: List[str], usages: List[str],
+                 request: str) -> None:
+        self.username = username
+        self.groups = groups
+        self.usages = usages
+        self.request = request
+
+
+class RecordCondition:
+
+    # last_update_time is kept as sent by the API, it is only logged
+    __slots__ = ('type', 'reason', 'message', 'last_update_time')
+
+    def __init__(self, type: str, reason: Optional[str],
+                 message: Optional[str],
+                 last_update_time: Optional[str]) -> None:
+        self.type = type
+        self.reason = reason
+        self.message = message
+        self.last_update_time = last_update_time
+
+
+class RecordStatus:
+
+    __slots__ = ('conditions',)
+
+    def __init__(self,
+                 conditions: Optional[List[RecordCondition]]) -> None:
+        self.conditions = conditions
+
+
+class CsrRecord:
+    """The fields of a CSR used to decide on and approve it."""
+
+    __slots__ = ('metadata', 'spec', 'status')
+
+    api_version = 'certificates.k8s.io/v1beta1'
+    kind = 'CertificateSigningRequest'
+
+    def __init__(self, metadata: RecordMeta, spec: RecordSpec,
+                 status: RecordStatus) -> None:
+        self.metadata = metadata
+        self.spec = spec
+        self.status = status
+
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> 'CsrRecord':
+        metadata = obj['metadata']
+        spec = obj['spec']
+        conditions = (obj.get('status') or {}).get('conditions')
+        if conditions is not None:
+            conditions = [
+                RecordCondition(c.get('type'), c.get('reason'),
+                                c.get('message'), c.get('lastUpdateTime'))
+                for c in conditions
+            ]
+        return cls(
+            RecordMeta(metadata.get('name'), metadata.get('uid'),
+                       metadata.get('resourceVersion'),
+                       metadata.get('generation'),
+                       parse_timestamp(metadata.get('creationTimestamp')),
+                       metadata),
+            RecordSpec(spec['username'], spec.get('groups') or [],
+                       spec.get('usages') or [], spec['request']),
+            RecordStatus(conditions)
+        )
+
+
+def parse_csr_list(data: bytes) \
+        -> Tuple[List[CsrRecord], Optional[str], Optional[str]]:
+    # Returns the records of a CSR list response body, the list's
+    # resource version and its continue token
+    decoded = json.loads(data)
+    metadata = decoded.get('metadata') or {}
+    items = decoded.get('items') or []
+    records = [CsrRecord.from_dict(item) for item in items]
+    return records, metadata.get('resourceVersion'), \
+        metadata.get('continue')
@@ -0,0 +1,283 @@
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver.logging import logger, \
+    configure as configure_logging
+from openshift_csr_approver.records import CsrRecord
+
+
+# Replays recorded CSRs through the decision pipeline against a node CSR
+# spec, without any API access, e.g. to check what a new spec would
+# approve before rolling it out:
+#
+#   oc get csr -o json > csrs.json
+#   python -m openshift_csr_approver.replay csrs.json \
+#       --config-file new-spec.yaml --baseline-config-file spec.yaml
+#
+# Dumps are read as a stream, so that memory use does not grow with
+# their size: either a JSON document holding a single CSR or a list of
+# them in "items", or JSON lines of either.
+
+CHUNK_SIZE = 1 << 20
+# Largest JSON value read at once, e.g. a single CSR
+MAX_VALUE_SIZE = 64 << 20
+
+WHITESPACE = ' \t\n\r'
+
+
+class _JsonStream:
+    # Reads the JSON values of a document one at a time, keeping only
+    # the part of the document not yet consumed in memory
+
+    def __init__(self, f: IO[str], chunk_size: int = CHUNK_SIZE,
+                 max_value_size: int = MAX_VALUE_SIZE) -> None:
+        self.f = f
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if chunk == '':
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        # The next character that is not whitespace, or '' at the end
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:  # noqa E501
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError(f'Expected one of {chars!r} in JSON, got {c!r}')  # noqa E501
+        self.pos += 1
+        return c
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                end = -1
+            # A number at the end of the buffer may go on in the next
+            # chunk, so values are only complete before its end
+            if end != -1 and (end < len(self.buf) or self.eof):
+                self.pos = end
+                return value
+            if len(self.buf) - self.pos > self.max_value_size:
+                raise ValueError(f'JSON value larger than {self.max_value_size} bytes')  # noqa E501
+            if not self._fill():
+                if end != -1:
+                    self.pos = end
+                    return value
+                # Raises the decoding error
+                self.decoder.raw_decode(self.buf, self.pos)
+
+
+def iter_json(f: IO[str], chunk_size: int = CHUNK_SIZE) \
+        -> Iterator[Dict[str, Any]]:
+    # Yields the CSRs of a JSON document, which is either a list with
+    # the CSRs in "items" (e.g. of oc get csr -o json) or a single CSR
+    stream = _JsonStream(f, chunk_size)
+    stream.expect('{')
+    fields = {}
+    is_list = False
+    if stream.peek() == '}':
+        stream.expect('}')
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'items':
+            is_list = True
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.expect(']')
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.expect(',]') == ']':
+                        break
+        else:
+            fields[key] = stream.value()
+        if stream.expect(',}') == '}':
+            break
+    if not is_list:
+        yield fields
+
+
+def iter_jsonl(f: IO[str]) -> Iterator[Dict[str, Any]]:
+    # Yields the CSRs of JSON lines, each either a CSR or a list of them
+    for line in f:
+        if line.strip() == '':
+            continue
+        obj = json.loads(line)
+        if isinstance(obj.get('items'), list):
+            yield from obj['items']
+        else:
+            yield obj
+
+
+def detect_format(path: str) -> str:
+    if path.endswith('.jsonl') or path.endswith('.ndjson'):
+        return 'jsonl'
+    return 'json'
+
+
+def read_dump(path: str, dump_format: str = 'auto',
+              chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    # Yields the CSRs of a dump file, or of stdin for '-'
+    if dump_format == 'auto':
+        dump_format = detect_format(path)
+    if path == '-':
+        f = sys.stdin
+    else:
+        f = open(path, 'r')
+    try:
+        if dump_format == 'jsonl':
+            yield from iter_jsonl(f)
+        else:
+            yield from iter_json(f, chunk_size)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _decide(record: CsrRecord, node_csr_spec: oca.NodeCsrSpec) \
+        -> Dict[str, Any]:
+    try:
+        decision = oca.decide_csr(record, node_csr_spec)
+    except Exception as e:
+        return {'stage': 'error', 'approve': False, 'code': None,
+                'reason': str(e)}
+    return {'stage': decision.stage, 'approve': decision.approve,
+            'code': decision.reason.value, 'reason': decision.message}
+
+
+def replay(csrs: Iterable[Dict[str, Any]], node_csr_spec: oca.NodeCsrSpec,
+           baseline: Optional[oca.NodeCsrSpec] = None,
+           ignore_conditions: bool = False,
+           stats: Optional[Counter] = None) -> Iterator[Dict[str, Any]]:
+    # Yields the decision about every CSR.  Given a baseline spec, e.g.
+    # the one currently deployed, the decision with it is added, and
+    # whether it differs.
+    if stats is None:
+        stats = Counter()
+    for obj in csrs:
+        stats['csrs'] += 1
+        metadata = obj.get('metadata') or {}
+        decision: Dict[str, Any] = {'name': metadata.get('name')}
+        try:
+            record = CsrRecord.from_dict(obj)
+        except (KeyError, TypeError, ValueError) as e:
+            stats['error'] += 1
+            decision.update(stage='error', approve=False, code=None,
+                            reason=f'Not a CSR: {e!r}')
+            yield decision
+            continue
+        if ignore_conditions:
+            # Decide as if no one had approved or denied the CSR yet
+            record.status.conditions = None
+        decision['username'] = record.spec.username
+        decision.update(_decide(record, node_csr_spec))
+        stats[decision['stage']] += 1
+        if baseline is not None:
+            base = _decide(record, baseline)
+            decision['baseline'] = base
+            decision['changed'] = base['approve'] != decision['approve']
+            if decision['changed']:
+                stats['changed'] += 1
+        yield decision
+
+
+def _node_not_joined(nodename: str) -> bool:
+    return False
+
+
+def parse_arguments(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Replay recorded CSRs through the approval checks against a node CSR spec, without API access')  # noqa E501
+    parser.add_argument('dumps', metavar='DUMP', nargs='+',
+                        help='JSON or JSON lines file of CSRs, e.g. the output of oc get csr -o json; - for stdin')  # noqa E501
+    parser.add_argument('--config-file', dest='cm_path', required=True,
+                        help='Node CSR spec to decide on the CSRs with')
+    parser.add_argument('--baseline-config-file', dest='baseline_path',
+                        help='Node CSR spec to compare the decisions with, e.g. the one currently deployed')  # noqa E501
+    parser.add_argument('--format', dest='dump_format',
+                        choices=['auto', 'json', 'jsonl'], default='auto',
+                        help='Format of the dumps, auto for jsonl if the file name ends with .jsonl or .ndjson, json otherwise (default: auto)')  # noqa E501
+    parser.add_argument('--approve-bootstrap-csrs',
+                        action='store_true', dest='approve_bootstrap',
+                        help='Decide on client CSRs of joining nodes as well, as if none of the nodes had joined yet')  # noqa E501
+    parser.add_argument('--ignore-conditions', action='store_true',
+                        help='Decide on CSRs as if they were neither approved nor denied yet')  # noqa E501
+    parser.add_argument('--changes-only', action='store_true',
+                        help='Only output decisions that differ from those with the baseline spec')  # noqa E501
+    parser.add_argument('--output', default='-',
+                        help='File to write the decisions to as JSON lines (default: stdout)')  # noqa E501
+    return parser.parse_args(args)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_arguments(sys.argv[1:] if argv is None else argv)
+    # The decisions are written to stdout by default, keep the log apart
+    configure_logging(stream=sys.stderr)
+    # Without API access, client CSRs are decided as if their nodes had
+    # not joined the cluster yet
+    node_csr_spec = oca.parse_node_csr_spec(args.cm_path,
+                                            args.approve_bootstrap,
+                                            _node_not_joined)
+    baseline = None
+    if args.baseline_path:
+        baseline = oca.parse_node_csr_spec(args.baseline_path,
+                                           args.approve_bootstrap,
+                                           _node_not_joined)
+    stats: Counter = Counter()
+    size = 0
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    start = time.perf_counter()
+    try:
+        for path in args.dumps:
+            if path != '-':
+                size += os.path.getsize(path)
+            decisions = replay(read_dump(path, args.dump_format),
+                               node_csr_spec, baseline,
+                               args.ignore_conditions, stats)
+            for decision in decisions:
+                if args.changes_only and not decision.get('changed'):
+                    continue
+                out.write(json.dumps(decision) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - start
+    count = stats['csrs']
+    rate = count / seconds if seconds > 0 else 0.0
+    throughput = size / seconds / (1 << 20) if seconds > 0 else 0.0
+    eliminated = ', '.join([
+        f'{stage} {stats[stage]}' for stage in oca.STAGES + ['error']
+    ])
+    logger.info(f'Replayed {count} CSRs in {seconds:.2f}s ({rate:.0f} CSRs/s, {throughput:.1f} MB/s of files), {stats["approved"]} to approve, eliminated by stage: {eliminated}',  # noqa E501
+                extra={'csrs': count, 'outcomes': dict(stats)})
+    if baseline is not None:
+        logger.info(f'{stats["changed"]} decisions differ from those with {os.path.basename(args.baseline_path)}')  # noqa E501
@@ -0,0 +1,143 @@
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import json
+import threading
+
+
+# States of CSRs in the store
+PENDING = 'pending'      # to be approved by us
+APPROVED = 'approved'    # approved, by us or anyone else
+DENIED = 'denied'        # denied by anyone else
+REJECTED = 'rejected'    # neither approved nor denied, rejected by us
+
+STATES = [PENDING, APPROVED, DENIED, REJECTED]
+
+# CSRs whose decision may change with the node CSR spec
+UNDECIDED = (PENDING, REJECTED)
+
+
+class StoreEntry:
+
+    # reason is rendered with str() when dumped, so that the message of
+    # a decision is only formatted when asked for
+    __slots__ = ('csr', 'nodename', 'state', 'reason')
+
+    def __init__(self, csr: Any, nodename: Optional[str], state: str,
+                 reason: Any) -> None:
+        self.csr = csr
+        self.nodename = nodename
+        self.state = state
+        self.reason = reason
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.csr.metadata.name,
+            'uid': self.csr.metadata.uid,
+            'node': self.nodename,
+            'state': self.state,
+            'reason': str(self.reason),
+        }
+
+
+class CsrStore:
+    """In-memory store of the CSRs seen in lists and watch events.
+
+    CSRs are indexed by uid, by the name of the node they were requested
+    for, and by their state.  This answers which CSRs of a node are
+    still undecided without walking all CSRs, e.g. to re-evaluate them
+    when the node's spec changes.  CSRs are removed when they are
+    deleted, which is how the API server garbage-collects old CSRs.
+
+    The store is updated from the reconcile loop, but may be read from
+    other threads, e.g. to serve a debug dump.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, StoreEntry] = {}
+        self._by_node: Dict[str, Set[str]] = {}
+        self._by_state: Dict[str, Set[str]] = {
+            state: set() for state in STATES
+        }
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._entries
+
+    def get(self, uid: str) -> Optional[StoreEntry]:
+        return self._entries.get(uid)
+
+    def update(self, csr: Any, nodename: Optional[str], state: str,
+               reason: Any = '') -> None:
+        uid = csr.metadata.uid
+        with self._lock:
+            self._remove(uid)
+            self._entries[uid] = StoreEntry(csr, nodename, state, reason)
+            if nodename is not None:
+                self._by_node.setdefault(nodename, set()).add(uid)
+            self._by_state[state].add(uid)
+
+    def _remove(self, uid: str) -> None:
+        entry = self._entries.pop(uid, None)
+        if entry is None:
+            return
+        if entry.nodename is not None:
+            uids = self._by_node[entry.nodename]
+            uids.discard(uid)
+            if len(uids) == 0:
+                del self._by_node[entry.nodename]
+        self._by_state[entry.state].discard(uid)
+
+    def remove(self, uid: str) -> None:
+        with self._lock:
+            self._remove(uid)
+
+    def retain(self, uids: Iterable[str]) -> None:
+        # Remove all CSRs not in uids, e.g. CSRs that were deleted since
+        # the last list
+        keep = set(uids)
+        with self._lock:
+            for uid in list(self._entries.keys()):
+                if uid not in keep:
+                    self._remove(uid)
+
+    def for_node(self, nodename: str,
+                 states: Iterable[str] = UNDECIDED) -> List[Any]:
+        states = set(states)
+        with self._lock:
+            entries = [
+                self._entries[uid]
+                for uid in self._by_node.get(nodename, ())
+            ]
+        return [entry.csr for entry in entries if entry.state in states]
+
+    def for_nodes(self, nodenames: Iterable[str],
+                  states: Iterable[str] = UNDECIDED) -> List[Any]:
+        states = set(states)
+        csrs = []
+        for nodename in nodenames:
+            csrs.extend(self.for_node(nodename, states))
+        return csrs
+
+    def in_state(self, state: str) -> List[Any]:
+        with self._lock:
+            return [self._entries[uid].csr for uid in self._by_state[state]]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                state: len(uids) for state, uids in self._by_state.items()
+            }
+
+    def dump(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._entries.values())
+        return sorted([entry.to_dict() for entry in entries],
+                      key=lambda e: (e['node'] or '', e['name']))
+
+    def debug_route(self) -> Tuple[str, bytes]:
+        # Route for MetricsServer.add_route
+        body = {'counts': self.counts(), 'csrs': self.dump()}
+        return 'application/json', json.dumps(body, indent=2).encode()
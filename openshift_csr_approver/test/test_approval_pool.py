@@ -0,0 +1,163 @@
+import copy
+import time
+import threading
+import unittest
+import unittest.mock as mock
+
+from datetime import datetime, timedelta, timezone
+
+import kubernetes.client as k8s
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver import metrics
+from openshift_csr_approver.records import CsrRecord
+from openshift_csr_approver.test.test_iterate_csrs import REQUESTS
+
+
+class TestApprovalPool(unittest.TestCase):
+
+    def setUp(self):
+        self.csrs = copy.deepcopy(REQUESTS.items)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.approved = []
+        self.api = mock.Mock()
+        self.api.replace_certificate_signing_request_approval.side_effect \
+            = self.approve
+
+    def approve(self, name, body):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        if name == 'csr-denied':
+            raise RuntimeError('approval failed')
+        with self.lock:
+            self.approved.append(name)
+
+    def test_sequential(self):
+        pool = oca.ApprovalPool(self.api)
+        for csr in self.csrs:
+            pool.submit(csr)
+        pool.close()
+        self.assertEqual(self.max_active, 1)
+        self.assertEqual(self.approved, [
+            csr.metadata.name for csr in self.csrs
+            if csr.metadata.name != 'csr-denied'
+        ])
+
+    def test_concurrent(self):
+        pool = oca.ApprovalPool(self.api, concurrency=3)
+        for csr in self.csrs:
+            pool.submit(csr)
+        pool.close()
+        self.assertGreater(self.max_active, 1)
+        self.assertLessEqual(self.max_active, 3)
+        # A failed approval doesn't affect the others
+        self.assertEqual(sorted(self.approved), sorted([
+            csr.metadata.name for csr in self.csrs
+            if csr.metadata.name != 'csr-denied'
+        ]))
+        self.assertEqual(pool.errors, 1)
+        self.assertEqual(len(pool.latencies), len(self.csrs) - 1)
+
+    def test_time_to_approval(self):
+        created = datetime.now(timezone.utc) - timedelta(seconds=100)
+        for csr in self.csrs:
+            csr.metadata.creation_timestamp = created
+        metrics.REGISTRY.enabled = True
+        try:
+            pool = oca.ApprovalPool(self.api, concurrency=2)
+            for csr in self.csrs:
+                pool.submit(csr)
+            pool.close()
+            observed = metrics.TIME_TO_APPROVAL.count()
+        finally:
+            metrics.REGISTRY.enabled = False
+            metrics.REGISTRY.reset()
+        # Failed approvals are not counted
+        self.assertEqual(len(pool.times_to_approval), len(self.csrs) - 1)
+        self.assertEqual(observed, len(self.csrs) - 1)
+        for time_to_approval in pool.times_to_approval:
+            self.assertGreaterEqual(time_to_approval, 100)
+            self.assertLess(time_to_approval, 110)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_rate_limit(self):
+        limiter = oca.RateLimiter(50, burst=2)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        # 2 requests from the burst, 4 more at 50 requests per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.075)
+
+    def test_unlimited(self):
+        limiter = oca.RateLimiter(0)
+        start = time.monotonic()
+        for _ in range(1000):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class TestPercentile(unittest.TestCase):
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(oca.percentile(values, 50), 50.0)
+        self.assertEqual(oca.percentile(values, 95), 95.0)
+        self.assertEqual(oca.percentile(values, 100), 100.0)
+        self.assertEqual(oca.percentile([], 95), 0.0)
+
+
+class TestCreateApprovalBody(unittest.TestCase):
+
+    def test_body(self):
+        csr = copy.deepcopy(REQUESTS.items[2])
+        csr.metadata.resource_version = '42'
+        body = oca.create_approval_body(csr, datetime(2020, 1, 1))
+        self.assertEqual(body.metadata.name, 'csr-denied')
+        self.assertEqual(body.metadata.resource_version, '42')
+        self.assertIsNone(body.spec)
+        # Existing conditions are kept
+        self.assertEqual([c.type for c in body.status.conditions],
+                         ['Denied', 'Approved'])
+        self.assertEqual(body.status.conditions[1].last_update_time,
+                         '2020-01-01T00:00:00Z')
+        self.assertEqual(len(csr.status.conditions), 1)
+
+    def test_metadata_is_kept(self):
+        # API servers before 1.21 update the metadata from the body
+        csr = copy.deepcopy(REQUESTS.items[0])
+        csr.metadata.labels = {'app': 'kubelet'}
+        csr.metadata.annotations = {'example.com/owner': 'ops'}
+        body = oca.create_approval_body(csr, datetime(2020, 1, 1))
+        self.assertIs(body.metadata, csr.metadata)
+        serialized = k8s.ApiClient().sanitize_for_serialization(body)
+        self.assertEqual(serialized['metadata']['labels'], {'app': 'kubelet'})
+        self.assertNotIn('spec', serialized)
+
+    def test_record_metadata_is_kept(self):
+        obj = k8s.ApiClient().sanitize_for_serialization(REQUESTS.items[0])
+        obj['metadata']['labels'] = {'app': 'kubelet'}
+        obj['metadata']['ownerReferences'] = [{'kind': 'Machine'}]
+        record = CsrRecord.from_dict(obj)
+        body = oca.create_approval_body(record, datetime(2020, 1, 1))
+        serialized = k8s.ApiClient().sanitize_for_serialization(body)
+        self.assertEqual(serialized['metadata'], obj['metadata'])
+        self.assertNotIn('spec', serialized)
+
+    def test_record_conditions(self):
+        # Records of raw lists are approved as well
+        obj = k8s.ApiClient().sanitize_for_serialization(REQUESTS.items[2])
+        record = CsrRecord.from_dict(obj)
+        body = oca.create_approval_body(record, datetime(2020, 1, 1))
+        serialized = k8s.ApiClient().sanitize_for_serialization(body)
+        conditions = serialized['status']['conditions']
+        self.assertEqual(conditions[0], obj['status']['conditions'][0])
+        self.assertEqual([c['type'] for c in conditions],
+                         ['Denied', 'Approved'])
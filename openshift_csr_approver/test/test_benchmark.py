@@ -0,0 +1,55 @@
+import json
+import unittest
+
+from collections import Counter
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver import benchmark
+
+
+class TestCsrGenerator(unittest.TestCase):
+
+    def test_generated_csrs_are_decided_by_kind(self):
+        raw_spec = benchmark.generate_spec(20)
+        spec = oca.compile_node_csr_spec(raw_spec)
+        generator = benchmark.CsrGenerator(raw_spec, seed=1)
+        expected = {
+            'approved': 'conditions',
+            'denied': 'conditions',
+            'valid': 'approved',
+            'bad-san': 'x509',
+            'unknown-node': 'node',
+            'not-node': 'username',
+            'bad-usages': 'usages',
+        }
+        for i, (kind, stage) in enumerate(expected.items()):
+            csr = generator.csr(i, kind)
+            self.assertEqual(oca.decide_csr(csr, spec).stage, stage, kind)
+
+    def test_generate_mix(self):
+        raw_spec = benchmark.generate_spec(10)
+        csrs = benchmark.CsrGenerator(raw_spec).generate(
+            100, {'approved': 1, 'valid': 1})
+        self.assertEqual(len(csrs), 100)
+        self.assertEqual(len(set(csr.metadata.uid for csr in csrs)), 100)
+        stats: Counter = Counter()
+        list(oca.iterate_csrs(csrs, oca.compile_node_csr_spec(raw_spec),
+                              stats))
+        self.assertEqual(stats['conditions'] + stats['approved'], 100)
+
+
+class TestRunBenchmarks(unittest.TestCase):
+
+    def test_results_are_json(self):
+        report = benchmark.run_benchmarks([(20, 5)], repeat=1)
+        report = json.loads(json.dumps(report))
+        self.assertEqual(
+            [result['benchmark'] for result in report['results']],
+            ['startup', 'deserialize_models', 'deserialize_records',
+             'parse_node_csr_spec', 'parse_csr', 'extract_sans',
+             'check_approve_csr',
+             'iterate_csrs', 'iterate_csrs_drop_unknown_nodes'])
+        comparison = benchmark.compare_results(report, report)
+        self.assertEqual(len(comparison), 9)
+        for result in comparison:
+            self.assertEqual(result['time_ratio'], 1.0)
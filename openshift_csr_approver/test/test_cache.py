@@ -0,0 +1,114 @@
+import copy
+import unittest
+import unittest.mock as mock
+
+import yaml
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver.cache import LRUCache, CsrCache
+from openshift_csr_approver.test.test_iterate_csrs import REQUESTS, \
+    NODE_CSR_SPEC
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertIsNone(cache.get('b'))
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put('a', 1)
+        self.assertEqual(len(cache), 0)
+
+
+class TestCsrCache(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        self.csrs = copy.deepcopy(REQUESTS.items)
+        for csr in self.csrs:
+            csr.metadata.resource_version = '1'
+        # Only decisions of the CSRs reaching the X.509 stage are cached:
+        # csr-valid, csr-wrong-cn and csr-valid-worker
+        self.checked = 3
+
+    def iterate(self, cache):
+        return [
+            csr.metadata.name
+            for csr in oca.iterate_csrs(self.csrs, self.spec, cache=cache)
+        ]
+
+    def test_repeated_iteration(self):
+        cache = CsrCache()
+        first = self.iterate(cache)
+        with mock.patch.object(oca, 'parse_csr') as parse_csr, \
+                mock.patch.object(oca, 'check_csr_info') as check_csr_info:
+            second = self.iterate(cache)
+        # Unchanged CSRs are neither parsed nor checked again
+        parse_csr.assert_not_called()
+        check_csr_info.assert_not_called()
+        self.assertEqual(first, ['csr-valid', 'csr-valid-worker'])
+        self.assertEqual(second, first)
+        stats = cache.stats()
+        self.assertEqual(stats['decision_hits'], self.checked)
+        self.assertEqual(stats['decision_misses'], self.checked)
+        self.assertEqual(stats['parsed_misses'], self.checked)
+
+    def test_changed_resource_version(self):
+        cache = CsrCache()
+        self.iterate(cache)
+        self.csrs[0].metadata.resource_version = '2'
+        with mock.patch.object(oca, 'parse_csr') as parse_csr:
+            self.iterate(cache)
+        # The decision is made again, but the parsed CSR is reused
+        parse_csr.assert_not_called()
+        stats = cache.stats()
+        self.assertEqual(stats['decision_misses'], self.checked + 1)
+        self.assertEqual(stats['parsed_hits'], 1)
+
+    def test_changed_spec(self):
+        # Decisions made with another spec are not reused, even if it
+        # compares equal
+        cache = CsrCache()
+        self.iterate(cache)
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        with mock.patch.object(oca, 'parse_csr') as parse_csr:
+            self.iterate(cache)
+        parse_csr.assert_not_called()
+        stats = cache.stats()
+        self.assertEqual(stats['decision_hits'], 0)
+        self.assertEqual(stats['decision_misses'], 2 * self.checked)
+
+    def test_evicts_deleted_csrs(self):
+        cache = CsrCache()
+        self.iterate(cache)
+        deleted = self.csrs.pop(0)
+        self.iterate(cache)
+        self.assertNotIn(deleted.metadata.uid, cache.parsed)
+        self.assertNotIn(deleted.metadata.uid, cache.decisions)
+        self.assertEqual(len(cache.decisions), self.checked - 1)
+
+    def test_more_csrs_than_cache_size(self):
+        # Approved and denied CSRs are not cached, so they don't evict
+        # the pending ones, however many of them are listed
+        for i in range(100):
+            csr = copy.deepcopy(REQUESTS.items[1])
+            csr.metadata.uid = f'approved-{i}'
+            self.csrs.insert(0, csr)
+        cache = CsrCache(self.checked)
+        first = self.iterate(cache)
+        with mock.patch.object(oca, 'parse_csr') as parse_csr, \
+                mock.patch.object(oca, 'check_csr_info') as check_csr_info:
+            second = self.iterate(cache)
+        parse_csr.assert_not_called()
+        check_csr_info.assert_not_called()
+        self.assertEqual(second, first)
+        self.assertEqual(cache.stats()['decision_hits'], self.checked)
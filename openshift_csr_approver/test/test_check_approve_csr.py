@@ -1,7 +1,19 @@
+import base64
+import copy
+import ipaddress
+import pickle
 import unittest
+from unittest import mock
 
 import yaml
+import OpenSSL.crypto
 import kubernetes.client as k8s
+from kubernetes.client.rest import ApiException
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
 
 from openshift_csr_approver import approver as oca
 
@@ -192,45 +204,318 @@ worker-01:
 class CheckApproveValidCsr(unittest.TestCase):
 
     def setUp(self):
-        self.spec = yaml.safe_load(NODE_CSR_SPEC)
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
 
     def test_check_valid_csr(self):
         csr = CSR_VALID
         csrinfo = oca.parse_csr(csr)
-        ok, msg = oca.check_approve_csr(csr, csrinfo, self.spec)
-        self.assertTrue(ok)
+        decision = oca.check_approve_csr(csr, csrinfo, self.spec)
+        self.assertTrue(decision.approve)
 
     def test_check_wrong_cn(self):
         csr = CSR_WRONG_CN
         csrinfo = oca.parse_csr(csr)
-        ok, msg = oca.check_approve_csr(csr, csrinfo, self.spec)
-        self.assertRegex(msg, '.*subject CN (.*) does not match.*')
-        self.assertFalse(ok)
+        decision = oca.check_approve_csr(csr, csrinfo, self.spec)
+        self.assertEqual(decision.reason, oca.Reason.CN_MISMATCH)
+        self.assertRegex(decision.message, '.*subject CN (.*) does not match.*')  # noqa E501
+        self.assertFalse(decision.approve)
 
     def test_check_wrong_san(self):
         csr = CSR_WRONG_SAN
         csrinfo = oca.parse_csr(csr)
-        ok, msg = oca.check_approve_csr(csr, csrinfo, self.spec)
-        self.assertRegex(msg, '.*SAN (.*) not allowed for node.*')
-        self.assertFalse(ok)
+        decision = oca.check_approve_csr(csr, csrinfo, self.spec)
+        self.assertRegex(decision.message, '.*SAN (.*) not allowed for node.*')
+        self.assertFalse(decision.approve)
 
     def test_check_wrong_usages(self):
         csr = CSR_WRONG_USAGES
         csrinfo = oca.parse_csr(csr)
-        ok, msg = oca.check_approve_csr(csr, csrinfo, self.spec)
-        self.assertRegex(msg, '.*required usage (.*) absent.*')
-        self.assertFalse(ok)
+        decision = oca.check_approve_csr(csr, csrinfo, self.spec)
+        self.assertRegex(decision.message, '.*required usage (.*) absent.*')
+        self.assertFalse(decision.approve)
 
     def test_check_approved(self):
         csr = CSR_APPROVED
         csrinfo = oca.parse_csr(csr)
-        ok, msg = oca.check_approve_csr(csr, csrinfo, self.spec)
-        self.assertRegex(msg, '.*Already processed.*Approved.*')
-        self.assertFalse(ok)
+        decision = oca.check_approve_csr(csr, csrinfo, self.spec)
+        self.assertRegex(decision.message, '.*Already processed.*Approved.*')
+        self.assertFalse(decision.approve)
 
     def test_check_denied(self):
         csr = CSR_DENIED
         csrinfo = oca.parse_csr(csr)
-        ok, msg = oca.check_approve_csr(csr, csrinfo, self.spec)
-        self.assertRegex(msg, '.*Already processed.*Denied.*')
-        self.assertFalse(ok)
+        decision = oca.check_approve_csr(csr, csrinfo, self.spec)
+        self.assertRegex(decision.message, '.*Already processed.*Denied.*')
+        self.assertFalse(decision.approve)
+
+
+def encode_request(cn, names=None):
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    builder = x509.CertificateSigningRequestBuilder().subject_name(
+        x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'system:nodes'),
+            x509.NameAttribute(NameOID.COMMON_NAME, cn),
+        ])
+    )
+    if names is not None:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName(names), critical=False)
+    request = builder.sign(key, hashes.SHA256(), default_backend())
+    pem = request.public_bytes(serialization.Encoding.PEM)
+    return base64.b64encode(pem).decode()
+
+
+def encode_extensions(cn, extensions):
+    # Requests with extensions cryptography refuses to build, e.g. the
+    # same one twice
+    key = OpenSSL.crypto.PKey()
+    key.generate_key(OpenSSL.crypto.TYPE_RSA, 1024)
+    request = OpenSSL.crypto.X509Req()
+    request.get_subject().O = 'system:nodes'
+    request.get_subject().CN = cn
+    request.add_extensions([
+        OpenSSL.crypto.X509Extension(name, False, value)
+        for name, value in extensions
+    ])
+    request.set_pubkey(key)
+    request.sign(key, 'sha256')
+    pem = OpenSSL.crypto.dump_certificate_request(
+        OpenSSL.crypto.FILETYPE_PEM, request)
+    return base64.b64encode(pem).decode()
+
+
+class CheckSubjectAltNames(unittest.TestCase):
+
+    def setUp(self):
+        spec = yaml.safe_load(NODE_CSR_SPEC)
+        spec['master-01']['names'].append('master, 01')
+        spec['master-01']['ips'].append('fd00::1')
+        self.spec = oca.compile_node_csr_spec(spec)
+
+    def check(self, names):
+        csr = copy.deepcopy(CSR_VALID)
+        csr.spec.request = encode_request('system:node:master-01', names)
+        return oca.check_approve_csr(csr, oca.parse_csr(csr), self.spec)
+
+    def test_extract_sans(self):
+        sans = oca.extract_sans(oca.parse_csr(CSR_VALID))
+        self.assertEqual(sans.dns, ('master-01', 'master-01.os.example.com'))
+        self.assertEqual(sans.ips, (ipaddress.ip_address('10.42.0.1'),
+                                    ipaddress.ip_address('192.168.42.1')))
+        self.assertEqual(sans.other, ())
+
+    def test_ipv6(self):
+        decision = self.check([
+            x509.DNSName('master-01'),
+            x509.IPAddress(ipaddress.ip_address('fd00::1')),
+        ])
+        self.assertTrue(decision.approve, decision.message)
+        decision = self.check([
+            x509.IPAddress(ipaddress.ip_address('fd00::2')),
+        ])
+        self.assertFalse(decision.approve)
+        self.assertIn('SAN IP Address:fd00::2 not allowed', decision.message)
+
+    def test_name_with_separator(self):
+        decision = self.check([x509.DNSName('master, 01')])
+        self.assertTrue(decision.approve, decision.message)
+        decision = self.check([x509.DNSName('master-01, DNS:evil')])
+        self.assertFalse(decision.approve)
+
+    def test_unexpected_type(self):
+        decision = self.check([
+            x509.DNSName('master-01'),
+            x509.RFC822Name('root@master-01'),
+        ])
+        self.assertFalse(decision.approve)
+        self.assertEqual(decision.reason, oca.Reason.UNEXPECTED_SAN)
+        self.assertRegex(decision.message, '.*unexpected SAN email:root@master-01')  # noqa E501
+
+    def test_malformed(self):
+        # A 3 byte IP address
+        csr = copy.deepcopy(CSR_VALID)
+        csr.spec.request = encode_extensions('system:node:master-01', [
+            (b'subjectAltName', b'DER:30058703010203'),
+        ])
+        decision = oca.check_approve_csr(csr, oca.parse_csr(csr), self.spec)
+        self.assertFalse(decision.approve)
+        self.assertEqual(decision.reason, oca.Reason.MALFORMED_SAN)
+
+    def test_unsupported_type(self):
+        # An empty x400Address, which cryptography does not decode
+        csr = copy.deepcopy(CSR_VALID)
+        csr.spec.request = encode_extensions('system:node:master-01', [
+            (b'subjectAltName', b'DER:3002a300'),
+        ])
+        decision = oca.check_approve_csr(csr, oca.parse_csr(csr), self.spec)
+        self.assertFalse(decision.approve)
+        self.assertEqual(decision.reason, oca.Reason.MALFORMED_SAN)
+
+    def test_unknown_type(self):
+        class FutureName(x509.GeneralName):
+            value = 'future'
+        csr_info = mock.Mock()
+        csr_info.to_cryptography.return_value.extensions \
+            .get_extension_for_class.return_value.value = [
+                x509.DNSName('master-01'), FutureName()]
+        sans = oca.extract_sans(csr_info)
+        self.assertEqual(sans.dns, ('master-01',))
+        self.assertEqual(sans.other, ('FutureName:<unsupported>',))
+
+    def test_duplicate_san_extension(self):
+        # Only the first extension names the node, the second one must
+        # not be approved along with it
+        csr = copy.deepcopy(CSR_VALID)
+        csr.spec.request = encode_extensions('system:node:master-01', [
+            (b'subjectAltName', b'DNS:master-01'),
+            (b'subjectAltName', b'DNS:kubernetes.default,IP:10.0.0.1'),
+        ])
+        decision = oca.check_approve_csr(csr, oca.parse_csr(csr), self.spec)
+        self.assertFalse(decision.approve)
+        self.assertEqual(decision.reason, oca.Reason.DUPLICATE_EXTENSION)
+        self.assertEqual(decision.message, 'Not approving, X509v3 extension 2.5.29.17 present more than once')  # noqa E501
+
+    def test_duplicate_extension(self):
+        csr = copy.deepcopy(CSR_VALID)
+        csr.spec.request = encode_extensions('system:node:master-01', [
+            (b'subjectAltName', b'DNS:master-01'),
+            (b'keyUsage', b'digitalSignature'),
+            (b'keyUsage', b'keyCertSign'),
+        ])
+        decision = oca.check_approve_csr(csr, oca.parse_csr(csr), self.spec)
+        self.assertEqual(decision.reason, oca.Reason.DUPLICATE_EXTENSION)
+
+
+def bootstrap_csr(cn, names=None):
+    csr = copy.deepcopy(CSR_VALID)
+    csr.spec.username = oca.NODE_BOOTSTRAPPER_USERNAME
+    csr.spec.groups = list(oca.NODE_BOOTSTRAPPER_GROUPS)
+    csr.spec.usages = list(oca.CLIENT_USAGES)
+    csr.spec.request = encode_request(cn, names)
+    return csr
+
+
+class CheckBootstrapCsr(unittest.TestCase):
+
+    def setUp(self):
+        self.joined = set()
+        self.spec = oca.compile_node_csr_spec(
+            yaml.safe_load(NODE_CSR_SPEC), approve_bootstrap=True,
+            node_exists=self.joined.__contains__)
+
+    def test_approve(self):
+        csr = bootstrap_csr('system:node:worker-01')
+        decision = oca.decide_csr(csr, self.spec)
+        self.assertEqual(decision.stage, 'approved')
+        self.assertTrue(decision.approve)
+        self.assertRegex(decision.message, 'client CSR of node worker-01')
+
+    def test_disabled(self):
+        spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        csr = bootstrap_csr('system:node:worker-01')
+        self.assertEqual(oca.decide_csr(csr, spec).stage, 'username')
+
+    def test_unknown_node(self):
+        csr = bootstrap_csr('system:node:worker-02')
+        decision = oca.decide_csr(csr, self.spec)
+        self.assertEqual(decision.stage, 'x509')
+        self.assertEqual(decision.reason, oca.Reason.UNKNOWN_NODE)
+        self.assertRegex(decision.message, '.*node worker-02 not present in spec')  # noqa E501
+
+    def test_other_shard(self):
+        spec = oca.NodeCsrSpec({}, True, self.joined.__contains__,
+                               ['worker-01'])
+        csr = bootstrap_csr('system:node:worker-01')
+        decision = oca.decide_csr(csr, spec)
+        self.assertEqual(decision.stage, 'x509')
+        self.assertEqual(decision.reason, oca.Reason.OTHER_SHARD)
+        self.assertRegex(decision.message, '.*node worker-01 belongs to the shard of another replica')  # noqa E501
+
+    def test_not_a_node(self):
+        csr = bootstrap_csr('admin')
+        decision = oca.decide_csr(csr, self.spec)
+        self.assertEqual(decision.stage, 'x509')
+        self.assertEqual(decision.reason, oca.Reason.CN_NOT_A_NODE)
+        self.assertRegex(decision.message, '.*subject CN \\(admin\\) does not match.*')  # noqa E501
+
+    def test_sans(self):
+        csr = bootstrap_csr('system:node:worker-01',
+                            [x509.DNSName('worker-01')])
+        decision = oca.decide_csr(csr, self.spec)
+        self.assertEqual(decision.stage, 'x509')
+        self.assertRegex(decision.message, '.*unexpected SANs in client CSR.*')
+
+    def test_duplicate_san_extension(self):
+        csr = bootstrap_csr('system:node:worker-01')
+        csr.spec.request = encode_extensions('system:node:worker-01', [
+            (b'subjectAltName', b'DNS:worker-01'),
+            (b'subjectAltName', b'DNS:worker-01'),
+        ])
+        decision = oca.decide_csr(csr, self.spec)
+        self.assertFalse(decision.approve)
+        self.assertEqual(decision.reason, oca.Reason.DUPLICATE_EXTENSION)
+
+    def test_node_exists(self):
+        self.joined.add('worker-01')
+        csr = bootstrap_csr('system:node:worker-01')
+        decision = oca.decide_csr(csr, self.spec)
+        self.assertEqual(decision.stage, 'x509')
+        self.assertFalse(decision.approve)
+        self.assertEqual(decision.reason, oca.Reason.NODE_EXISTS)
+        self.assertRegex(decision.message, '.*node worker-01 already joined')
+
+    def test_node_lookup_required(self):
+        with self.assertRaises(ValueError):
+            oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC),
+                                      approve_bootstrap=True)
+
+    def test_api_node_exists(self):
+        api = mock.Mock()
+        node_exists = oca.api_node_exists(api)
+        self.assertTrue(node_exists('worker-01'))
+        api.read_node.assert_called_with('worker-01')
+        api.read_node.side_effect = ApiException(status=404)
+        self.assertFalse(node_exists('worker-01'))
+        # Client CSRs are not approved while in doubt
+        api.read_node.side_effect = ApiException(status=403)
+        with self.assertRaises(ApiException):
+            node_exists('worker-01')
+        spec = oca.NodeCsrSpec(self.spec, True, node_exists)
+        csr = bootstrap_csr('system:node:worker-01')
+        self.assertFalse(oca.evaluate_csr(csr, spec))
+
+    def test_serving_usages(self):
+        csr = bootstrap_csr('system:node:worker-01')
+        csr.spec.usages = list(oca.SERVING_USAGES)
+        self.assertEqual(oca.decide_csr(csr, self.spec).stage, 'usages')
+
+    def test_groups(self):
+        csr = bootstrap_csr('system:node:worker-01')
+        csr.spec.groups = list(oca.NODE_GROUPS)
+        self.assertEqual(oca.decide_csr(csr, self.spec).stage, 'groups')
+
+    def test_selector_keeps_bootstrap_csrs(self):
+        selector = oca.CsrSelector(node_csr_spec=self.spec,
+                                   drop_unknown_nodes=True)
+        self.assertTrue(selector.select(bootstrap_csr('system:node:x')))
+
+
+class CheckDecision(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+
+    def test_messages(self):
+        decision = oca.decide_csr(CSR_VALID, self.spec)
+        self.assertEqual(decision.reason, oca.Reason.APPROVED)
+        self.assertEqual(str(decision), 'Marking CSR for approval: O = system:nodes, CN = system:node:master-01')  # noqa E501
+        decision = oca.decide_csr(CSR_WRONG_CN, self.spec)
+        self.assertEqual(str(decision), 'Not approving, subject CN (system:node:master-02) does not match username system:node:master-01')  # noqa E501
+
+    def test_every_reason_has_a_message(self):
+        self.assertEqual(set(oca.MESSAGES), set(oca.Reason))
+
+    def test_pickle(self):
+        # Decisions are sent back from DecisionPool workers
+        decision = oca.decide_csr(CSR_VALID, self.spec)
+        self.assertEqual(pickle.loads(pickle.dumps(decision)), decision)
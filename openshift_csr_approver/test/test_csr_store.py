@@ -0,0 +1,159 @@
+import copy
+import json
+import unittest
+import unittest.mock as mock
+
+import yaml
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver import store as csr_store
+from openshift_csr_approver.cache import CsrCache
+from openshift_csr_approver.test.test_check_approve_csr import bootstrap_csr
+from openshift_csr_approver.test.test_iterate_csrs import REQUESTS, \
+    NODE_CSR_SPEC
+
+
+SPEC_WITHOUT_WORKER = '''
+---
+master-01:
+  names:
+    - master-01
+    - master-01.os.example.com
+  ips:
+    - 10.42.0.1
+    - 192.168.42.1
+'''
+
+
+class TestDiffNodeCsrSpecs(unittest.TestCase):
+
+    def test_diff(self):
+        old = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        new = oca.compile_node_csr_spec({
+            'master-01': {'names': ['master-01'], 'ips': ['10.42.0.1']},
+            'infra-01': {'names': ['infra-01'], 'ips': ['10.42.0.21']},
+        })
+        diff = oca.diff_node_csr_specs(old, new)
+        self.assertEqual(diff.added, {'infra-01'})
+        self.assertEqual(diff.removed, {'worker-01'})
+        self.assertEqual(diff.changed, {'master-01'})
+        self.assertEqual(diff.affected, {'infra-01', 'worker-01', 'master-01'})
+
+    def test_diff_unchanged(self):
+        old = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        new = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        self.assertEqual(oca.diff_node_csr_specs(old, new).affected, set())
+
+
+def names(csrs):
+    return sorted([csr.metadata.name for csr in csrs])
+
+
+class TestCsrStore(unittest.TestCase):
+
+    def setUp(self):
+        self.csrs = copy.deepcopy(REQUESTS.items)
+        self.store = csr_store.CsrStore()
+        spec = oca.compile_node_csr_spec(yaml.safe_load(SPEC_WITHOUT_WORKER))
+        list(oca.iterate_csrs(self.csrs, spec, store=self.store))
+
+    def test_states(self):
+        self.assertEqual(len(self.store), len(self.csrs))
+        self.assertEqual(self.store.counts(), {
+            'pending': 1,
+            'approved': 1,
+            'denied': 1,
+            'rejected': 3,
+        })
+        self.assertEqual(names(self.store.in_state('pending')),
+                         ['csr-valid'])
+        self.assertEqual(names(self.store.in_state('denied')),
+                         ['csr-denied'])
+
+    def test_for_node(self):
+        # Approved and denied CSRs are not undecided
+        self.assertEqual(names(self.store.for_node('worker-01')),
+                         ['csr-valid-worker'])
+        self.assertEqual(names(self.store.for_node('master-01')),
+                         ['csr-valid', 'csr-wrong-cn', 'csr-wrong-usages'])
+        self.assertEqual(
+            names(self.store.for_node('master-01', [csr_store.APPROVED])),
+            ['csr-approved'])
+        self.assertEqual(self.store.for_node('infra-01'), [])
+
+    def test_update_moves_state(self):
+        csr = self.csrs[0]
+        self.store.update(csr, 'master-01', csr_store.APPROVED)
+        self.assertEqual(self.store.get(csr.metadata.uid).state, 'approved')
+        self.assertEqual(self.store.counts()['pending'], 0)
+        self.assertEqual(self.store.counts()['approved'], 2)
+
+    def test_retain(self):
+        self.store.retain([self.csrs[0].metadata.uid])
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.for_node('worker-01'), [])
+        self.assertEqual(self.store.counts()['rejected'], 0)
+
+    def test_remove(self):
+        uid = self.csrs[-1].metadata.uid
+        self.store.remove(uid)
+        self.store.remove(uid)
+        self.assertNotIn(uid, self.store)
+        self.assertEqual(self.store.for_node('worker-01'), [])
+
+    def test_debug_route(self):
+        content_type, body = self.store.debug_route()
+        self.assertEqual(content_type, 'application/json')
+        dump = json.loads(body)
+        self.assertEqual(dump['counts']['rejected'], 3)
+        self.assertEqual(dump['csrs'][-1], {
+            'name': 'csr-valid-worker',
+            'uid': self.csrs[-1].metadata.uid,
+            'node': 'worker-01',
+            'state': 'rejected',
+            'reason': 'Not approving, node worker-01 not present in spec',
+        })
+
+    def test_reevaluate_affected_nodes(self):
+        new = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        old = oca.compile_node_csr_spec(yaml.safe_load(SPEC_WITHOUT_WORKER))
+        diff = oca.diff_node_csr_specs(old, new)
+        self.assertEqual(diff.affected, {'worker-01'})
+        with mock.patch.object(oca.k8s, 'CertificatesV1beta1Api') as api, \
+                mock.patch.object(oca, 'parse_csr',
+                                  wraps=oca.parse_csr) as parse_csr:
+            oca.reevaluate_csrs(mock.Mock(), new, self.store, diff.affected)
+        approve = api.return_value.replace_certificate_signing_request_approval  # noqa E501
+        self.assertEqual([c[0][0] for c in approve.call_args_list],
+                         ['csr-valid-worker'])
+        # CSRs of unchanged nodes are not evaluated again
+        self.assertEqual(parse_csr.call_count, 1)
+        entry = self.store.get(self.csrs[-1].metadata.uid)
+        self.assertEqual(entry.state, csr_store.PENDING)
+
+    def test_reevaluate_client_csr_of_added_node(self):
+        # Client CSRs are indexed by the node named in their subject
+        old = oca.compile_node_csr_spec(yaml.safe_load(SPEC_WITHOUT_WORKER),
+                                        approve_bootstrap=True,
+                                        node_exists=lambda nodename: False)
+        new = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC),
+                                        approve_bootstrap=True,
+                                        node_exists=lambda nodename: False)
+        csr = bootstrap_csr('system:node:worker-01')
+        csr.metadata.name = 'csr-client-worker'
+        csr.metadata.uid = 'c1e6f1d2-5c1a-4f57-9a43-0b2b8e1f4c11'
+        csr.metadata.resource_version = '1'
+        cache = CsrCache()
+        self.assertFalse(oca.evaluate_csr(csr, old, cache=cache,
+                                          store=self.store))
+        self.assertEqual(self.store.get(csr.metadata.uid).nodename,
+                         'worker-01')
+        diff = oca.diff_node_csr_specs(old, new)
+        with mock.patch.object(oca.k8s, 'CertificatesV1beta1Api') as api:
+            oca.reevaluate_csrs(mock.Mock(), new, self.store, diff.affected,
+                                cache)
+        approve = api.return_value.replace_certificate_signing_request_approval  # noqa E501
+        self.assertIn(csr.metadata.name,
+                      [c[0][0] for c in approve.call_args_list])
+        self.assertEqual(self.store.get(csr.metadata.uid).state,
+                         csr_store.PENDING)
@@ -0,0 +1,84 @@
+import base64
+import copy
+import pickle
+import unittest
+
+from collections import Counter
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver import benchmark
+from openshift_csr_approver.cache import CsrCache
+
+
+MIX = {'approved': 1, 'valid': 3, 'bad-san': 1, 'unknown-node': 1}
+
+LOGGER = 'openshift-csr-approver'
+
+
+class TestDecisionPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Starting the pool's processes dominates, so it is shared
+        cls.decider = oca.DecisionPool(2, min_batch=10, batch_size=100)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.decider.close()
+
+    def setUp(self):
+        raw_spec = benchmark.generate_spec(10)
+        self.spec = oca.compile_node_csr_spec(raw_spec)
+        self.csrs = benchmark.CsrGenerator(raw_spec).generate(150, MIX)
+        # A CSR whose request can't be parsed
+        valid = [
+            csr for csr in self.csrs
+            if oca.decide_csr(csr, self.spec).stage == 'approved'
+        ]
+        broken = copy.deepcopy(valid[0])
+        broken.metadata.name = 'csr-broken'
+        broken.metadata.uid = 'broken'
+        broken.spec.request = base64.b64encode(b'garbage').decode()
+        self.csrs.insert(50, broken)
+
+    def evaluate(self, decider, cache=None):
+        stats = Counter()
+        with self.assertLogs(LOGGER, 'DEBUG') as cm:
+            approved = list(oca.iterate_csrs(self.csrs, self.spec, stats,
+                                             cache, decider=decider))
+        messages = [record.getMessage() for record in cm.records]
+        return [csr.metadata.name for csr in approved], stats, messages
+
+    def test_same_as_serial(self):
+        serial = self.evaluate(None)
+        parallel = self.evaluate(self.decider)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(serial[1]['error'], 1)
+        self.assertGreater(self.decider.parallel, 0)
+
+    def test_cached_csrs_are_not_checked(self):
+        cache = CsrCache(1000)
+        self.evaluate(None, cache)
+        # Only the broken CSR is left to check, errors are not cached
+        decider = oca.DecisionPool(2, min_batch=2)
+        try:
+            self.evaluate(decider, cache)
+            self.assertEqual(decider.serial, 1)
+            self.assertEqual(decider.parallel, 0)
+            self.assertIsNone(decider._executor)
+        finally:
+            decider.close()
+
+    def test_small_batches_are_checked_serially(self):
+        decider = oca.DecisionPool(2, min_batch=1000)
+        try:
+            self.assertEqual(self.evaluate(decider), self.evaluate(None))
+            self.assertEqual(decider.parallel, 0)
+            self.assertGreater(decider.serial, 0)
+            self.assertIsNone(decider._executor)
+        finally:
+            decider.close()
+
+    def test_pickle_node_spec(self):
+        node_spec = next(iter(self.spec.values()))
+        self.assertEqual(pickle.loads(pickle.dumps(node_spec)), node_spec)
@@ -0,0 +1,221 @@
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock as mock
+from datetime import datetime, timezone
+
+import yaml
+import kubernetes.client as k8s
+from kubernetes.client.rest import ApiException
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver import benchmark
+from openshift_csr_approver.election import FakeLeaseStore, Lease, \
+    LeaseConflict, LeaderElector, ShardMembership, KubernetesLeaseStore, \
+    format_micro_time, keep_renewing, shard_owner
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLeaderElector(unittest.TestCase):
+
+    def setUp(self):
+        self.store = FakeLeaseStore()
+        self.clock = Clock()
+        self.a = LeaderElector(self.store, 'lease', 'a', 15, self.clock)
+        self.b = LeaderElector(self.store, 'lease', 'b', 15, self.clock)
+
+    def test_single_leader(self):
+        self.assertTrue(self.a.try_acquire_or_renew())
+        self.assertFalse(self.b.try_acquire_or_renew())
+        self.clock.now = 10
+        self.assertTrue(self.a.try_acquire_or_renew())
+        self.assertFalse(self.b.try_acquire_or_renew())
+        self.assertEqual(self.store.get('lease').holder, 'a')
+
+    def test_take_over_expired_lease(self):
+        self.assertTrue(self.a.try_acquire_or_renew())
+        self.assertFalse(self.b.try_acquire_or_renew())
+        # a stopped renewing
+        self.clock.now = 15
+        self.assertTrue(self.b.try_acquire_or_renew())
+        lease = self.store.get('lease')
+        self.assertEqual((lease.holder, lease.transitions), ('b', 1))
+        self.assertFalse(self.a.try_acquire_or_renew())
+        self.assertFalse(self.a.is_leader)
+
+    def test_release(self):
+        self.assertTrue(self.a.try_acquire_or_renew())
+        self.a.release()
+        self.assertTrue(self.b.try_acquire_or_renew())
+
+    def test_conflict(self):
+        self.assertTrue(self.a.try_acquire_or_renew())
+        lease = self.store.get('lease')
+        self.assertTrue(self.a.try_acquire_or_renew())
+        with self.assertRaises(LeaseConflict):
+            self.store.update(lease)
+
+    def test_acquire_without_waiting(self):
+        self.assertTrue(self.a.acquire(0, wait=False))
+        self.assertFalse(self.b.acquire(0, wait=False))
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.store = FakeLeaseStore()
+        self.clock = Clock()
+        self.members = {
+            identity: ShardMembership(self.store, 'approver-', identity, 15,
+                                      self.clock)
+            for identity in ['a', 'b', 'c']
+        }
+        for membership in self.members.values():
+            membership.renew()
+
+    def test_members(self):
+        self.assertEqual(self.members['a'].members(), ['a', 'b', 'c'])
+        # c stopped renewing
+        self.clock.now = 10
+        self.members['a'].renew()
+        self.members['b'].renew()
+        self.assertEqual(self.members['a'].members(), ['a', 'b', 'c'])
+        self.clock.now = 20
+        self.assertEqual(self.members['a'].members(), ['a', 'b'])
+        self.members['b'].release()
+        self.assertEqual(self.members['a'].members(), ['a'])
+
+    def test_expired_leases_are_deleted(self):
+        self.members['a'].members()
+        # c is gone for good
+        self.clock.now = 10
+        self.members['a'].renew()
+        self.members['b'].renew()
+        self.members['a'].members()
+        self.clock.now = 20
+        self.assertEqual(self.members['a'].members(), ['a', 'b'])
+        self.assertIsNone(self.store.get('approver-c'))
+        # A replica starting later does not count it as a member
+        joined = ShardMembership(self.store, 'approver-', 'd', 15,
+                                 self.clock)
+        joined.renew()
+        self.assertEqual(joined.members(), ['a', 'b', 'd'])
+
+    def test_renewed_lease_is_not_deleted(self):
+        self.members['a'].members()
+        self.clock.now = 20
+        # c renews after a saw its lease expire, but before a deletes it
+        stale = self.store.get('approver-c')
+        self.members['b'].renew()
+        self.members['c'].renew()
+        with self.assertRaises(LeaseConflict):
+            self.store.delete('approver-c', stale.version)
+        self.assertEqual(self.members['a'].members(), ['a', 'b', 'c'])
+        self.assertIsNotNone(self.store.get('approver-c'))
+
+    def test_shard_owner(self):
+        nodes = [benchmark.node_name(i) for i in range(300)]
+        owners = {node: shard_owner(node, ['a', 'b', 'c']) for node in nodes}
+        self.assertEqual(set(owners.values()), {'a', 'b', 'c'})
+        # Only the nodes of the member that left move
+        for node in nodes:
+            owner = shard_owner(node, ['a', 'c'])
+            if owners[node] != 'b':
+                self.assertEqual(owner, owners[node])
+
+    def test_shard_node_csr_spec(self):
+        spec = oca.compile_node_csr_spec(benchmark.generate_spec(50))
+        shard = oca.shard_node_csr_spec(spec, ['a', 'b', 'c'], 'a')
+        self.assertEqual(set(shard) | shard.other_shards, set(spec))
+        self.assertTrue(shard.other_shards.isdisjoint(shard))
+        csr = k8s.V1beta1CertificateSigningRequest(
+            metadata=k8s.V1ObjectMeta(name='csr-other'),
+            spec=k8s.V1beta1CertificateSigningRequestSpec(
+                username=f'system:node:{min(shard.other_shards)}',
+                groups=list(oca.NODE_GROUPS),
+                usages=list(oca.SERVING_USAGES), request=''),
+            status=k8s.V1beta1CertificateSigningRequestStatus())
+        decision = oca.decide_csr(csr, shard)
+        self.assertEqual(decision.stage, 'node')
+        self.assertEqual(decision.reason, oca.Reason.OTHER_SHARD)
+
+    def test_spec_watcher(self):
+        spec = benchmark.generate_spec(50)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'spec.yaml')
+            with open(path, 'w') as f:
+                yaml.safe_dump(spec, f)
+            watchers = {
+                identity: oca.SpecWatcher(path, membership=membership)
+                for identity, membership in self.members.items()
+            }
+            shards = [set(watcher.spec) for watcher in watchers.values()]
+            self.assertEqual(set.union(*shards), set(spec))
+            self.assertEqual(sum([len(shard) for shard in shards]), 50)
+            self.assertFalse(watchers['a'].poll())
+            # c left
+            self.members['c'].release()
+            self.assertTrue(watchers['a'].poll())
+            self.assertTrue(watchers['b'].poll())
+            self.assertEqual(set(watchers['a'].spec) | set(watchers['b'].spec),
+                             set(spec))
+
+
+class TestKeepRenewing(unittest.TestCase):
+
+    def test_lost(self):
+        lost = threading.Event()
+        stop = keep_renewing(lambda: False, 0.01, 0.05, lost.set)
+        self.assertTrue(lost.wait(5))
+        stop.set()
+
+
+class TestKubernetesLeaseStore(unittest.TestCase):
+
+    def setUp(self):
+        self.api = mock.Mock(spec=k8s.CoordinationV1Api)
+        self.store = KubernetesLeaseStore(self.api, 'csr-approver')
+
+    def test_micro_time(self):
+        value = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(format_micro_time(value),
+                         '2020-01-01T00:00:00.000000Z')
+
+    def test_update(self):
+        self.api.replace_namespaced_lease.return_value = k8s.V1Lease(
+            metadata=k8s.V1ObjectMeta(name='lease', resource_version='2'),
+            spec=k8s.V1LeaseSpec(holder_identity='a',
+                                 lease_duration_seconds=15))
+        now = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        lease = self.store.update(Lease('lease', 'a', 15, now, now, 0, '1'))
+        self.assertEqual(lease.version, '2')
+        name, namespace, body = self.api.replace_namespaced_lease.call_args[0]
+        self.assertEqual((name, namespace), ('lease', 'csr-approver'))
+        self.assertEqual(body['metadata']['resourceVersion'], '1')
+        self.assertEqual(body['spec']['renewTime'],
+                         '2020-01-01T00:00:00.000000Z')
+
+    def test_conflict(self):
+        self.api.create_namespaced_lease.side_effect = ApiException(409)
+        with self.assertRaises(LeaseConflict):
+            self.store.create(Lease('lease', 'a', 15))
+
+    def test_delete_precondition(self):
+        self.api.delete_namespaced_lease.side_effect = ApiException(409)
+        with self.assertRaises(LeaseConflict):
+            self.store.delete('lease', '1')
+        body = self.api.delete_namespaced_lease.call_args[1]['body']
+        self.assertEqual(body.preconditions.resource_version, '1')
+
+    def test_not_found(self):
+        self.api.read_namespaced_lease.side_effect = ApiException(404)
+        self.assertIsNone(self.store.get('lease'))
@@ -0,0 +1,206 @@
+import unittest
+import unittest.mock as mock
+
+from typing import Optional
+
+import kubernetes.client as k8s
+from kubernetes.client.rest import ApiException
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver import benchmark
+from openshift_csr_approver.cache import CsrCache
+from openshift_csr_approver.fakeapi import FakeApiServer, Faults
+
+
+MIX = {'approved': 2, 'valid': 2, 'bad-san': 1, 'unknown-node': 1}
+
+# Stages of the CSRs that end up approved
+APPROVED = ['approved', 'conditions']
+
+
+class FakeApiTestCase(unittest.TestCase):
+
+    faults: Optional[Faults] = None
+    history = 1000
+
+    def setUp(self):
+        raw_spec = benchmark.generate_spec(10)
+        self.spec = oca.compile_node_csr_spec(raw_spec)
+        self.generator = benchmark.CsrGenerator(raw_spec)
+        self.server = FakeApiServer(faults=self.faults, history=self.history)
+        self.server.start()
+        config = k8s.Configuration()
+        config.host = self.server.url
+        self.client = oca.PooledApiClient(config, (5, 5))
+        self.api = k8s.CertificatesV1beta1Api(self.client)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def approved(self):
+        return sorted([
+            csr['metadata']['name'] for csr in self.server.state.all()
+            if any([c['type'] == 'Approved'
+                    for c in csr['status'].get('conditions') or []])
+        ])
+
+
+class TestFakeApi(FakeApiTestCase):
+
+    def test_run_csr_approval(self):
+        csrs = self.generator.generate(200, MIX)
+        self.server.state.add_all(csrs)
+        expected = sorted([
+            csr.metadata.name for csr in csrs
+            if oca.decide_csr(csr, self.spec).stage in APPROVED
+        ])
+        rv = oca.run_csr_approval(self.client, self.spec, page_size=50,
+                                  concurrency=4)
+        self.assertEqual(rv, '200')
+        self.assertEqual(self.server.requests['list'], 4)
+        self.assertEqual(self.approved(), expected)
+
+    def test_run_csr_approval_raw(self):
+        csrs = self.generator.generate(100, MIX)
+        self.server.state.add_all(csrs)
+        rv = oca.run_csr_approval(self.client, self.spec, page_size=30,
+                                  concurrency=2, raw=True)
+        self.assertEqual(rv, '100')
+        self.assertEqual(self.approved(), sorted([
+            csr.metadata.name for csr in csrs
+            if oca.decide_csr(csr, self.spec).stage in APPROVED
+        ]))
+
+    def test_get_not_found(self):
+        with self.assertRaises(ApiException) as cm:
+            self.api.read_certificate_signing_request('csr-missing')
+        self.assertEqual(cm.exception.status, 404)
+
+    def test_approve_conflict(self):
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        csr = self.api.read_certificate_signing_request('csr-00000')
+        # Modified since it was read
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        with self.assertRaises(ApiException) as cm:
+            oca.approve_csr(self.api, csr, oca.datetime.utcnow())
+        self.assertEqual(cm.exception.status, 409)
+
+    def test_approve_conflict_retry(self):
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        csr = self.api.read_certificate_signing_request('csr-00000')
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        oca.approve_csr(self.api, csr, oca.datetime.utcnow(), self.spec,
+                        backoff=0)
+        self.assertEqual(self.approved(), ['csr-00000'])
+        self.assertEqual(self.server.requests['approve'], 2)
+        self.assertEqual(self.server.requests['get'], 2)
+
+    def test_approve_conflict_recheck(self):
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        csr = self.api.read_certificate_signing_request('csr-00000')
+        # Denied since it was read
+        self.server.state.add(self.generator.csr(0, 'denied'))
+        with self.assertRaises(oca.ApprovalSkipped):
+            oca.approve_csr(self.api, csr, oca.datetime.utcnow(), self.spec,
+                            backoff=0)
+        self.assertEqual(self.approved(), [])
+
+    def test_approve_leaves_csr_unchanged(self):
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        csr = self.api.read_certificate_signing_request('csr-00000')
+        oca.approve_csr(self.api, csr, oca.datetime.utcnow())
+        # The CSR itself is left as it was
+        self.assertIsNone(csr.status.conditions)
+        stored = self.server.state.get('csr-00000')
+        self.assertEqual(stored['spec']['request'], csr.spec.request)
+        self.assertEqual(self.approved(), ['csr-00000'])
+
+    def test_watch(self):
+        self.server.state.add(self.generator.csr(0, 'approved'))
+        rv = self.server.state.resource_version
+        self.server.state.add(self.generator.csr(1, 'valid'))
+        self.server.state.add(self.generator.csr(2, 'bad-san'))
+        rv = oca.watch_csrs(self.api, self.spec, str(rv), timeout_seconds=1)
+        # The watch also sees the approval of csr-00001
+        self.assertEqual(rv, '4')
+        self.assertEqual(self.approved(), ['csr-00000', 'csr-00001'])
+
+
+class TestFakeApiHistory(FakeApiTestCase):
+
+    history = 2
+
+    def test_watch_gone(self):
+        for i in range(4):
+            self.server.state.add(self.generator.csr(i, 'valid'))
+        self.assertIsNone(
+            oca.watch_csrs(self.api, self.spec, '1', timeout_seconds=1))
+        self.assertEqual(self.approved(), [])
+
+
+class TestFakeApiFaults(FakeApiTestCase):
+
+    faults = Faults(error_rates={500: 1.0})
+
+    def test_injected_errors(self):
+        with self.assertRaises(ApiException) as cm:
+            self.api.list_certificate_signing_request()
+        self.assertEqual(cm.exception.status, 500)
+        self.assertEqual(self.server.errors['list'], 1)
+
+    def test_invalid_fault(self):
+        with self.assertRaises(ValueError):
+            Faults(error_rates={404: 0.5})
+
+
+class TestFakeApiApprovalFaults(FakeApiTestCase):
+
+    def setUp(self):
+        self.faults = Faults(error_rates={500: 1.0}, endpoints=['approve'])
+        super().setUp()
+
+    def test_watch_raises_failed_approval(self):
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        with self.assertRaises(oca.ApprovalFailed):
+            oca.watch_csrs(self.api, self.spec, '0', timeout_seconds=1)
+        self.assertEqual(self.server.errors['approve'], 1)
+        self.assertEqual(self.approved(), [])
+
+    def test_watch_raises_throttled_approval(self):
+        # 429s are retried after Retry-After by the client, until it
+        # gives up
+        self.faults.error_rates = {429: 1.0}
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        with mock.patch.object(oca.time, 'sleep'), \
+                self.assertRaises(oca.ApprovalFailed):
+            oca.watch_csrs(self.api, self.spec, '0', timeout_seconds=1)
+        self.assertGreater(self.server.errors['approve'], 1)
+        self.assertEqual(self.approved(), [])
+
+    def test_run_csr_approval_raises_failed_approvals(self):
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        self.assertEqual(oca.run_csr_approval(self.client, self.spec), '1')
+        with self.assertRaises(oca.ApprovalFailed):
+            oca.run_csr_approval(self.client, self.spec, raise_failed=True)
+
+    def test_watch_mode_retries_with_backoff(self):
+        self.server.state.add(self.generator.csr(0, 'valid'))
+        spec_watcher = mock.Mock(spec=oca.SpecWatcher)
+        spec_watcher.spec = self.spec
+        # Stop once the first watch interval is over
+        spec_watcher.poll.side_effect = KeyboardInterrupt
+        delays = []
+
+        def sleep(delay):
+            delays.append(delay)
+            if len(delays) == 3:
+                self.faults.error_rates.clear()
+
+        with mock.patch.object(oca.time, 'sleep', sleep), \
+                self.assertRaises(KeyboardInterrupt):
+            oca.watch_csr_approval(self.client, spec_watcher,
+                                   cache=CsrCache(), reload_interval=1,
+                                   retry_delay=1.0, max_retry_delay=3.0)
+        self.assertEqual(delays, [1.0, 2.0, 3.0])
+        self.assertEqual(self.server.errors['approve'], 3)
+        self.assertEqual(self.approved(), ['csr-00000'])
@@ -1,9 +1,15 @@
+import copy
 import unittest
+import unittest.mock as mock
+
+from collections import Counter
 
 import yaml
 import kubernetes.client as k8s
+from kubernetes.client.rest import ApiException
 
 from openshift_csr_approver import approver as oca
+from openshift_csr_approver import metrics
 
 
 REQUESTS = k8s.V1beta1CertificateSigningRequestList(
@@ -194,13 +200,172 @@ worker-01:
 class TestIterateCsrs(unittest.TestCase):
 
     def setUp(self):
-        self.spec = yaml.safe_load(NODE_CSR_SPEC)
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
 
     def test_iterate_csrs(self):
-        csrs_to_approve = oca.iterate_csrs(REQUESTS, self.spec)
+        csrs_to_approve = list(oca.iterate_csrs(REQUESTS.items, self.spec))
         # make sure only the correct CSRs are approved
         self.assertEqual(len(csrs_to_approve), 2)
         master = csrs_to_approve[0]
         worker = csrs_to_approve[1]
         self.assertEqual(master.metadata.name, 'csr-valid')
         self.assertEqual(worker.metadata.name, 'csr-valid-worker')
+
+    def test_iterate_csrs_stages(self):
+        stats = Counter()
+        with mock.patch.object(oca, 'parse_csr',
+                               wraps=oca.parse_csr) as parse_csr:
+            list(oca.iterate_csrs(REQUESTS.items, self.spec, stats))
+        # Already processed CSRs and wrong usages are rejected before
+        # the CSR is parsed
+        self.assertEqual(parse_csr.call_count, 3)
+        self.assertEqual(stats, Counter({
+            'conditions': 2,
+            'usages': 1,
+            'x509': 1,
+            'approved': 2,
+        }))
+
+
+class TestCsrLister(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        # Approving modifies the CSRs, keep the fixtures intact
+        self.items = copy.deepcopy(REQUESTS.items)
+        self.calls = []
+        self.api = mock.Mock()
+        self.api.list_certificate_signing_request.side_effect = self.list
+
+    def list(self, limit=None, _continue=None):
+        # Serve REQUESTS.items in pages of `limit` CSRs
+        self.calls.append(('list', limit, _continue))
+        start = int(_continue or 0)
+        end = len(self.items) if limit is None else start + limit
+        more = end < len(self.items)
+        return k8s.V1beta1CertificateSigningRequestList(
+            items=self.items[start:end],
+            metadata=k8s.V1ListMeta(
+                resource_version='1000',
+                _continue=str(end) if more else None
+            )
+        )
+
+    def test_unpaged(self):
+        lister = oca.CsrLister(self.api)
+        self.assertEqual(len(list(lister)), len(REQUESTS.items))
+        self.assertEqual(self.calls, [('list', None, None)])
+        self.assertEqual(lister.resource_version, '1000')
+
+    def test_paged(self):
+        lister = oca.CsrLister(self.api, page_size=4)
+        names = [csr.metadata.name for csr in lister]
+        self.assertEqual(names,
+                         [csr.metadata.name for csr in REQUESTS.items])
+        self.assertEqual(self.calls, [('list', 4, None), ('list', 4, '4')])
+        self.assertEqual(lister.pages, 2)
+
+    def test_expired_continue_token(self):
+        expired = []
+
+        def list_expiring(limit=None, _continue=None):
+            # The first continue token expires
+            if _continue is not None and not expired:
+                expired.append(_continue)
+                self.calls.append(('list', limit, _continue))
+                raise ApiException(status=410, reason='Gone')
+            return self.list(limit, _continue)
+        self.api.list_certificate_signing_request.side_effect \
+            = list_expiring
+        lister = oca.CsrLister(self.api, page_size=4)
+        names = [csr.metadata.name for csr in lister]
+        # The first page is listed again
+        self.assertEqual(names[:4], names[4:8])
+        self.assertEqual(names[4:],
+                         [csr.metadata.name for csr in REQUESTS.items])
+        self.assertEqual(self.calls, [
+            ('list', 4, None),
+            ('list', 4, '4'),
+            ('list', 4, None),
+            ('list', 4, '4'),
+        ])
+
+    def test_gone_without_continue_token(self):
+        self.api.list_certificate_signing_request.side_effect \
+            = ApiException(status=410, reason='Gone')
+        with self.assertRaises(ApiException):
+            list(oca.CsrLister(self.api, page_size=4))
+
+    def test_approve_while_paging(self):
+        def approve(name, body):
+            self.calls.append(('approve', name))
+        self.api.replace_certificate_signing_request_approval.side_effect \
+            = approve
+        with mock.patch.object(oca.k8s, 'CertificatesV1beta1Api',
+                               return_value=self.api):
+            rv = oca.run_csr_approval(k8s.ApiClient(), self.spec,
+                                      page_size=2)
+        self.assertEqual(rv, '1000')
+        # The first page is approved before the next one is requested
+        self.assertEqual(self.calls, [
+            ('list', 2, None),
+            ('approve', 'csr-valid'),
+            ('list', 2, '2'),
+            ('list', 2, '4'),
+            ('approve', 'csr-valid-worker'),
+        ])
+
+
+class TestCsrSelector(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+
+    def test_request_kwargs(self):
+        api = mock.Mock()
+        api.list_certificate_signing_request.return_value \
+            = k8s.V1beta1CertificateSigningRequestList(items=[])
+        selector = oca.CsrSelector('app=node', 'metadata.name!=foo')
+        list(oca.CsrLister(api, 10, selector))
+        api.list_certificate_signing_request.assert_called_once_with(
+            limit=10, label_selector='app=node',
+            field_selector='metadata.name!=foo')
+
+    def test_drop_unknown_nodes(self):
+        spec = oca.compile_node_csr_spec({
+            'master-01': {'names': ['master-01'], 'ips': ['10.42.0.1']}
+        })
+        selector = oca.CsrSelector(node_csr_spec=spec,
+                                   drop_unknown_nodes=True)
+        stats = Counter()
+        with mock.patch.object(oca, 'evaluate_csr',
+                               return_value=False) as evaluate_csr:
+            list(oca.iterate_csrs(REQUESTS.items, spec, stats,
+                                  selector=selector))
+        # Only the CSR of worker-01 is dropped
+        self.assertEqual(evaluate_csr.call_count, 5)
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual((selector.selected, selector.dropped), (5, 1))
+        selector.update(self.spec)
+        self.assertTrue(selector.select(REQUESTS.items[-1]))
+
+    def test_drop_other_shards(self):
+        nodes = {name: self.spec[name] for name in self.spec
+                 if name != 'worker-01'}
+        spec = oca.NodeCsrSpec(nodes, other_shards=['worker-01'])
+        selector = oca.CsrSelector(node_csr_spec=spec)
+        metrics.REGISTRY.enabled = True
+        try:
+            selected = [csr.metadata.name for csr in REQUESTS.items
+                        if selector.select(csr)]
+            dropped = metrics.CSRS_DROPPED.value(reason='other-shard')
+        finally:
+            metrics.REGISTRY.enabled = False
+            metrics.REGISTRY.reset()
+        self.assertNotIn('csr-valid-worker', selected)
+        self.assertEqual((selector.selected, selector.dropped), (5, 1))
+        self.assertEqual(dropped, 1)
+
+    def test_keep_unknown_nodes(self):
+        selector = oca.CsrSelector(node_csr_spec=oca.NodeCsrSpec({}))
+        self.assertTrue(selector.select(REQUESTS.items[0]))
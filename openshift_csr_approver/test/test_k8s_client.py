@@ -0,0 +1,86 @@
+import json
+import socket
+import threading
+import unittest
+import unittest.mock as mock
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import kubernetes.client as k8s
+
+from openshift_csr_approver import approver as oca
+
+
+class CsrListHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps({
+            'apiVersion': 'certificates.k8s.io/v1beta1',
+            'kind': 'CertificateSigningRequestList',
+            'metadata': {'resourceVersion': '1'},
+            'items': []
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBuildK8sClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), CsrListHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        self.endpoint = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def build(self, *argv):
+        args = oca.parse_arguments([
+            '--api-endpoint', self.endpoint,
+            '--service-account', '/nonexistent',
+        ] + list(argv))
+        return oca.build_k8s_client(args)
+
+    def test_connection_reuse(self):
+        client = self.build()
+        api = k8s.CertificatesV1beta1Api(client)
+        for _ in range(3):
+            api.list_certificate_signing_request()
+        self.assertEqual(oca.connection_stats(client), (1, 2))
+
+    def test_pool_options(self):
+        client = self.build('--concurrency', '8', '--keepalive', '30')
+        pool_manager = client.rest_client.pool_manager
+        self.assertEqual(pool_manager.connection_pool_kw['maxsize'], 9)
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                      pool_manager.connection_pool_kw['socket_options'])
+
+    def test_keepalive_disabled(self):
+        client = self.build('--keepalive', '0', '--pool-size', '2')
+        pool_manager = client.rest_client.pool_manager
+        self.assertEqual(pool_manager.connection_pool_kw['maxsize'], 2)
+        self.assertNotIn('socket_options', pool_manager.connection_pool_kw)
+
+    def test_request_timeout(self):
+        client = self.build('--connect-timeout', '3', '--read-timeout', '7')
+        with mock.patch.object(k8s.ApiClient, 'call_api') as call_api:
+            client.call_api('/apis', 'GET', {}, [])
+            self.assertEqual(call_api.call_args[1]['_request_timeout'],
+                             (3, 7))
+            # Watches are not subject to the read timeout
+            client.call_api('/apis', 'GET', {}, [('watch', True)])
+            self.assertNotIn('_request_timeout', call_api.call_args[1])
+            # Explicit timeouts take precedence
+            client.call_api('/apis', 'GET', {}, [], _request_timeout=1)
+            self.assertEqual(call_api.call_args[1]['_request_timeout'], 1)
@@ -0,0 +1,121 @@
+import copy
+import json
+import logging
+import unittest
+import unittest.mock as mock
+
+import yaml
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver.logging import JsonFormatter, PrettyFormatter
+from openshift_csr_approver.store import CsrStore
+from openshift_csr_approver.test.test_iterate_csrs import REQUESTS, \
+    NODE_CSR_SPEC
+
+
+LOGGER = 'openshift-csr-approver'
+
+
+class TestFormatters(unittest.TestCase):
+
+    def record(self, msg, *args, **extra):
+        record = logging.LogRecord(LOGGER, logging.INFO, '/approver.py', 42,
+                                   msg, args, None, 'evaluate_csr')
+        record.__dict__.update(extra)
+        return record
+
+    def test_json(self):
+        record = self.record('%s: %s', 'csr-valid', 'Marking CSR',
+                             csr='csr-valid', stage='approved')
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry['message'], 'csr-valid: Marking CSR')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['location'], '/approver.py:42')
+        self.assertEqual(entry['csr'], 'csr-valid')
+        self.assertEqual(entry['stage'], 'approved')
+        self.assertNotIn('args', entry)
+
+    def test_pretty_single_line(self):
+        line = PrettyFormatter().format(self.record('a\nb'))
+        self.assertTrue(line.endswith(': a b'))
+
+
+class TestDecisionLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        self.csrs = copy.deepcopy(REQUESTS.items)
+
+    def levels(self, store=None):
+        with self.assertLogs(LOGGER, 'DEBUG') as cm:
+            list(oca.iterate_csrs(self.csrs, self.spec, store=store))
+        return {
+            record.csr: record.levelname
+            for record in cm.records if hasattr(record, 'csr')
+        }
+
+    def test_levels(self):
+        self.assertEqual(self.levels(), {
+            'csr-valid': 'INFO',
+            'csr-approved': 'DEBUG',
+            'csr-denied': 'DEBUG',
+            'csr-wrong-cn': 'INFO',
+            'csr-wrong-usages': 'INFO',
+            'csr-valid-worker': 'INFO',
+        })
+
+    def test_repeated_rejections(self):
+        store = CsrStore()
+        self.levels(store)
+        # Rejections were logged in the first pass already
+        levels = self.levels(store)
+        self.assertEqual(levels['csr-wrong-cn'], 'DEBUG')
+        self.assertEqual(levels['csr-valid'], 'INFO')
+
+    def test_other_shard(self):
+        # Rejections of the CSRs of other replicas' nodes are expected
+        nodes = {name: self.spec[name] for name in self.spec
+                 if name != 'worker-01'}
+        self.spec = oca.NodeCsrSpec(nodes, other_shards=['worker-01'])
+        with self.assertLogs(LOGGER, 'DEBUG') as cm:
+            list(oca.iterate_csrs(self.csrs, self.spec))
+        records = {
+            record.csr: record for record in cm.records
+            if hasattr(record, 'csr')
+        }
+        self.assertEqual(records['csr-valid-worker'].levelname, 'DEBUG')
+        self.assertEqual(records['csr-valid-worker'].reason, 'other-shard')
+        self.assertEqual(records['csr-valid'].levelname, 'INFO')
+
+    def test_summary(self):
+        with self.assertLogs(LOGGER, 'INFO') as cm:
+            list(oca.iterate_csrs(self.csrs, self.spec))
+        summary = cm.records[-1]
+        self.assertEqual(summary.csrs, 6)
+        self.assertEqual(summary.outcomes['conditions'], 2)
+
+    def test_reason_codes(self):
+        with self.assertLogs(LOGGER, 'DEBUG') as cm:
+            list(oca.iterate_csrs(self.csrs, self.spec))
+        reasons = {
+            record.csr: record.reason
+            for record in cm.records if hasattr(record, 'csr')
+        }
+        self.assertEqual(reasons['csr-valid'], 'approved')
+        self.assertEqual(reasons['csr-approved'], 'already-processed')
+        self.assertEqual(reasons['csr-wrong-cn'], 'cn-mismatch')
+
+    def test_suppressed_messages_are_not_rendered(self):
+        rendered = []
+        message = oca.Decision.message
+
+        def render(decision):
+            rendered.append(decision.reason)
+            return message.fget(decision)
+        with mock.patch.object(oca.Decision, 'message', property(render)):
+            with self.assertLogs(LOGGER, 'INFO'):
+                list(oca.iterate_csrs(self.csrs, self.spec))
+        # CSRs that were already approved or denied are only logged at
+        # debug level
+        self.assertNotIn(oca.Reason.ALREADY_PROCESSED, rendered)
+        self.assertIn(oca.Reason.APPROVED, rendered)
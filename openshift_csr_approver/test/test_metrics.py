@@ -0,0 +1,89 @@
+import unittest
+import urllib.error
+import urllib.request
+
+import yaml
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver import metrics
+from openshift_csr_approver.metrics.server import MetricsServer
+from openshift_csr_approver.test.test_iterate_csrs import REQUESTS, \
+    NODE_CSR_SPEC
+
+
+class TestMetricTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_disabled(self):
+        counter = metrics.Counter('test_total', 'Test', registry=self.registry)
+        histogram = metrics.Histogram('test_seconds', 'Test',
+                                      registry=self.registry)
+        counter.inc()
+        with histogram.time():
+            pass
+        self.assertEqual(counter.value(), 0)
+        self.assertEqual(histogram.count(), 0)
+
+    def test_exposition(self):
+        self.registry.enabled = True
+        counter = metrics.Counter('test_total', 'A counter',
+                                  registry=self.registry)
+        histogram = metrics.Histogram('test_seconds', 'A histogram',
+                                      buckets=[0.1, 1.0],
+                                      registry=self.registry)
+        counter.inc(reason='foo')
+        counter.inc(2, reason='bar"')
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(self.registry.exposition(), '''\
+# HELP test_total A counter
+# TYPE test_total counter
+test_total{reason="bar\\""} 2.0
+test_total{reason="foo"} 1.0
+# HELP test_seconds A histogram
+# TYPE test_seconds histogram
+test_seconds_bucket{le="0.1"} 1
+test_seconds_bucket{le="1.0"} 2
+test_seconds_bucket{le="+Inf"} 3
+test_seconds_sum 5.55
+test_seconds_count 3
+''')
+
+
+class TestMetricsServer(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        metrics.REGISTRY.reset()
+        self.server = MetricsServer('127.0.0.1', 0)
+        self.server.start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        self.server.stop()
+        metrics.REGISTRY.enabled = False
+        metrics.REGISTRY.reset()
+
+    def scrape(self):
+        with urllib.request.urlopen(self.url + '/metrics') as response:
+            return response.read().decode()
+
+    def test_scrape(self):
+        list(oca.iterate_csrs(REQUESTS.items, self.spec))
+        lines = self.scrape().splitlines()
+        self.assertIn('openshift_csr_approver_csrs_seen_total 6.0', lines)
+        self.assertIn('openshift_csr_approver_csrs_rejected_total{reason="conditions"} 2.0', lines)  # noqa E501
+        self.assertIn('openshift_csr_approver_csrs_rejected_total{reason="usages"} 1.0', lines)  # noqa E501
+        self.assertIn('openshift_csr_approver_csrs_rejected_total{reason="x509"} 1.0', lines)  # noqa E501
+        self.assertIn('openshift_csr_approver_decisions_total{reason="already-processed"} 2.0', lines)  # noqa E501
+        self.assertIn('openshift_csr_approver_decisions_total{reason="cn-mismatch"} 1.0', lines)  # noqa E501
+        self.assertIn('openshift_csr_approver_parse_duration_seconds_count 3', lines)  # noqa E501
+        self.assertIn('openshift_csr_approver_decision_duration_seconds_count 6', lines)  # noqa E501
+
+    def test_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(self.url + '/foo')
+        self.assertEqual(cm.exception.code, 404)
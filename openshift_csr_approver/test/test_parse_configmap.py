@@ -2,6 +2,7 @@ import unittest
 import unittest.mock as mock
 
 from collections import namedtuple
+from ipaddress import ip_address
 
 from openshift_csr_approver import approver as oca
 
@@ -21,41 +22,85 @@ worker-01:
 '''
 
 
+IPV6_SPEC = '''
+---
+master-01:
+  names: [master-01]
+  ips: ["2001:db8::10"]
+'''
+
+
+INVALID_IP_SPEC = '''
+---
+master-01:
+  names: [master-01]
+  ips: [10.42.0.1, master-01]
+'''
+
+
 class ParseConfigmapTest(unittest.TestCase):
 
     def test_parse_valid(self):
         with mock.patch('builtins.open', mock.mock_open(read_data=VALID_SPEC)):
             parsed_spec = oca.parse_node_csr_spec('foo')
 
-        self.assertIsInstance(parsed_spec, dict)
+        self.assertIsInstance(parsed_spec, oca.NodeCsrSpec)
         self.assertEqual(len(parsed_spec), 2)
         self.assertIn('master-01', parsed_spec)
         self.assertIn('worker-01', parsed_spec)
 
-        self.assertIsInstance(parsed_spec['master-01'], dict)
-        self.assertIsInstance(parsed_spec['worker-01'], dict)
-        self.assertIn('names', parsed_spec['master-01'])
-        self.assertIn('ips', parsed_spec['master-01'])
-        self.assertIn('names', parsed_spec['worker-01'])
-        self.assertIn('ips', parsed_spec['worker-01'])
-
-        self.assertIsInstance(parsed_spec['master-01']['names'], list)
-        self.assertIsInstance(parsed_spec['master-01']['ips'], list)
-        self.assertIsInstance(parsed_spec['worker-01']['names'], list)
-        self.assertIsInstance(parsed_spec['worker-01']['ips'], list)
-        self.assertEqual(len(parsed_spec['master-01']['names']), 2)
-        self.assertEqual(len(parsed_spec['master-01']['ips']), 2)
-        self.assertEqual(len(parsed_spec['worker-01']['names']), 2)
-        self.assertEqual(len(parsed_spec['worker-01']['ips']), 2)
-
-        self.assertIn('master-01', parsed_spec['master-01']['names'])
+        self.assertIsInstance(parsed_spec['master-01'], oca.NodeSpec)
+        self.assertIsInstance(parsed_spec['worker-01'], oca.NodeSpec)
+        self.assertEqual(parsed_spec['master-01'].name, 'master-01')
+        self.assertEqual(parsed_spec['worker-01'].name, 'worker-01')
+
+        self.assertIsInstance(parsed_spec['master-01'].names, frozenset)
+        self.assertIsInstance(parsed_spec['master-01'].ips, frozenset)
+        self.assertIsInstance(parsed_spec['worker-01'].names, frozenset)
+        self.assertIsInstance(parsed_spec['worker-01'].ips, frozenset)
+        self.assertEqual(len(parsed_spec['master-01'].names), 2)
+        self.assertEqual(len(parsed_spec['master-01'].ips), 2)
+        self.assertEqual(len(parsed_spec['worker-01'].names), 2)
+        self.assertEqual(len(parsed_spec['worker-01'].ips), 2)
+
+        self.assertIn('master-01', parsed_spec['master-01'].names)
         self.assertIn('master-01.os.example.com',
-                      parsed_spec['master-01']['names'])
-        self.assertIn('10.42.0.1', parsed_spec['master-01']['ips'])
-        self.assertIn('192.168.42.1', parsed_spec['master-01']['ips'])
+                      parsed_spec['master-01'].names)
+        self.assertIn(ip_address('10.42.0.1'), parsed_spec['master-01'].ips)
+        self.assertIn(ip_address('192.168.42.1'),
+                      parsed_spec['master-01'].ips)
 
-        self.assertIn('worker-01', parsed_spec['worker-01']['names'])
+        self.assertIn('worker-01', parsed_spec['worker-01'].names)
         self.assertIn('worker-01.os.example.com',
-                      parsed_spec['worker-01']['names'])
-        self.assertIn('10.42.0.11', parsed_spec['worker-01']['ips'])
-        self.assertIn('192.168.42.11', parsed_spec['worker-01']['ips'])
+                      parsed_spec['worker-01'].names)
+        self.assertIn(ip_address('10.42.0.11'), parsed_spec['worker-01'].ips)
+        self.assertIn(ip_address('192.168.42.11'),
+                      parsed_spec['worker-01'].ips)
+
+    def test_parse_ipv6(self):
+        with mock.patch('builtins.open', mock.mock_open(read_data=IPV6_SPEC)):
+            parsed_spec = oca.parse_node_csr_spec('foo')
+        ips = parsed_spec['master-01'].ips
+        self.assertIn(ip_address('2001:db8:0:0:0:0:0:10'), ips)
+        self.assertIn(ip_address('2001:DB8::10'), ips)
+
+    def test_parse_invalid_ip(self):
+        with mock.patch('builtins.open',
+                        mock.mock_open(read_data=INVALID_IP_SPEC)):
+            with self.assertRaisesRegex(ValueError, 'ips\\[1\\]'):
+                oca.parse_node_csr_spec('foo')
+
+    def test_immutable(self):
+        with mock.patch('builtins.open', mock.mock_open(read_data=VALID_SPEC)):
+            parsed_spec = oca.parse_node_csr_spec('foo')
+        with self.assertRaises(AttributeError):
+            parsed_spec['master-01'].names = frozenset()
+        with self.assertRaises(TypeError):
+            parsed_spec['foo'] = parsed_spec['master-01']
+        # Nor can the attributes of the spec be changed
+        for name in ['_nodes', 'approve_bootstrap', 'node_exists',
+                     'other_shards', 'generation']:
+            with self.assertRaises(AttributeError):
+                setattr(parsed_spec, name, None)
+            with self.assertRaises(AttributeError):
+                delattr(parsed_spec, name)
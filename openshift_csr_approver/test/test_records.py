@@ -0,0 +1,48 @@
+import json
+import unittest
+
+from datetime import datetime, timezone
+
+import yaml
+import kubernetes.client as k8s
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver.records import CsrRecord, parse_csr_list, \
+    parse_timestamp
+from openshift_csr_approver.test.test_iterate_csrs import REQUESTS, \
+    NODE_CSR_SPEC
+
+
+class TestCsrRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        body = k8s.ApiClient().sanitize_for_serialization(REQUESTS)
+        body['metadata'] = {'resourceVersion': '42', 'continue': 'next'}
+        self.data = json.dumps(body).encode()
+
+    def test_parse_csr_list(self):
+        records, resource_version, _continue = parse_csr_list(self.data)
+        self.assertEqual(resource_version, '42')
+        self.assertEqual(_continue, 'next')
+        self.assertEqual([r.metadata.name for r in records],
+                         [csr.metadata.name for csr in REQUESTS.items])
+        self.assertEqual(records[2].status.conditions[0].type, 'Denied')
+        with self.assertRaises(AttributeError):
+            records[0].extra = True
+
+    def test_same_decisions_as_models(self):
+        records, _, _ = parse_csr_list(self.data)
+        for csr, record in zip(REQUESTS.items, records):
+            self.assertIsInstance(record, CsrRecord)
+            expected = oca.decide_csr(csr, self.spec)
+            decision = oca.decide_csr(record, self.spec)
+            self.assertEqual((decision.stage, decision.reason),
+                             (expected.stage, expected.reason))
+
+    def test_parse_timestamp(self):
+        expected = datetime(2020, 1, 1, 12, 0, tzinfo=timezone.utc)
+        self.assertEqual(parse_timestamp('2020-01-01T12:00:00Z'), expected)
+        self.assertEqual(parse_timestamp('2020-01-01T12:00:00+00:00'),
+                         expected)
+        self.assertIsNone(parse_timestamp(None))
@@ -0,0 +1,186 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import unittest
+
+import yaml
+import kubernetes.client as k8s
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver import benchmark
+from openshift_csr_approver import logging as csr_logging
+from openshift_csr_approver import replay
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+MIX = {'approved': 1, 'valid': 3, 'bad-san': 1, 'unknown-node': 1}
+
+
+def dump_csrs(csrs):
+    return k8s.ApiClient().sanitize_for_serialization(
+        k8s.V1beta1CertificateSigningRequestList(items=csrs))
+
+
+class TestReadDump(unittest.TestCase):
+
+    def setUp(self):
+        self.items = [
+            {'metadata': {'name': f'csr-{i}'}, 'spec': {'n': 1.5 * i}}
+            for i in range(20)
+        ]
+
+    def test_chunk_boundaries(self):
+        data = json.dumps({'apiVersion': 'v1', 'items': self.items,
+                           'kind': 'List'}, indent=2)
+        # Every chunk size splits values at other places
+        for chunk_size in [1, 2, 3, 7, 64]:
+            items = list(replay.iter_json(io.StringIO(data), chunk_size))
+            self.assertEqual(items, self.items)
+
+    def test_numbers_at_the_end_of_chunks(self):
+        data = '{"items": [{"n": 12345}, 678]}'
+        for chunk_size in range(1, len(data) + 1):
+            items = list(replay.iter_json(io.StringIO(data), chunk_size))
+            self.assertEqual(items, [{'n': 12345}, 678])
+
+    def test_empty(self):
+        self.assertEqual(list(replay.iter_json(io.StringIO('{"items": []}'))),
+                         [])
+        self.assertEqual(list(replay.iter_json(io.StringIO(' {} '))), [])
+
+    def test_single_csr(self):
+        data = json.dumps(self.items[0])
+        self.assertEqual(list(replay.iter_json(io.StringIO(data), 4)),
+                         [self.items[0]])
+
+    def test_jsonl(self):
+        lines = [json.dumps(item) for item in self.items[:5]]
+        lines.append('')
+        lines.append(json.dumps({'items': self.items[5:]}))
+        items = list(replay.iter_jsonl(io.StringIO('\n'.join(lines))))
+        self.assertEqual(items, self.items)
+
+    def test_malformed(self):
+        for data in ['', '[]', '{"items": [{}, {]}', '{"items": [{} {}]}',
+                     '{"items": [{}']:
+            with self.assertRaises(ValueError):
+                list(replay.iter_json(io.StringIO(data), 4))
+
+    def test_value_too_large(self):
+        stream = replay._JsonStream(io.StringIO('["' + 'a' * 100 + '"]'),
+                                    chunk_size=8, max_value_size=50)
+        with self.assertRaises(ValueError):
+            stream.value()
+
+    def test_memory_is_bounded(self):
+        # The dump is read in chunks, and items are dropped once yielded
+        item = json.dumps({'spec': {'request': 'a' * 1000}})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'csrs.json')
+            with open(path, 'w') as f:
+                f.write('{"items": [')
+                f.write(','.join([item] * 5000))
+                f.write(']}')
+            tracemalloc.start()
+            try:
+                count = sum(1 for _ in replay.read_dump(path,
+                                                        chunk_size=1 << 16))
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(count, 5000)
+        self.assertLess(peak, 1 << 20)
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.raw_spec = benchmark.generate_spec(10)
+        self.spec = oca.compile_node_csr_spec(self.raw_spec)
+        self.csrs = benchmark.CsrGenerator(self.raw_spec).generate(60, MIX)
+        self.body = dump_csrs(self.csrs)
+        # main logs to stderr from then on
+        handler = csr_logging.stdout
+        self.addCleanup(setattr, handler, 'stream', handler.stream)
+
+    def test_same_as_decide_csr(self):
+        decisions = list(replay.replay(self.body['items'], self.spec))
+        expected = [oca.decide_csr(csr, self.spec) for csr in self.csrs]
+        self.assertEqual([(d['stage'], d['code']) for d in decisions],
+                         [(d.stage, d.reason.value) for d in expected])
+        self.assertEqual([d['name'] for d in decisions],
+                         [csr.metadata.name for csr in self.csrs])
+
+    def test_ignore_conditions(self):
+        decisions = replay.replay(self.body['items'], self.spec,
+                                  ignore_conditions=True)
+        self.assertNotIn('conditions', [d['stage'] for d in decisions])
+
+    def test_not_a_csr(self):
+        decisions = list(replay.replay([{'metadata': {'name': 'x'}}],
+                                       self.spec))
+        self.assertEqual(decisions[0]['stage'], 'error')
+        self.assertFalse(decisions[0]['approve'])
+
+    def test_main(self):
+        # Without the first node, its CSRs are no longer approved
+        baseline = dict(self.raw_spec)
+        first = benchmark.node_name(0)
+        spec = {name: ips for name, ips in baseline.items() if name != first}
+        expected = {
+            csr.metadata.name for csr in self.csrs
+            if oca.decide_csr(csr, self.spec).approve
+            if csr.spec.username == f'system:node:{first}'
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = {}
+            for name, content in [('spec.yaml', spec),
+                                  ('baseline.yaml', baseline)]:
+                paths[name] = os.path.join(tmpdir, name)
+                with open(paths[name], 'w') as f:
+                    yaml.safe_dump(content, f)
+            paths['dump'] = os.path.join(tmpdir, 'csrs.json')
+            with open(paths['dump'], 'w') as f:
+                json.dump(self.body, f)
+            output = os.path.join(tmpdir, 'decisions.jsonl')
+            with self.assertLogs('openshift-csr-approver', 'INFO') as cm:
+                replay.main([paths['dump'],
+                             '--config-file', paths['spec.yaml'],
+                             '--baseline-config-file', paths['baseline.yaml'],  # noqa E501
+                             '--changes-only', '--output', output])
+            with open(output) as f:
+                decisions = [json.loads(line) for line in f]
+        self.assertTrue(expected)
+        self.assertEqual({d['name'] for d in decisions}, expected)
+        for decision in decisions:
+            self.assertEqual(decision['stage'], 'node')
+            self.assertTrue(decision['baseline']['approve'])
+        self.assertIn(f'Replayed {len(self.csrs)} CSRs', cm.output[0])
+        self.assertIn(f'{len(expected)} decisions differ', cm.output[1])
+
+    def test_log_is_not_mixed_with_decisions(self):
+        # Run in a fresh interpreter, the log goes to stderr while the
+        # decisions are written to stdout
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spec_path = os.path.join(tmpdir, 'spec.yaml')
+            with open(spec_path, 'w') as f:
+                yaml.safe_dump(self.raw_spec, f)
+            dump_path = os.path.join(tmpdir, 'csrs.json')
+            with open(dump_path, 'w') as f:
+                json.dump(self.body, f)
+            env = dict(os.environ)
+            env['PYTHONPATH'] = ROOT
+            result = subprocess.run(
+                [sys.executable, '-m', 'openshift_csr_approver.replay',
+                 dump_path, '--config-file', spec_path],
+                env=env, check=True, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, universal_newlines=True)
+        decisions = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual(len(decisions), len(self.csrs))
+        self.assertIn(f'Replayed {len(self.csrs)} CSRs', result.stderr)
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from openshift_csr_approver import approver as oca
+
+
+SPEC_V1 = '''
+---
+master-01:
+  names: [master-01]
+  ips: [10.42.0.1]
+'''
+
+
+SPEC_V2 = '''
+---
+master-01:
+  names: [master-01]
+  ips: [10.42.0.1]
+worker-01:
+  names: [worker-01]
+  ips: [10.42.0.11]
+'''
+
+
+class TestSpecWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+        self.version = 0
+        # Mimic the layout of a ConfigMap volume:
+        # spec.yaml -> ..data/spec.yaml, ..data -> ..<version>
+        self.update(SPEC_V1)
+        os.symlink(os.path.join('..data', 'spec.yaml'),
+                   os.path.join(self.dir, 'spec.yaml'))
+        self.watcher = oca.SpecWatcher(os.path.join(self.dir, 'spec.yaml'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def update(self, content):
+        self.version += 1
+        version_dir = f'..{self.version}'
+        os.mkdir(os.path.join(self.dir, version_dir))
+        with open(os.path.join(self.dir, version_dir, 'spec.yaml'), 'w') as f:
+            f.write(content)
+        tmp_link = os.path.join(self.dir, '..data_tmp')
+        os.symlink(version_dir, tmp_link)
+        os.replace(tmp_link, os.path.join(self.dir, '..data'))
+
+    def test_unchanged(self):
+        self.assertFalse(self.watcher.poll())
+        self.assertEqual(list(self.watcher.spec), ['master-01'])
+
+    def test_reload(self):
+        old_spec = self.watcher.spec
+        self.update(SPEC_V2)
+        self.assertTrue(self.watcher.poll())
+        self.assertEqual(list(self.watcher.spec), ['master-01', 'worker-01'])
+        # The old spec is replaced, not modified
+        self.assertEqual(list(old_spec), ['master-01'])
+        self.assertFalse(self.watcher.poll())
+
+    def test_invalid_keeps_old_spec(self):
+        self.update('master-01: [foo]')
+        with self.assertLogs('openshift-csr-approver', 'ERROR'):
+            self.assertFalse(self.watcher.poll())
+        self.assertEqual(list(self.watcher.spec), ['master-01'])
+        # A subsequent valid update is loaded
+        self.update(SPEC_V2)
+        self.assertTrue(self.watcher.poll())
+        self.assertEqual(list(self.watcher.spec), ['master-01', 'worker-01'])
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def run(script):
+    # Imports are cached by the interpreter, so every check runs in a
+    # fresh one
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT
+    return subprocess.run([sys.executable, '-c', script], env=env,
+                          check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout
+
+
+def last_line(script):
+    # The approver logs to stdout as well
+    return run(script).splitlines()[-1].split()
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_approver_defers_imports(self):
+        loaded = last_line(
+            'import sys\n'
+            'import openshift_csr_approver.approver\n'
+            'print("OpenSSL" in sys.modules, "http.server" in sys.modules)\n'
+        )
+        self.assertEqual(loaded, ['False', 'False'])
+
+    def test_decided_csrs_are_not_parsed(self):
+        loaded = last_line(
+            'import sys, copy, yaml\n'
+            'from openshift_csr_approver import approver as oca\n'
+            'from openshift_csr_approver.test.test_iterate_csrs import '
+            'REQUESTS, NODE_CSR_SPEC\n'
+            'spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))\n'  # noqa E501
+            'csrs = [csr for csr in copy.deepcopy(REQUESTS.items)\n'
+            '        if csr.status.conditions]\n'
+            'list(oca.iterate_csrs(csrs, spec))\n'
+            'print(len(csrs), "OpenSSL" in sys.modules)\n'
+        )
+        self.assertEqual(loaded, ['2', 'False'])
+
+    def test_subpackages_do_not_import_kubernetes(self):
+        loaded = last_line(
+            'import sys\n'
+            'import openshift_csr_approver.metrics\n'
+            'import openshift_csr_approver.store\n'
+            'import openshift_csr_approver.records\n'
+            'print("kubernetes" in sys.modules)\n'
+        )
+        self.assertEqual(loaded, ['False'])
+
+    def test_entry_point(self):
+        output = run(
+            'import sys\n'
+            'import openshift_csr_approver\n'
+            'sys.argv = ["openshift-csr-approver", "--help"]\n'
+            'openshift_csr_approver.main()\n'
+        )
+        self.assertIn('--watch', output)
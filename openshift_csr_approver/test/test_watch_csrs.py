@@ -0,0 +1,148 @@
+import copy
+import unittest
+import unittest.mock as mock
+
+import yaml
+import kubernetes.client as k8s
+from kubernetes.client.rest import ApiException
+
+from openshift_csr_approver import approver as oca
+from openshift_csr_approver.store import CsrStore
+from openshift_csr_approver.test.test_iterate_csrs import REQUESTS, \
+    NODE_CSR_SPEC
+
+
+class FakeWatch:
+
+    def __init__(self, events):
+        self.events = events
+        self.kwargs = None
+        self.resource_version = None
+
+    def stream(self, func, **kwargs):
+        self.kwargs = kwargs
+        self.resource_version = kwargs['resource_version']
+        for event in self.events:
+            if isinstance(event, BaseException):
+                raise event
+            if event['type'] != 'ERROR':
+                self.resource_version \
+                    = event['object'].metadata.resource_version
+            yield event
+
+    def stop(self):
+        pass
+
+
+class TestWatchCsrs(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        self.api = mock.Mock()
+
+    def watch(self, events, store=None, **kwargs):
+        fake = FakeWatch(events)
+        with mock.patch.object(oca.k8s_watch, 'Watch', return_value=fake):
+            self.resource_version = oca.watch_csrs(self.api, self.spec, '42',
+                                                   store=store, **kwargs)
+        return fake
+
+    def added(self, csrs):
+        return [
+            {'type': 'ADDED', 'object': csr, 'raw_object': {}}
+            for csr in copy.deepcopy(csrs)
+        ]
+
+    def approved_names(self):
+        return [
+            c[0][0] for c in
+            self.api.replace_certificate_signing_request_approval.call_args_list  # noqa E501
+        ]
+
+    def test_watch_approves_events(self):
+        events = [
+            {'type': 'ADDED', 'object': csr, 'raw_object': {}}
+            for csr in copy.deepcopy(REQUESTS.items)
+        ]
+        for i, event in enumerate(events):
+            event['object'].metadata.resource_version = str(43 + i)
+        fake = self.watch(events)
+        self.assertEqual(fake.kwargs['resource_version'], '42')
+        # Resume from the last event's resource version
+        self.assertEqual(self.resource_version, str(42 + len(events)))
+        self.assertEqual(self.approved_names(),
+                         ['csr-valid', 'csr-valid-worker'])
+
+    def test_watch_approvals_are_rate_limited(self):
+        rate_limiter = mock.Mock(spec=oca.RateLimiter)
+        self.watch(self.added(REQUESTS.items), concurrency=4,
+                   rate_limiter=rate_limiter)
+        self.assertEqual(sorted(self.approved_names()),
+                         ['csr-valid', 'csr-valid-worker'])
+        self.assertEqual(rate_limiter.acquire.call_count, 2)
+
+    def test_watch_raises_failed_approval(self):
+        self.api.replace_certificate_signing_request_approval.side_effect \
+            = ApiException(status=500)
+        with self.assertRaises(oca.ApprovalFailed):
+            self.watch(self.added(REQUESTS.items))
+        # Stopped after the first failed approval
+        self.assertEqual(self.approved_names(), ['csr-valid'])
+
+    def test_watch_ignores_deleted(self):
+        events = [
+            {'type': 'DELETED', 'object': REQUESTS.items[0], 'raw_object': {}}
+        ]
+        self.watch(events)
+        self.assertEqual(self.approved_names(), [])
+
+    def test_watch_updates_store(self):
+        store = CsrStore()
+        csr = copy.deepcopy(REQUESTS.items[3])
+        self.watch([{'type': 'ADDED', 'object': csr, 'raw_object': {}}],
+                   store)
+        self.assertEqual(store.get(csr.metadata.uid).state, 'rejected')
+        # CSRs garbage-collected by the API server are removed
+        self.watch([{'type': 'DELETED', 'object': csr, 'raw_object': {}}],
+                   store)
+        self.assertEqual(len(store), 0)
+
+    def test_watch_gone_event(self):
+        events = [
+            {'type': 'ERROR', 'object': None,
+             'raw_object': {'kind': 'Status', 'code': 410}},
+            {'type': 'ADDED', 'object': REQUESTS.items[0], 'raw_object': {}}
+        ]
+        self.watch(events)
+        # The stream must be abandoned after the 410, so nothing after
+        # it is processed
+        self.assertEqual(self.approved_names(), [])
+        self.assertIsNone(self.resource_version)
+
+    def test_watch_gone_exception(self):
+        self.watch([ApiException(status=410, reason='Gone')])
+        self.assertEqual(self.approved_names(), [])
+        self.assertIsNone(self.resource_version)
+
+    def test_watch_timeout(self):
+        self.watch([])
+        self.assertEqual(self.resource_version, '42')
+
+    def test_watch_other_exception(self):
+        with self.assertRaises(ApiException):
+            self.watch([ApiException(status=500, reason='Error')])
+
+
+class TestRunCsrApproval(unittest.TestCase):
+
+    def test_returns_resource_version(self):
+        spec = oca.compile_node_csr_spec(yaml.safe_load(NODE_CSR_SPEC))
+        csrs = k8s.V1beta1CertificateSigningRequestList(
+            items=[],
+            metadata=k8s.V1ListMeta(resource_version='1234')
+        )
+        with mock.patch.object(oca.k8s, 'CertificatesV1beta1Api') as api:
+            api.return_value.list_certificate_signing_request.return_value \
+                = csrs
+            rv = oca.run_csr_approval(k8s.ApiClient(), spec)
+        self.assertEqual(rv, '1234')